@@ -1,33 +1,111 @@
 import os
 import streamlit as st
-from PyPDF2 import PdfReader 
-from langchain.text_splitter import CharacterTextSplitter
-from langchain.embeddings.openai import OpenAIEmbeddings
-from langchain.vectorstores import FAISS
-from langchain.chains.question_answering import load_qa_chain
-from langchain.chat_models import ChatOpenAI
-import openai
 from dotenv import load_dotenv
 import json
+import time
+import datetime
+import queue
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from extraction import join_pages, chunk_pages
+from engine import ExtractionEngine, OpenAIBackend, EMBEDDING_MODEL, all_chunks
+from clients import get_embeddings, invalid_request_error
+from llm_executor import AsyncLLMExecutor
+from response_cache import ResponseCache
+from prompts import QUERIES
+from streaming import IncrementalDictParser
+from metrics import Tracer, RecentSpansExporter
+from memo import StageMemo
 
 
 
 load_dotenv()
 
+DOC_TYPE_ERRORS = {
+    'Resume': """:red[Error: This file isn't a resume file. Please upload a resume file or choose other options] """,
+    'Bill of loading': """:red[Error: This file isn't a bill of loading file. Please upload a bill of loading file or choose other options] """,
+    'Procurement': """:red[Error: This file isn't a procurement file. Please upload a procurement file or choose other options] """,
+}
+
+FIELD_RENDERERS = {
+    'Resume': 'resume_field',
+    'Bill of loading': 'bill_of_loading_field',
+    'Procurement': 'procurement_field',
+}
+
+# One executor per model for the whole server, so every session shares the same rate limits
+@st.cache_resource
+def get_llm_executor(model, api_key):
+    return AsyncLLMExecutor(OpenAIBackend(model, api_key=api_key, max_retries=0))
+
+@st.cache_resource
+def get_response_cache():
+    return ResponseCache()
+
+# The indexes of the latest pdfs, shared by every session so a rerun or another user asking about
+# the same pdf doesn't load it from disk again
+@st.cache_resource(max_entries=16)
+def get_knowledge_base(cache_key, local_search, _engine, _text):
+    return _engine.build_index(cache_key, _text)
+
+# Large pdfs are indexed in the background while they are read, a rerun or another session
+# uploading the same pdf follows the same ingestion
+@st.cache_resource(max_entries=4)
+def get_ingestion(cache_key, _engine, _pdf_bytes):
+    return _engine.ingest(cache_key, _pdf_bytes)
+
+# The spans of the latest requests of every session, for the performance panel
+@st.cache_resource
+def get_recent_spans():
+    return RecentSpansExporter()
+
+# Also sends the spans to the exporters named in METRICS_EXPORTERS, started once for the whole server
+@st.cache_resource
+def get_tracer():
+    return Tracer.from_env([get_recent_spans()])
+
+# The corpus of every pdf added so far, shared by all sessions
+@st.cache_resource
+def get_corpus(api_key):
+    from corpus import CorpusIndex
+    return CorpusIndex(get_embeddings(EMBEDDING_MODEL, api_key))
+
+# One engine per model and search option for the whole server. It is only built once a pdf is uploaded
+# or the corpus is asked, so the first page is drawn without loading langchain and the OpenAI clients.
+@st.cache_resource
+def get_engine(model, api_key, local_search):
+    if local_search:
+        return ExtractionEngine(get_llm_executor(model, api_key), response_cache=get_response_cache(), retrieval="local", tracer=get_tracer())
+    return ExtractionEngine(
+        get_llm_executor(model, api_key), embeddings=get_embeddings(EMBEDDING_MODEL, api_key), response_cache=get_response_cache(), tracer=get_tracer()
+    )
+
 class PDFChatBot:
     def __init__(self):
         self.pdf = None
-        self.pdf_reader = None
         self.text = ""
-        self.text_splitter = None
+        self.pages = []
+        self.page_offsets = []
         self.embeddings = None
         self.knowledge_base = None
+        self.ingestion = None
+        self.progress_bar = None
         self.query = ""
-        self.llm = None
-        self.chain = None
+        self.engine = None
         self.option = ''
         self.response = ''
+        self.bypass_cache = False
+        self.add_to_corpus = False
+        self.check_doc_type = False
+        self.local_search = False
+        self.show_performance = False
+        self.tracer = None
+        self.memo = None
+        self.result_key = None
+        self.data = {}
+        self.is_doc_type = None
         self.api_key = os.getenv("OPENAI_API_KEY")
+        self.cache_key = None
 
 
     def disable(self, b):
@@ -37,31 +115,45 @@ class PDFChatBot:
         # Sets the UI of the application
         st.set_page_config(page_title="AI PDF Reader: AI Powered PDF data Extraction")
         st.header("AI PDF Reader: AI Powered PDF data Extraction")
-        self.option = st.selectbox('What would you like to upload?', ('Resume', 'Bill of loading', "Ask your pdf", "Procurement"))
+        self.option = st.selectbox('What would you like to upload?', ('Resume', 'Bill of loading', "Ask your pdf", "Procurement", "Ask your corpus"))
         self.model = st.selectbox('Model Options', ("text-davinci-003", "gpt-3.5-turbo"))
+        self.local_search = st.selectbox('Search Options', ("OpenAI embeddings", "Local (offline)"), help="Local search ranks the chunks with TF-IDF and BM25 on this machine, without any embedding call") == "Local (offline)"
         self.pdf = st.file_uploader("Upload a pdf", type="pdf")
-        print(self.api_key)
-        # If a pdf file is uploaded, it will be parsed into a PdfReader lib
-        # The text will be extracted from the pdf and saved in the 'text' variable
-        if self.pdf is not None:
-            self.pdf_reader = PdfReader(self.pdf)
-            self.text = ""
-            for page in self.pdf_reader.pages:
-                self.text += page.extract_text()
-
-            # Split the text inside the pdf into chunks
-            self.text_splitter = CharacterTextSplitter(        
-                separator="\n",
-                chunk_size=1250,
-                chunk_overlap=200,
-                length_function=len
-            )
+        self.bypass_cache = st.checkbox("Bypass response cache", help="Always send the request to the model instead of reusing a previous answer")
+        self.add_to_corpus = st.checkbox("Add uploaded pdfs to the corpus", help="Keep the pdf in the corpus so it can be searched together with the others in 'Ask your corpus'", disabled=self.local_search)
+        self.check_doc_type = st.checkbox("Check the document type first", help="Classify the pdf on this machine first, a pdf that is clearly none of the templates is rejected without calling the model and one that is clearly another template is extracted with that one")
+        self.show_performance = st.sidebar.checkbox("Show performance panel", help="Time, estimated tokens and cost of every stage of the last request")
+        self.tracer = get_tracer()
+        self.memo = StageMemo(st.session_state)
+
+        # Every rerun of the script is one request, its stages are spans inside it
+        with self.tracer.span("request", option=self.option, model=self.model, retrieval="local" if self.local_search else "embeddings") as request:
+            self._handle_request()
+        if self.show_performance:
+            self._performance_panel(request.trace_id)
+        self._follow_ingestion()
+
+    def _handle_request(self):
+        # If a pdf file is uploaded, its pages will be extracted in parallel and kept with their page numbers
+        # The text of all the pages will be joined and saved in the 'text' variable
+        # Repeat uploads read the pages back from the document cache instead and reruns of the
+        # same upload take them from the session without even hashing the pdf again
+        if self.option != "Ask your corpus" and self.pdf is None:
+            return
+        # The extraction pipeline itself lives in the engine, this class only drives it from the UI
+        self.engine = get_engine(self.model, self.api_key, self.local_search)
+        self.embeddings = self.engine.embeddings
+        if self.option == "Ask your corpus":
+            self._ask_corpus()
+        elif self.pdf is not None:
+            document = self.memo.get_or_compute("document", (self._upload_identity(), self.local_search), self._load_document)
+            self.cache_key, self.pages, self.text, self.page_offsets = document
 
             if self.option == "Ask your pdf":
                 self._create_embeddings()
                 self._ask_query()
-                st.write(self.response)
             else:
+                self._apply_route()
                 placeholder = st.empty()
                 self.button = placeholder.button('Extract data', key="button", disabled=False)
 
@@ -73,279 +165,379 @@ class PDFChatBot:
                 if self.button:
                     placeholder.button('Extract data', disabled=True, key='2')
                     loading_text = st.text("Loading the data please wait...")
-                    self._create_embeddings()
-                    self._ask_query()
+                    if self._check_doc_type():
+                        self._create_embeddings(wait=True)
+                        self._ask_query(recompute=True)
                     loading_text.empty()
+                elif self.memo.get("result", self._result_key(QUERIES[self.option])) is not None:
+                    # Reruns, like the one of the export button, show the data extracted before
+                    self._ask_query()
+
+    # The first pages are classified on this machine before anything is sent to OpenAI, see doctype.py.
+    # A pdf that is confidently another of the templates is extracted with that one, which is kept for the
+    # reruns of the same upload, and one that is confidently none of them is rejected without embedding it or
+    # asking the model. When the classifier isn't sure the model's docType answer decides, as without the check.
+    def _check_doc_type(self):
+        if not self.check_doc_type:
+            return True
+        template, _, _ = self.engine.classify(self.option, self.pdf.getvalue() if self.pages is None else None, self.pages)
+        if template is None:
+            st.markdown(DOC_TYPE_ERRORS[self.option])
+            return False
+        if template != self.option:
+            self.memo.put("route", (self.cache_key, self.option), template)
+            self._apply_route()
+        return True
+
+    def _apply_route(self):
+        template = self.memo.get("route", (self.cache_key, self.option))
+        if template is not None and self.check_doc_type:
+            st.markdown(":orange[This file looks like a %s file, its data was extracted as one.]" % template.lower())
+            self.option = template
+
+    # The id streamlit gives every upload, a new upload of the same file gets a new one
+    def _upload_identity(self):
+        return getattr(self.pdf, "file_id", None) or (self.pdf.name, self.pdf.size)
+
+    # A large pdf is streamed into its index instead, its pages are never all read at once
+    def _load_document(self):
+        pdf_bytes = self.pdf.getvalue()
+        cache_key = self.engine.make_key(pdf_bytes)
+        if self.engine.streams(pdf_bytes):
+            return cache_key, None, None, None
+        pages = self.engine.load_pages(cache_key, pdf_bytes)
+        text, page_offsets = join_pages(pages)
+        return cache_key, pages, text, page_offsets
+
+    # An answer from a pdf that was still being indexed is asked again once the whole pdf is.
+    # Ticking "Bypass response cache" asks the model again too, reruns with it ticked keep that answer.
+    def _result_key(self, query):
+        return (self.cache_key, self.option, self.model, self.local_search, query, self._partial(), self.bypass_cache)
+
+    def _partial(self):
+        return self.ingestion is not None and not self.ingestion.done.is_set()
+
+    def _performance_panel(self, trace_id):
+        spans = get_recent_spans().trace(trace_id)
+        if len(spans) <= 1:
+            return
+        with st.expander("Performance", expanded=True):
+            rows = []
+            for span in spans:
+                rows.append({
+                    "stage": "\u00a0\u00a0" * span.depth + span.name,
+                    "ms": round(span.duration * 1000, 1),
+                    "prompt tokens": span.usage.get("prompt_tokens", 0),
+                    "completion tokens": span.usage.get("completion_tokens", 0),
+                    "embedding tokens": span.usage.get("embedding_tokens", 0),
+                    "cost ($)": round(span.usage.get("cost", 0), 5),
+                    "details": ", ".join("%s=%s" % item for item in span.attributes.items() if item[0] not in span.usage),
+                })
+            st.table(rows)
+
+    # Split the text inside the pdf into chunks and create embeddings based on the chunks created
+    # A cached index is loaded from disk without making any embedding calls
+    # and only the chunks that were never embedded before are sent to OpenAI
+    # A streamed pdf can be asked about as soon as its first chunks are indexed, unless 'wait' is set
+    def _create_embeddings(self, wait=False):
+        if self.pages is None:
+            pdf_bytes = self.pdf.getvalue()
+            self.ingestion = get_ingestion(self.cache_key, self.engine, pdf_bytes)
+            self.knowledge_base = self.ingestion.knowledge_base
+            if not self.ingestion.done.is_set():
+                self.progress_bar = st.progress(self.ingestion.progress, text=self._progress_text())
+                while not self.ingestion.done.wait(0.1):
+                    if not wait and self.knowledge_base.ntotal > 0:
+                        break
+                    self.progress_bar.progress(self.ingestion.progress, text=self._progress_text())
+            if self.ingestion.error is not None:
+                # Forget the failed ingestion so the next upload of this pdf starts over,
+                # the ones other sessions are following stay cached
+                get_ingestion.clear(self.cache_key, self.engine, pdf_bytes)
+                raise self.ingestion.error
+        else:
+            self.knowledge_base = get_knowledge_base(self.cache_key, self.local_search, self.engine, self.text)
+        # The corpus is searched with OpenAI embeddings, a locally searched pdf has none to add
+        # and a streamed one is added once it is complete
+        if self.add_to_corpus and not self.local_search and not self._partial():
+            self._add_to_corpus()
+
+    def _progress_text(self):
+        return "Indexing the pdf: page %d of %d, %d chunks so far" % (self.ingestion.pages_indexed, self.ingestion.page_count, self.ingestion.chunks_indexed)
+
+    # Keeps the progress of a pdf that is still being indexed up to date after the rest of the page is drawn,
+    # then reruns the script so the page shows the whole pdf. Any widget change stops it with a rerun of its own.
+    def _follow_ingestion(self):
+        if not self._partial():
+            return
+        while not self.ingestion.done.wait(0.5):
+            self.progress_bar.progress(self.ingestion.progress, text=self._progress_text())
+        st.rerun()
+
+    # The vectors are taken from the pdf's own index so adding it to the corpus makes no embedding calls
+    def _add_to_corpus(self):
+        corpus = get_corpus(self.api_key)
+        if corpus.has_document(self.cache_key):
+            return
+        with self.tracer.span("corpus_add"):
+            docs = all_chunks(self.knowledge_base)
+            chunks = [doc.page_content for doc in docs]
+            if self.pages is None:
+                # Streamed chunks carry the page they start on
+                pages = [doc.metadata.get("page") for doc in docs]
+            else:
+                pages = chunk_pages(self.text, chunks, self.pages, self.page_offsets)
+            corpus.add_document(
+                self.cache_key, chunks, name=self.pdf.name,
+                doc_type=self.option if self.option in QUERIES else None,
+                pages=pages,
+                vectors=self.knowledge_base.index.reconstruct_n(0, len(chunks))
+            )
 
-    # Create embeddings based on the chunks created
-    def _create_embeddings(self):
-        self.embeddings = OpenAIEmbeddings(openai_api_key=self.api_key)
-        chunks = self.text_splitter.split_text(self.text)
-        self.knowledge_base = FAISS.from_texts(chunks, self.embeddings)
+    # Ask a question across every pdf added to the corpus, optionally only the ones of some types or upload dates
+    def _ask_corpus(self):
+        corpus = get_corpus(self.api_key)
+        doc_types = st.multiselect("Document types", list(QUERIES))
+        dates = st.date_input("Uploaded between", value=())
+        filters = {"doc_types": doc_types or None}
+        if len(dates) == 2:
+            filters["uploaded_after"] = datetime.datetime.combine(dates[0], datetime.time.min).timestamp()
+            filters["uploaded_before"] = datetime.datetime.combine(dates[1] + datetime.timedelta(days=1), datetime.time.min).timestamp()
+        self.query = st.text_input("Ask your corpus?", key="ask_corpus_input")
+
+        if self.query:
+            if corpus.index is None or corpus.index.ntotal == 0:
+                st.markdown(""":red[Error: The corpus is empty. Upload a pdf with 'Add uploaded pdfs to the corpus' checked first.] """)
+                return
+            self.knowledge_base = corpus.filtered(**filters)
+            self.cache_key = None
+            try:
+                self._stream_answer()
+            except invalid_request_error():
+                st.markdown(""":red[Error: Maximum context length exceeded. Please cut down your pdf and upload only the necessary pages.] """)
 
     # Search the pdf for similarity and then use qa chain lib for chatGPT's response.
-    def _ask_query(self):
-        if self.option == 'Resume':
-            self.query = '''
-            Follow this format and insert the owner's information in the values. Do not copy the value:
-
-            {   
-                'docType': 'Answer with True or False, is this a resume?'
-                'name': "owner's name",
-                'contact': "owner's contact information separated by commas",
-                'experience': [
-                    {
-                        'company_name': 'first work experience company name',
-                        'job_date': 'from date and to date of the job',
-                        'job_title': 'job title for this experience',
-                        'job_description': 'summarize the experience description'
-                    },
-                    # Add more experiences if relevant
-                ],
-                'educationalBackground': { 
-                    'school': 'the school attended', 
-                    'course': 'the course taken', 
-                    'year': 'year started and ended' 
-                },
-                'technicalSkills': 'only give 5 of the most notable technical skills that can apply to full stack development',
-                'certifications': 'list out the resume owner\'s certifications',
-            }
-
-            Send out the complete response and format it like a Python dictionary so that I can do eval() method on it later. Remove any bullet points
-            '''
-        elif self.option == 'Bill of loading':        
-            self.query = '''
-            Follow this format and insert the proper information as values. Do not copy the value. If empty, just put 'none' as the value:
-
-            {   'docType': 'Answer with True or False, is this doc a bill of loading?',
-                'slwbNo': 'the slwbno of the shipment',
-                'shipper': "shipper's details (separate each detail with a new line)",
-                'consignee': "consignee's details (separate each detail with a new line)",
-                'notify_party': "notify party's details (separate each detail with a new line)",
-                'vessel': 'what vessel will be used within this delivery',
-                'loading_port': 'port of loading',
-                'discharge_port': 'port of discharge',
-                'packages_info': [
-                    {
-                        'mark_nos': 'total number of palletes',
-                        'num_kind': ['the number of palettes for the given product'],
-                        'desc': [
-                            {
-                                'cartons': 'how many cartons and what does it contain',
-                                'net_weight_prod': 'net-weight of the product',
-                                'temp': 'temperature of the product',
-                                'ncm': 'ncm of the product'
-                            },
-                            # (add more to this list if needed, separate each product's details into dictionaries inside this list)
-                        ],
-                        'gross_weight': 'package gross weight',
-                        'net_weight': 'package net weight'
-                    },
-                    # (if necessary create more object that contains the details like the last one)
-                ],
-                'freight_info': 'freight, charges, etc (if no data, just leave it blank)',
-                'freight_paid_at': 'freight to be paid at (if no data, just leave it blank)',
-                'place_date': 'place and date of issue',
-            }
-
-            Send out the complete response and format it like a Python dictionary so that I can do eval() method on it later. Remove any bullet points
-            '''
-        elif self.option == 'Ask your pdf':
+    # The context is packed to the model's token budget. A question is answered from the most similar chunks
+    # that fit, a template's whole document that doesn't fit is answered with map-reduce instead.
+    # The answer is kept in the session, a rerun with the same pdf, options and question shows it again
+    # without asking the model, unless 'recompute' is set.
+    def _ask_query(self, recompute=False):
+        if self.option == 'Ask your pdf':
             self.query = st.text_input("Ask your pdf?", key="ask_pdf_input")
-        elif self.option == "Procurement":
-            self.query = '''
-                Follow this format and insert the proper information as values. Do not copy the value. If empty, just put 'none' as the value:
-
-                {
-                    'docType' 'Answer with True or False, is this doc a procurement doc based on the doc template? if the doc is a resume or a bill of loading answer False',
-                    'customer_name': 'the customer name stated in the paper.',
-                    'quote_info': {
-                        'quote_address': 'The address of the provider of the quote (add newline to every new bit of information.)',
-                        'quote_number': 'Quote Number or ID',
-                        'quote_creation_date': 'The Quote Creation Date',
-                        'quote_expiration_date': 'The expiration date of the quote',
-                    },
-                    'customer_details': {
-                        'customer_number': 'The customer number id',
-                        'payment_method': 'The payment method used for this quote',
-                        'customer_information': 'The customer\'s information'                   
-                    },
-                    'billing': {
-                        'sales_rep': 'The details of the sales representative (add newline to every new bit of information.)',
-                        'bill_to': 'the information the \'bill to\' contains',
-                        'mail_to': 'the information the \'mail to\' contains',
-                        'ship_to': 'the information the \'ship to\' contains',
-                    },
-                    'pricing_summary': [
-                        {
-                            'product name': 'the product name or description',
-                            'qty': 'the product quantity',
-                            'list_price': 'product\'s list price',
-                            'unit_price': 'product\'s unit price',
-                            'net_price': 'product\'s net price',
-                            'mark_up': 'The markup in price of list price and unit price in percentage add a & sign at the end'
-                        }
-                    ]
-                }
-            '''
+        else:
+            self.query = QUERIES[self.option]
         
         if self.query:
-            docs = self.knowledge_base.similarity_search(self.query)
-            self.llm = ChatOpenAI(max_tokens=2048, model_name=self.model, openai_api_key=self.api_key)
-            self.chain = load_qa_chain(self.llm, chain_type='stuff')
-            print(os.environ)
+            self.result_key = self._result_key(self.query)
+            result = None if recompute else self.memo.get("result", self.result_key)
             try:
-                self.response = self.chain.run(input_documents=docs, question=self.query)
-                st.write(self.response)
-                if (self.option != 'Ask your pdf'):
-                    self.data = eval(self.response)
-
-                if self.option == 'Resume':
-                    if self.data['docType'] == 'True':
-                        self.resume_query()
-                    else:
-                        st.markdown(""":red[Error: This file isn't a resume file. Please upload a resume file or choose other options] """)
-                        
-                    
-                elif self.option == 'Bill of loading':
-                    if self.data['docType'] == 'True':
-                        self.bill_of_loading()
-                    else:
-                        st.markdown(""":red[Error: This file isn't a bill of loading file. Please upload a bill of loading file or choose other options] """)
-    
-                elif self.option == 'Procurement':
-                    if self.data['docType'] == 'True':
-                        self.procurement()
-                    else:
-                        st.markdown(""":red[Error: This file isn't a procurement file. Please upload a procurement file or choose other options] """)
-
-                st.button("Export to JSON", key='json', on_click=self.exportToJson)
+                if result is None:
+                    self._stream_answer()
+                    self.memo.put("result", self.result_key, {"response": self.response, "data": self.data})
+                else:
+                    self._show_result(result)
+                if self._partial():
+                    st.caption("The pdf is still being indexed, this answer only used the pages indexed so far.")
+                if st.button("Export to JSON", key='json'):
+                    self.exportToJson()
                 
-            except openai.error.InvalidRequestError:
+            except invalid_request_error():
                 st.markdown(""":red[Error: Maximum context length exceeded. Please cut down your pdf and upload only the necessary pages.] """)
                 return
+            except (ValueError, SyntaxError):
+                st.markdown(""":red[Error: The response couldn't be read. Please extract the data again.] """)
+                return
+
+    # The answer is shown while the model streams it and for the structured options every field
+    # is drawn as soon as it is complete, instead of everything at once at the end
+    def _stream_answer(self):
+        structured = self.option in QUERIES
+        parser = IncrementalDictParser() if structured else None
+        # The field renderers update the parsed data in place, e.g. splitting comma separated values into lists
+        self.data = parser.result() if parser is not None else {}
+        self.is_doc_type = None
+        response_area = st.empty()
+        tokens = queue.Queue()
+        streamed = []
+        parse_seconds = 0.0
+
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            # Near-identical questions about the same pdf are answered from the response cache too,
+            # once the whole pdf is indexed.
+            # The context is copied so the engine's spans end up inside this request's span.
+            future = pool.submit(
+                contextvars.copy_context().run, self.engine.ask, self.knowledge_base, self.query, document=None if self._partial() else self.cache_key,
+                use_cache=not self.bypass_cache, match_similar=not structured,
+                whole_document=structured, on_token=tokens.put, validate=self.engine.parse if structured else None
+            )
+            while not (future.done() and tokens.empty()):
+                try:
+                    new_tokens = [tokens.get(timeout=0.05)]
+                except queue.Empty:
+                    continue
+                while not tokens.empty():
+                    new_tokens.append(tokens.get())
+                streamed.extend(new_tokens)
+                response_area.write("".join(streamed))
+                if parser is not None:
+                    parse_start = time.perf_counter()
+                    fields = parser.feed("".join(new_tokens))
+                    parse_seconds += time.perf_counter() - parse_start
+                    for key, value in fields:
+                        self._render_field(key, value)
+            self.response = future.result()
+
+        response_area.write(self.response)
+        if parser is not None:
+            parse_start = time.perf_counter()
+            fields = parser.close()
+            # The response is parsed piece by piece while it streams, the span holds the total
+            self.tracer.record("parse", parse_seconds + time.perf_counter() - parse_start, fields=len(parser.result()))
+            for key, value in fields:
+                self._render_field(key, value)
+            if self.is_doc_type is None:
+                st.markdown(DOC_TYPE_ERRORS[self.option])
+
+    def _show_result(self, result):
+        self.response = result["response"]
+        st.write(self.response)
+        if self.option in QUERIES:
+            self.data = result["data"]
+            self.is_doc_type = None
+            for key, value in list(self.data.items()):
+                self._render_field(key, value)
+            if self.is_doc_type is None:
+                st.markdown(DOC_TYPE_ERRORS[self.option])
+
+    def _render_field(self, key, value):
+        if key == 'docType':
+            self.is_doc_type = value == 'True'
+            if not self.is_doc_type:
+                st.markdown(DOC_TYPE_ERRORS[self.option])
+            elif self.option == 'Procurement':
+                st.header("Procurement")
+        elif self.is_doc_type:
+            getattr(self, FIELD_RENDERERS[self.option])(key, value)
             
+    # Exports the result kept in the session, which outlives the rerun the export button causes
     def exportToJson(self):
-        json_str = json.dumps(self.data, indent=4)
+        result = self.memo.get("result", self.result_key)
+        json_str = json.dumps(result["data"] if result is not None else self.data, indent=4)
         st.code(json_str, language='python', line_numbers=False)
 
     # Logic behind the different types of UI per query
+    # Every field is drawn on its own so the widgets can fill in while the response is still streaming
     def resume_query(self):
-        for key, value in self.data.items():
-            if ',' in value:
-                self.data[key] = [item.strip() for item in value.split(',')]
-        name = self.data['name']
-        contact = self.data['contact']
-        experiences = self.data['experience']
-        educationalBackground = self.data['educationalBackground']
-        technicalSkills = self.data['technicalSkills']
-        certifications = self.data['certifications']
-
-        st.text('Name: ')
-        st.text_input('Name: ', name, disabled=True, label_visibility='collapsed')
-        st.text('Contact Information: ')
-        if isinstance(contact, list):
-            for element in contact:
-                st.text_input('Contacts: ', element, disabled=True, label_visibility='collapsed')
-        else:
-            st.text_input('Contact: ', contact, disabled=True, label_visibility='collapsed')
-
-        st.text('Experiences: ')
-        for experience in experiences:
-            company_name = experience['company_name']
-            job_date = experience['job_date']
-            job_title = experience['job_title']
-            job_description = experience['job_description']
-
-            st.text('Company Name')
-            st.text_input('Company Name: ', company_name, disabled=True, label_visibility='collapsed')
-            st.text('Job Date')
-            st.text_input('Job Date: ', job_date, disabled=True, label_visibility='collapsed')
-            st.text('Job Title')
-            st.text_input('Job Title: ', job_title, disabled=True, label_visibility='collapsed')
-            st.text('Job Description')
-            st.text_area('Job Description: ', value=job_description, disabled=True, label_visibility='collapsed')
-
-        school = educationalBackground['school']
-        course = educationalBackground['course']
-        year = educationalBackground['year']
-        st.text('Education: ')
-        st.text('Institution')
-        st.text_input('School Attended: ', school, disabled=True, label_visibility='collapsed')
-        st.text('Course')
-        st.text_input('School Attended: ', course, disabled=True, label_visibility='collapsed')
-        st.text('Year Graduated')
-        st.text_input('School Attended: ', year, disabled=True, label_visibility='collapsed')
-
-        st.text('Technical Skills: ')
-        if isinstance(technicalSkills, list):
-            for element in technicalSkills:
-                st.text_input('Technical Skills: ', element, disabled=True, label_visibility='collapsed')
-        st.text('Certifications: ')
-        if isinstance(certifications, list):
-            for element in certifications:
-                st.text_input('Certifications: ', element, disabled=True, label_visibility='collapsed')
+        for key, value in list(self.data.items()):
+            self.resume_field(key, value)
+
+    def resume_field(self, key, value):
+        if isinstance(value, str) and ',' in value:
+            value = self.data[key] = [item.strip() for item in value.split(',')]
+
+        if key == 'name':
+            st.text('Name: ')
+            st.text_input('Name: ', value, disabled=True, label_visibility='collapsed')
+        elif key == 'contact':
+            st.text('Contact Information: ')
+            if isinstance(value, list):
+                for element in value:
+                    st.text_input('Contacts: ', element, disabled=True, label_visibility='collapsed')
+            else:
+                st.text_input('Contact: ', value, disabled=True, label_visibility='collapsed')
+        elif key == 'experience':
+            st.text('Experiences: ')
+            for experience in value:
+                company_name = experience['company_name']
+                job_date = experience['job_date']
+                job_title = experience['job_title']
+                job_description = experience['job_description']
+
+                st.text('Company Name')
+                st.text_input('Company Name: ', company_name, disabled=True, label_visibility='collapsed')
+                st.text('Job Date')
+                st.text_input('Job Date: ', job_date, disabled=True, label_visibility='collapsed')
+                st.text('Job Title')
+                st.text_input('Job Title: ', job_title, disabled=True, label_visibility='collapsed')
+                st.text('Job Description')
+                st.text_area('Job Description: ', value=job_description, disabled=True, label_visibility='collapsed')
+        elif key == 'educationalBackground':
+            school = value['school']
+            course = value['course']
+            year = value['year']
+            st.text('Education: ')
+            st.text('Institution')
+            st.text_input('School Attended: ', school, disabled=True, label_visibility='collapsed')
+            st.text('Course')
+            st.text_input('School Attended: ', course, disabled=True, label_visibility='collapsed')
+            st.text('Year Graduated')
+            st.text_input('School Attended: ', year, disabled=True, label_visibility='collapsed')
+        elif key == 'technicalSkills':
+            st.text('Technical Skills: ')
+            if isinstance(value, list):
+                for element in value:
+                    st.text_input('Technical Skills: ', element, disabled=True, label_visibility='collapsed')
+        elif key == 'certifications':
+            st.text('Certifications: ')
+            if isinstance(value, list):
+                for element in value:
+                    st.text_input('Certifications: ', element, disabled=True, label_visibility='collapsed')
 
     def bill_of_loading(self):
-        slwbNo = self.data['slwbNo']
-        shipper = self.data['shipper']
-        consignee = self.data['consignee']
-        notify_party = self.data['notify_party']
-        vessel = self.data['vessel']
-        loading_port = self.data['loading_port']
-        discharge_port = self.data['discharge_port']
-        package_info = self.data['packages_info']
-        freight_info = self.data['freight_info']
-        freight_paid_at = self.data['freight_paid_at']
-        place_date = self.data['place_date']
-
-        st.text("SLWB No.")
-        st.text_input('SLWB No.: ', slwbNo, disabled=True, label_visibility='collapsed')
-        st.text("Shipper's details: ")
-        st.text_area('Shipper Details: ', shipper, disabled=True, label_visibility='collapsed')
-        st.text("Consignee's details: ")
-        st.text_area('Consignee Details: ', consignee, disabled=True, label_visibility='collapsed')
-        st.text("Notify Party's details: ")
-        st.text_area("Notify Party's details: ", notify_party, disabled=True, label_visibility='collapsed')
-        st.text("Vessel: ")
-        st.text_input('Vessel: ', vessel, disabled=True, label_visibility='collapsed')
-        st.text("Loading Port: ")
-        st.text_input('Loading Port: ', loading_port, disabled=True, label_visibility='collapsed')
-        st.text("Discharge Port: ")
-        st.text_input('Discharge Port: ', discharge_port, disabled=True, label_visibility='collapsed')
-
-        for info in package_info:
-            mark_nos = info['mark_nos']
-            num_kind = info['num_kind']
-            desc = info['desc']
-            gross_weight = info['gross_weight']
-            net_weight = info['net_weight']
-
-            st.text("Packages Info: ")
-            st.text('Total Palettes: ')
-            st.text_input('Mark No.: ', mark_nos, disabled=True, key=f"mark_no_{mark_nos}", label_visibility='collapsed')
+        for key, value in self.data.items():
+            self.bill_of_loading_field(key, value)
+
+    def bill_of_loading_field(self, key, value):
+        if key == 'slwbNo':
+            st.text("SLWB No.")
+            st.text_input('SLWB No.: ', value, disabled=True, label_visibility='collapsed')
+        elif key == 'shipper':
+            st.text("Shipper's details: ")
+            st.text_area('Shipper Details: ', value, disabled=True, label_visibility='collapsed')
+        elif key == 'consignee':
+            st.text("Consignee's details: ")
+            st.text_area('Consignee Details: ', value, disabled=True, label_visibility='collapsed')
+        elif key == 'notify_party':
+            st.text("Notify Party's details: ")
+            st.text_area("Notify Party's details: ", value, disabled=True, label_visibility='collapsed')
+        elif key == 'vessel':
+            st.text("Vessel: ")
+            st.text_input('Vessel: ', value, disabled=True, label_visibility='collapsed')
+        elif key == 'loading_port':
+            st.text("Loading Port: ")
+            st.text_input('Loading Port: ', value, disabled=True, label_visibility='collapsed')
+        elif key == 'discharge_port':
+            st.text("Discharge Port: ")
+            st.text_input('Discharge Port: ', value, disabled=True, label_visibility='collapsed')
+        elif key == 'packages_info':
+            for info in value:
+                self._package_info(info)
+        elif key == 'freight_info':
+            st.text("Freight Info: ")
+            st.text_input('Freight Info: ', value, disabled=True, label_visibility='collapsed')
+        elif key == 'freight_paid_at':
+            st.text("Freight Paid at: ")
+            st.text_area('Freight Paid at: ', value, disabled=True, label_visibility='collapsed')
+        elif key == 'place_date':
+            st.text("Place & Date: ")
+            st.text_input('Place & Date: ', value, disabled=True, label_visibility='collapsed')
+
+    def _package_info(self, info):
+        mark_nos = info['mark_nos']
+        num_kind = info['num_kind']
+        desc = info['desc']
+        gross_weight = info['gross_weight']
+        net_weight = info['net_weight']
+
+        st.text("Packages Info: ")
+        st.text('Total Palettes: ')
+        st.text_input('Mark No.: ', mark_nos, disabled=True, key=f"mark_no_{mark_nos}", label_visibility='collapsed')
+        
+        for i, num in enumerate(num_kind):
+            st.text('Number of palettes: ')
+            st.text_input('Num kind: ', num, disabled=True, key=f"num_kind_{i}", label_visibility='collapsed')
             
-            for i, num in enumerate(num_kind):
-                st.text('Number of palettes: ')
-                st.text_input('Num kind: ', num, disabled=True, key=f"num_kind_{i}", label_visibility='collapsed')
-                
-                if i < len(desc):
-                    obj = desc[i]
-                    cartons = obj['cartons']
-                    net_weight_prod = obj['net_weight_prod']
-                    temp = obj['temp']
-                    ncm = obj['ncm']
-
-                    st.text('Cartons')
-                    st.text_input('Cartons: ', cartons, disabled=True, key=f"cartons_{i}", label_visibility='collapsed')
-                    st.text('Net Weight')
-                    st.text_input('Net Weight Prod: ', net_weight_prod, disabled=True, key=f"net_weight_prod_{i}", label_visibility='collapsed')
-                    st.text('Temp:')
-                    st.text_input('Temp: ', temp, disabled=True, key=f"temp_{i}", label_visibility='collapsed')
-                    st.text('NCM:')
-                    st.text_input('NCM: ', ncm, disabled=True, key=f"ncm_{i}", label_visibility='collapsed')
-                    
-            for i in range(len(num_kind), len(desc)):
+            if i < len(desc):
                 obj = desc[i]
                 cartons = obj['cartons']
                 net_weight_prod = obj['net_weight_prod']
@@ -360,60 +552,69 @@ class PDFChatBot:
                 st.text_input('Temp: ', temp, disabled=True, key=f"temp_{i}", label_visibility='collapsed')
                 st.text('NCM:')
                 st.text_input('NCM: ', ncm, disabled=True, key=f"ncm_{i}", label_visibility='collapsed')
-            st.text('Gross Weight.')
-            st.text_input('Gross Weight: ', gross_weight, disabled=True, key="gross_weight", label_visibility='collapsed')
+                
+        for i in range(len(num_kind), len(desc)):
+            obj = desc[i]
+            cartons = obj['cartons']
+            net_weight_prod = obj['net_weight_prod']
+            temp = obj['temp']
+            ncm = obj['ncm']
+
+            st.text('Cartons')
+            st.text_input('Cartons: ', cartons, disabled=True, key=f"cartons_{i}", label_visibility='collapsed')
             st.text('Net Weight')
-            st.text_input('Net Weight: ', net_weight, disabled=True, key="net_weight", label_visibility='collapsed')
-
-        st.text("Freight Info: ")
-        st.text_input('Freight Info: ', freight_info, disabled=True, label_visibility='collapsed')
-        st.text("Freight Paid at: ")
-        st.text_area('Freight Paid at: ', freight_paid_at, disabled=True, label_visibility='collapsed')
-        st.text("Place & Date: ")
-        st.text_input('Place & Date: ', place_date, disabled=True, label_visibility='collapsed')
+            st.text_input('Net Weight Prod: ', net_weight_prod, disabled=True, key=f"net_weight_prod_{i}", label_visibility='collapsed')
+            st.text('Temp:')
+            st.text_input('Temp: ', temp, disabled=True, key=f"temp_{i}", label_visibility='collapsed')
+            st.text('NCM:')
+            st.text_input('NCM: ', ncm, disabled=True, key=f"ncm_{i}", label_visibility='collapsed')
+        st.text('Gross Weight.')
+        st.text_input('Gross Weight: ', gross_weight, disabled=True, key="gross_weight", label_visibility='collapsed')
+        st.text('Net Weight')
+        st.text_input('Net Weight: ', net_weight, disabled=True, key="net_weight", label_visibility='collapsed')
 
     def procurement(self):
-        customer_name = self.data['customer_name']
-        quote_info = self.data['quote_info']
-        customer_details = self.data['customer_details']
-        billing = self.data['billing']
-        pricing_summary = self.data['pricing_summary']
-
         st.header("Procurement")
-        st.text('Customer Name: ')
-        st.text_input('Customer Name: ', customer_name, disabled=True, label_visibility='collapsed')
-        st.text('Quote Informations: ')
-        for key, value in quote_info.items():
-            if key == 'quote_address':
-                st.text("Quote Address:")
-                st.text_area('', value, disabled=True, key="quote_address", label_visibility='collapsed')
-            else:
+        for key, value in self.data.items():
+            self.procurement_field(key, value)
+
+    def procurement_field(self, key, value):
+        if key == 'customer_name':
+            st.text('Customer Name: ')
+            st.text_input('Customer Name: ', value, disabled=True, label_visibility='collapsed')
+        elif key == 'quote_info':
+            st.text('Quote Informations: ')
+            for key, value in value.items():
+                if key == 'quote_address':
+                    st.text("Quote Address:")
+                    st.text_area('', value, disabled=True, key="quote_address", label_visibility='collapsed')
+                else:
+                    st.text(key.capitalize() + ':')
+                    st.text_input('', value, disabled=True, key=f"quote_info_{key}", label_visibility='collapsed')
+        elif key == 'customer_details':
+            st.text("Customer Information")
+            for key, value in value.items():
+                st.text(key.capitalize() + ':')
+                st.text_input('', value, disabled=True, key=f"customer_details_{key}", label_visibility='collapsed')                 
+        elif key == 'billing':
+            for key, value in value.items():
                 st.text(key.capitalize() + ':')
-                st.text_input('', value, disabled=True, key=f"quote_info_{key}", label_visibility='collapsed')
-
-        st.text("Customer Information")
-        for key, value in customer_details.items():
-            st.text(key.capitalize() + ':')
-            st.text_input('', value, disabled=True, key=f"customer_details_{key}", label_visibility='collapsed')                 
-
-        for key, value in billing.items():
-            st.text(key.capitalize() + ':')
-            st.text_area('', value, disabled=True, key=f"billing_{key}", label_visibility='collapsed')
-
-        st.text('Pricing Summary:')
-        for i, product in enumerate(pricing_summary):
-            st.text('Product Name:')
-            st.text_input('', product['product name'], disabled=True, key=f"product_name_{i}", label_visibility='collapsed')
-            st.text('Quantity:')
-            st.text_input('', str(product['qty']), disabled=True, key=f"quantity_{i}", label_visibility='collapsed')
-            st.text('List Price:')
-            st.text_input('', str(product['list_price']), disabled=True, key=f"list_price_{i}", label_visibility='collapsed')
-            st.text('Unit Price:')
-            st.text_input('', str(product['unit_price']), disabled=True, key=f"unit_price_{i}", label_visibility='collapsed')
-            st.text('Net Price:')
-            st.text_input('', str(product['net_price']), disabled=True, key=f"net_price_{i}", label_visibility='collapsed')
-            st.text('Markup:')
-            st.text_input('', product['mark_up'], disabled=True, key=f"markup_{i}", label_visibility='collapsed')
+                st.text_area('', value, disabled=True, key=f"billing_{key}", label_visibility='collapsed')
+        elif key == 'pricing_summary':
+            st.text('Pricing Summary:')
+            for i, product in enumerate(value):
+                st.text('Product Name:')
+                st.text_input('', product['product name'], disabled=True, key=f"product_name_{i}", label_visibility='collapsed')
+                st.text('Quantity:')
+                st.text_input('', str(product['qty']), disabled=True, key=f"quantity_{i}", label_visibility='collapsed')
+                st.text('List Price:')
+                st.text_input('', str(product['list_price']), disabled=True, key=f"list_price_{i}", label_visibility='collapsed')
+                st.text('Unit Price:')
+                st.text_input('', str(product['unit_price']), disabled=True, key=f"unit_price_{i}", label_visibility='collapsed')
+                st.text('Net Price:')
+                st.text_input('', str(product['net_price']), disabled=True, key=f"net_price_{i}", label_visibility='collapsed')
+                st.text('Markup:')
+                st.text_input('', product['mark_up'], disabled=True, key=f"markup_{i}", label_visibility='collapsed')
 
 if __name__ == '__main__':
     bot = PDFChatBot()
@@ -0,0 +1,72 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from corpus import CorpusIndex
+
+
+DOC_TYPES = ['Resume', 'Bill of loading', 'Procurement']
+
+
+def percentiles(timings):
+    timings = np.array(timings) * 1000
+    return "p50 %.2fms  p95 %.2fms  p99 %.2fms" % tuple(np.percentile(timings, [50, 95, 99]))
+
+
+# Builds a corpus of 'size' random clustered vectors, 'chunks_per_doc' chunks per document,
+# and times adding, training and searching it with and without metadata filters
+def run(size, dim, chunks_per_doc, queries, root):
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((256, dim)).astype(np.float32)
+    corpus = CorpusIndex(embeddings=None, root=root)
+
+    start = time.perf_counter()
+    for doc in range(size // chunks_per_doc):
+        vectors = centers[rng.integers(0, len(centers), chunks_per_doc)] + 0.3 * rng.standard_normal((chunks_per_doc, dim)).astype(np.float32)
+        chunks = ["document %d chunk %d" % (doc, i) for i in range(chunks_per_doc)]
+        corpus.add_document("doc-%d" % doc, chunks, name="doc-%d.pdf" % doc, doc_type=DOC_TYPES[doc % 3], uploaded_at=doc, vectors=vectors, save=False)
+    corpus.save()
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    corpus = CorpusIndex(embeddings=None, root=root)
+    load = time.perf_counter() - start
+
+    query_vectors = centers[rng.integers(0, len(centers), queries)] + 0.3 * rng.standard_normal((queries, dim)).astype(np.float32)
+    results = {}
+    for name, filters in (
+        ("no filter", {}),
+        ("doc_type filter", {"doc_types": ["Resume"]}),
+        ("single document", {"doc_ids": ["doc-0"]}),
+    ):
+        timings = []
+        for vector in query_vectors:
+            start = time.perf_counter()
+            corpus.search_by_vector(vector, k=4, **filters)
+            timings.append(time.perf_counter() - start)
+        results[name] = percentiles(timings)
+
+    print("%d chunks (%s, dim %d): build %.1fs, load %.3fs" % (size, type(corpus.index).__name__, dim, build, load))
+    for name, result in results.items():
+        print("  %-16s %s" % (name, result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the corpus index search latency at different corpus sizes.")
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--dim", type=int, default=1536, help="1536 is the size of the ada-002 embeddings")
+    parser.add_argument("--chunks-per-doc", type=int, default=1000)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    for size in (int(size) for size in args.sizes.split(",")):
+        with tempfile.TemporaryDirectory() as root:
+            run(size, args.dim, args.chunks_per_doc, args.queries, root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from synthetic import DOC_TYPES, LINES_PER_PAGE, COMPANIES, CITIES, FIRST_NAMES, LAST_NAMES, synthetic_pages, make_pdf
+from extraction import first_pages
+from doctype import DocTypeClassifier, OTHER, CLASSIFY_PAGES
+
+
+TOPICS = ["the budget", "the new office", "the hiring plan", "the quarterly results", "the product launch", "the website redesign"]
+VERBS = ["discussed", "approved", "postponed", "reviewed", "questioned", "agreed on"]
+
+
+# Documents that are none of the templates: meeting minutes, a letter and an article, with the odd
+# number and capitalised heading so they aren't told apart by their layout alone
+def _other_pages(kind, pages, seed):
+    rng = random.Random("%s-%d-%d" % (kind, pages, seed))
+    person = lambda: "%s %s" % (rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES))
+    if kind == "minutes":
+        lines = ["MINUTES OF THE BOARD MEETING", "Date: %02d/%02d/2023" % (rng.randrange(1, 29), rng.randrange(1, 13)), "Present: %s, %s" % (person(), person()), ""]
+    elif kind == "letter":
+        lines = ["%s" % rng.choice(CITIES), "Dear %s," % person(), ""]
+    else:
+        lines = ["%s REPORTS RECORD YEAR" % rng.choice(COMPANIES).upper(), "By %s" % person(), ""]
+    while len(lines) < pages * LINES_PER_PAGE:
+        lines.append("%s %s %s in %d and will come back to it in %d weeks." % (person(), rng.choice(VERBS), rng.choice(TOPICS), rng.randrange(2015, 2024), rng.randrange(1, 9)))
+    return [lines[i * LINES_PER_PAGE:(i + 1) * LINES_PER_PAGE] for i in range(pages)]
+
+
+# The text of the first pages as the app reads it from the pdf and the time reading them took. 'noise' is
+# the share of lines dropped with the line breaks of the rest lost, like the text of a badly extracted scan.
+def _document(pages, seed, noise):
+    pdf_bytes = make_pdf(pages)
+    start = time.perf_counter()
+    text = "\n".join(text for _, text in first_pages(pdf_bytes, CLASSIFY_PAGES))
+    seconds = time.perf_counter() - start
+    if noise:
+        rng = random.Random(seed)
+        text = " ".join(line for line in text.splitlines() if rng.random() >= noise)
+    return text, seconds
+
+
+# Every template and 'Other' document for the given seeds, page counts and noise levels as (text, label, group),
+# the group being the noise level, with the times reading their first pages took
+def build_corpus(seeds, page_counts, noise_levels):
+    documents = []
+    read_times = []
+    for noise in noise_levels:
+        for pages in page_counts:
+            for seed in seeds:
+                generated = [(synthetic_pages(doc_type, pages, seed), doc_type) for doc_type in DOC_TYPES]
+                generated += [(_other_pages(kind, pages, seed), OTHER) for kind in ("minutes", "letter", "article")]
+                for lines, label in generated:
+                    text, seconds = _document(lines, seed, noise)
+                    documents.append((text, label, "noise %s" % noise))
+                    read_times.append(seconds)
+    return documents, read_times
+
+
+# Documents written by hand instead of generated, resumes in prose, real looking bills of lading and purchase
+# orders and look-alikes like invoices and contracts, so the numbers aren't only about synthetic.py's layouts
+def load_samples(path):
+    with open(path, encoding="utf-8") as f:
+        return [(sample["text"], sample["label"], "hand written") for sample in json.load(f)]
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+# Accuracy and confusion matrix of the predictions and what the gate in front of the extraction prompt
+# would have done with a confident prediction: extract with the right template or reject a document that
+# is none of them, or the mistakes, reject a template or extract with the wrong one. Below min_confidence
+# it abstains and the model's docType check decides as without the gate. Latency is the classification of
+# one document, the batch throughput is predict_proba over all of them at once.
+def evaluate(classifier, documents, min_confidence):
+    classes = classifier.classes
+    confusion = [[0] * len(classes) for _ in classes]
+    gate = {"extracted": 0, "rejected": 0, "abstained": 0, "wrongly_rejected": 0, "wrong_template": 0}
+    by_group = {}
+    times = []
+    for text, label, group in documents:
+        start = time.perf_counter()
+        predicted, confidence = classifier.predict(text)
+        times.append(time.perf_counter() - start)
+        confusion[classes.index(label)][classes.index(predicted)] += 1
+        correct = by_group.setdefault(group, [0, 0])
+        correct[0] += predicted == label
+        correct[1] += 1
+        if confidence < min_confidence:
+            gate["abstained"] += 1
+        elif predicted == label:
+            gate["rejected" if label == OTHER else "extracted"] += 1
+        else:
+            gate["wrongly_rejected" if predicted == OTHER else "wrong_template"] += 1
+
+    start = time.perf_counter()
+    classifier.predict_proba([text for text, _, _ in documents])
+    batch = time.perf_counter() - start
+    return {
+        "documents": len(documents),
+        "accuracy": round(sum(confusion[i][i] for i in range(len(classes))) / len(documents), 4),
+        "accuracy_by_group": {group: round(right / total, 4) for group, (right, total) in by_group.items()},
+        "confusion": {label: dict(zip(classes, row)) for label, row in zip(classes, confusion)},
+        "gate": gate,
+        "p50_ms": round(statistics.median(times) * 1000, 3),
+        "p95_ms": round(_percentile(times, 0.95) * 1000, 3),
+        "batch_docs_per_s": round(len(documents) / batch, 1),
+    }
+
+
+def print_result(name, result):
+    print("%s: %d documents, accuracy %.2f%%  (%s)" % (name, result["documents"], result["accuracy"] * 100, "  ".join(
+        "%s: %.2f%%" % (group, accuracy * 100) for group, accuracy in result["accuracy_by_group"].items()
+    )))
+    print("  latency p50 %.3fms  p95 %.3fms  batch %.0f docs/s" % (result["p50_ms"], result["p95_ms"], result["batch_docs_per_s"]))
+    print("  gate " + "  ".join("%s %d" % item for item in result["gate"].items()))
+    classes = list(result["confusion"])
+    print("  %-16s" % "label \\ predicted" + "".join("%17s" % name for name in classes))
+    for label, row in result["confusion"].items():
+        print("  %-16s" % label + "".join("%17d" % row[name] for name in classes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the accuracy and latency of the local document type classifier on synthetic documents.")
+    parser.add_argument("--seeds", type=int, default=20, help="documents of every kind per page count and noise level")
+    parser.add_argument("--pages", default="1,3,20")
+    parser.add_argument("--noise", default="0,0.5,0.8", help="shares of lines dropped from the extracted text")
+    parser.add_argument("--samples", default=os.path.join(ROOT, "tests", "data", "doctype_samples.json"), help="JSON file of hand written documents evaluated with the synthetic ones, empty for none")
+    parser.add_argument("--min-confidence", type=float, default=float(os.getenv("DOCTYPE_MIN_CONFIDENCE", "0.8")))
+    parser.add_argument("--fit", action="store_true", help="also tune the weights on the even seeds and evaluate both models on the odd ones")
+    parser.add_argument("--save", help="write the tuned model to this JSON file, for DOCTYPE_MODEL_PATH")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    page_counts = [int(pages) for pages in args.pages.split(",")]
+    noise_levels = [float(noise) for noise in args.noise.split(",")]
+    seeds = range(args.seeds)
+    if args.fit:
+        seeds = range(1, 2 * args.seeds, 2)
+
+    results = {}
+    test, read_times = build_corpus(seeds, page_counts, noise_levels)
+    if args.samples:
+        test += load_samples(args.samples)
+    results["read_first_pages"] = {"p50_ms": round(statistics.median(read_times) * 1000, 3), "p95_ms": round(_percentile(read_times, 0.95) * 1000, 3)}
+    print("read first %d pages: p50 %.3fms  p95 %.3fms" % (CLASSIFY_PAGES, results["read_first_pages"]["p50_ms"], results["read_first_pages"]["p95_ms"]))
+    results["hand set"] = evaluate(DocTypeClassifier(), test, args.min_confidence)
+    print_result("hand set", results["hand set"])
+
+    if args.fit:
+        train, _ = build_corpus(range(0, 2 * args.seeds, 2), page_counts, noise_levels)
+        start = time.perf_counter()
+        classifier = DocTypeClassifier().fit([text for text, _, _ in train], [label for _, label, _ in train])
+        print("fitted on %d documents in %.2fs" % (len(train), time.perf_counter() - start))
+        results["fitted"] = evaluate(classifier, test, args.min_confidence)
+        print_result("fitted", results["fitted"])
+        if args.save:
+            classifier.save(args.save)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
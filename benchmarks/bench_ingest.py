@@ -0,0 +1,88 @@
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from synthetic import synthetic_pdf
+
+
+def _peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# Indexes one synthetic pdf either whole, reading every page before splitting and embedding them, or
+# streamed through ingest.py. The embeddings are fakes the size of OpenAI's, so the index costs what it
+# would in the app. Runs in a fresh process so the peak RSS is the case's own; the growth is the peak
+# over what the process used before the pdf was read.
+def run_case(mode, doc_type, pages, workers, dim):
+    from cache import DocumentCache
+    from engine import ExtractionEngine
+    from embedding_cache import CachedEmbeddings, EmbeddingStore
+    from fakes import DeterministicFakeEmbeddings, StubLLMBackend
+
+    pdf_bytes = synthetic_pdf(doc_type, pages)
+    with tempfile.TemporaryDirectory() as root:
+        embeddings = CachedEmbeddings(DeterministicFakeEmbeddings(dim), "fake", store=EmbeddingStore(os.path.join(root, "embeddings")))
+        engine = ExtractionEngine(StubLLMBackend(), embeddings=embeddings, embedding_model="fake", cache=DocumentCache(os.path.join(root, "documents")), extract_workers=workers)
+        key = engine.make_key(pdf_bytes)
+        engine.text_splitter.split_text("warm up")
+        rss_before = _peak_rss_mb()
+
+        start = time.perf_counter()
+        if mode == "streaming":
+            ingestion = engine.ingest(key, pdf_bytes)
+            while ingestion.knowledge_base.ntotal == 0 and not ingestion.done.wait(0.005):
+                pass
+            first_query = time.perf_counter() - start
+            knowledge_base = ingestion.result()
+        else:
+            from extraction import join_pages
+            text, _ = join_pages(engine.load_pages(key, pdf_bytes))
+            knowledge_base = engine.build_index(key, text)
+            first_query = time.perf_counter() - start
+        total = time.perf_counter() - start
+
+    return {
+        "chunks": knowledge_base.index.ntotal,
+        "first_query_s": round(first_query, 3),
+        "total_s": round(total, 3),
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        "rss_growth_mb": round(_peak_rss_mb() - rss_before, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the peak memory and time to the first query of whole and streamed indexing of large pdfs.")
+    parser.add_argument("--doc-type", default="Bill of loading")
+    parser.add_argument("--pages", default="250,500,1000,2000")
+    parser.add_argument("--modes", default="whole,streaming")
+    parser.add_argument("--workers", type=int, default=1, help="page extraction processes")
+    parser.add_argument("--dim", type=int, default=1536, help="size of the fake embeddings")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    for pages in (int(pages) for pages in args.pages.split(",")):
+        for mode in args.modes.split(","):
+            case = "%s/%d" % (mode, pages)
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                results[case] = executor.submit(run_case, mode, args.doc_type, pages, args.workers, args.dim).result()
+            result = results[case]
+            print("%-15s %6d chunks  first query %7.2fs  total %7.2fs  peak RSS %7.1fMB  growth %7.1fMB" % (
+                case, result["chunks"], result["first_query_s"], result["total_s"], result["peak_rss_mb"], result["rss_growth_mb"]
+            ))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+import os
+import sys
+import time
+import random
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from langchain.text_splitter import CharacterTextSplitter
+from engine import SPLITTER_SETTINGS, MAX_CANDIDATES
+from local_retrieval import LocalKnowledgeBase
+
+
+def percentiles(timings):
+    timings = np.array(timings) * 1000
+    return "p50 %.2fms  p95 %.2fms  p99 %.2fms" % tuple(np.percentile(timings, [50, 95, 99]))
+
+
+# Builds the local index over a document of 'pages' pages of random words split like the engine splits pdfs,
+# then times the questions the engine would ask it, each one taking MAX_CANDIDATES chunks
+def run(pages, lines_per_page, queries, vocabulary):
+    rng = random.Random(0)
+    words = ["word%d" % i for i in range(vocabulary)]
+    text = "\n".join(" ".join(rng.choice(words) for _ in range(12)) for _ in range(pages * lines_per_page))
+    chunks = CharacterTextSplitter(length_function=len, **SPLITTER_SETTINGS).split_text(text)
+
+    start = time.perf_counter()
+    knowledge_base = LocalKnowledgeBase.from_texts(chunks)
+    build = time.perf_counter() - start
+
+    timings = []
+    for _ in range(queries):
+        query = " ".join(rng.choice(words) for _ in range(8))
+        start = time.perf_counter()
+        knowledge_base.similarity_search(query, k=MAX_CANDIDATES)
+        timings.append(time.perf_counter() - start)
+
+    print("%d pages, %d chunks: build %.2fs" % (pages, len(chunks), build))
+    print("  query  %s" % percentiles(timings))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the build time and query latency of the local retrieval backend.")
+    parser.add_argument("--pages", default="10,100,1000")
+    parser.add_argument("--lines-per-page", type=int, default=45)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--vocabulary", type=int, default=20000)
+    args = parser.parse_args()
+
+    for pages in (int(pages) for pages in args.pages.split(",")):
+        run(pages, args.lines_per_page, args.queries, args.vocabulary)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import resource
+import argparse
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from synthetic import DOC_TYPES, synthetic_pdf
+
+
+# The spans of ExtractionEngine.process timed for every case, 'total' is the process span itself
+STAGES = ["parse_pdf", "split", "embed", "index", "search", "llm", "parse", "total"]
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on linux, the extraction pool's processes count as children
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(max(own, children) / 1024, 1)
+
+
+# Milliseconds a fixed mix of numpy, hashing and string work takes on this machine right now, the fastest of
+# a few runs. Every repeat of a case is timed as a multiple of it measured just before, which follows a
+# machine that got busier or slower for a while better than the timings themselves.
+def calibrate(runs=3):
+    matrix = np.random.default_rng(0).random((200, 200))
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        for _ in range(5):
+            matrix @ matrix
+        for i in range(20000):
+            hashlib.sha256(str(i).encode("utf-8")).digest()
+        " ".join(str(i) for i in range(50000)).split("1")
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+# Runs ExtractionEngine.process, the pipeline the app and the cli run for an extraction template, on one
+# synthetic pdf 'repeats' times, with the fake embeddings and the stub llm standing in for the OpenAI services.
+# Every run starts from empty document and embedding caches, like the first upload of the pdf, and the stage
+# times are read from its spans, and relative to the calibration run before it. Runs in a fresh process so the
+# peak RSS is the case's own.
+def run_case(doc_type, pages, repeats, retrieval, chunk_size, chunk_overlap, llm_latency, workers):
+    from langchain.text_splitter import CharacterTextSplitter
+    from cache import DocumentCache
+    from embedding_cache import CachedEmbeddings, EmbeddingStore
+    from engine import ExtractionEngine, SPLITTER_SETTINGS
+    from fakes import DeterministicFakeEmbeddings, StubLLMBackend
+    from metrics import Tracer, RecentSpansExporter
+
+    pdf_bytes = synthetic_pdf(doc_type, pages)
+    timings = {stage: [] for stage in STAGES}
+    ratios = {stage: [] for stage in STAGES}
+    chunk_count = 0
+    for _ in range(repeats):
+        calibration_ms = calibrate()
+        with tempfile.TemporaryDirectory() as root:
+            spans = RecentSpansExporter()
+            engine = ExtractionEngine(
+                StubLLMBackend(latency=llm_latency),
+                embeddings=CachedEmbeddings(DeterministicFakeEmbeddings(), "fake", store=EmbeddingStore(os.path.join(root, "embeddings"))),
+                embedding_model="fake", cache=DocumentCache(os.path.join(root, "documents")), extract_workers=workers,
+                retrieval=retrieval, tracer=Tracer([spans])
+            )
+            engine.text_splitter = CharacterTextSplitter(
+                length_function=len, separator=SPLITTER_SETTINGS["separator"], chunk_size=chunk_size, chunk_overlap=chunk_overlap
+            )
+            record = engine.process(pdf_bytes, doc_type)
+            if record["status"] != "ok":
+                raise RuntimeError("%s/%d: %s" % (doc_type, pages, record["error"]))
+
+            stage_times = dict.fromkeys(STAGES, 0.0)
+            for span in spans.spans:
+                if span.name == "process":
+                    stage_times["total"] = span.duration
+                elif span.name in stage_times:
+                    stage_times[span.name] += span.duration
+                # The split span of a whole pdf and the ingest span of a streamed one count the chunks
+                if span.name in ("split", "ingest") and "chunks" in span.attributes:
+                    chunk_count = span.attributes["chunks"]
+            for stage, seconds in stage_times.items():
+                timings[stage].append(seconds)
+                ratios[stage].append(seconds * 1000 / calibration_ms)
+
+    result = {"pages": pages, "chunks": chunk_count, "stages": {}}
+    for stage, values in timings.items():
+        values = np.array(values) * 1000
+        result["stages"][stage] = {
+            "p50_ms": round(float(np.percentile(values, 50)), 2), "p95_ms": round(float(np.percentile(values, 95)), 2),
+            "p50_ratio": round(float(np.median(ratios[stage])), 4)
+        }
+    total_seconds = result["stages"]["total"]["p50_ms"] / 1000
+    result["pages_per_second"] = round(pages / total_seconds, 2)
+    result["chunks_per_second"] = round(chunk_count / total_seconds, 2)
+    result["peak_rss_mb"] = _peak_rss_mb()
+    return result
+
+
+# The regressions of every case as {case: [description]}: a stage whose p50 relative to the calibration or the
+# peak RSS grew by more than the threshold over the baseline. Stages faster than 'min_ms' in both runs are
+# left out since their timings are mostly noise.
+def compare(results, baseline, threshold, rss_threshold, min_ms):
+    regressions = {}
+    for case, result in results.items():
+        base = baseline.get("cases", {}).get(case)
+        if base is None:
+            continue
+        found = []
+        for stage, timing in result["stages"].items():
+            base_timing = base["stages"].get(stage)
+            if base_timing is None or "p50_ratio" not in base_timing or max(timing["p50_ms"], base_timing["p50_ms"]) < min_ms:
+                continue
+            if timing["p50_ratio"] > base_timing["p50_ratio"] * (1 + threshold):
+                found.append("%s %s: p50 %.1fms, %.2fx the calibration, baseline %.1fms, %.2fx" % (
+                    case, stage, timing["p50_ms"], timing["p50_ratio"], base_timing["p50_ms"], base_timing["p50_ratio"]
+                ))
+        if result["peak_rss_mb"] > base["peak_rss_mb"] * (1 + rss_threshold):
+            found.append("%s peak RSS: %.1fMB, baseline %.1fMB" % (case, result["peak_rss_mb"], base["peak_rss_mb"]))
+        if found:
+            regressions[case] = found
+    return regressions
+
+
+# The better of two runs of a case stage by stage, noise from the rest of the machine only ever makes a run slower
+def best_of(first, second):
+    best = dict(first, stages={}, peak_rss_mb=min(first["peak_rss_mb"], second["peak_rss_mb"]))
+    for stage, timing in first["stages"].items():
+        best["stages"][stage] = min(timing, second["stages"][stage], key=lambda timing: timing["p50_ratio"])
+    total_seconds = best["stages"]["total"]["p50_ms"] / 1000
+    best["pages_per_second"] = round(best["pages"] / total_seconds, 2)
+    best["chunks_per_second"] = round(best["chunks"] / total_seconds, 2)
+    return best
+
+
+def print_result(case, result):
+    print("%s: %d chunks, %.1f pages/s, peak RSS %.1fMB" % (case, result["chunks"], result["pages_per_second"], result["peak_rss_mb"]))
+    for stage, timing in result["stages"].items():
+        print("  %-9s p50 %9.2fms  p95 %9.2fms" % (stage, timing["p50_ms"], timing["p95_ms"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the extraction pipeline stages on synthetic pdfs with local stand-ins for the OpenAI services.")
+    parser.add_argument("--doc-types", default=",".join(DOC_TYPES))
+    parser.add_argument("--pages", default="1,10,100,1000")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--retrieval", default="embeddings", choices=["embeddings", "local"])
+    parser.add_argument("--chunk-size", type=int, default=1250)
+    parser.add_argument("--chunk-overlap", type=int, default=200)
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="seconds every stub llm call sleeps")
+    parser.add_argument("--workers", type=int, default=None, help="page extraction processes")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="write the results as the new baseline instead of comparing")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed p50 slowdown of a stage over the baseline, relative to the calibration")
+    parser.add_argument("--rss-threshold", type=float, default=0.2, help="allowed peak RSS growth over the baseline")
+    parser.add_argument("--min-ms", type=float, default=5.0, help="stages faster than this are not compared")
+    parser.add_argument("--confirm", type=int, default=2, help="times a case slower than the baseline is run again before it counts as a regression")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+
+    def run(case):
+        doc_type, pages = case.rsplit("/", 1)
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            return executor.submit(
+                run_case, doc_type, int(pages), args.repeats, args.retrieval, args.chunk_size, args.chunk_overlap, args.llm_latency, args.workers
+            ).result()
+
+    results = {}
+    for doc_type in args.doc_types.split(","):
+        for pages in args.pages.split(","):
+            case = "%s/%s" % (doc_type, pages)
+            results[case] = run(case)
+            print_result(case, results[case])
+
+    report = {
+        "settings": {"retrieval": args.retrieval, "chunk_size": args.chunk_size, "chunk_overlap": args.chunk_overlap, "repeats": args.repeats},
+        "cases": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print("Baseline written to %s" % args.baseline)
+        return
+
+    if not os.path.exists(args.baseline):
+        print("No baseline at %s, run with --save-baseline to create one" % args.baseline)
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("settings") != report["settings"]:
+        print("Baseline was recorded with different settings: %s" % baseline.get("settings"))
+    regressions = compare(results, baseline, args.threshold, args.rss_threshold, args.min_ms)
+    # A slow run is often only a busy machine, a regression has to show in the best of the runs again
+    for _ in range(args.confirm):
+        if not regressions:
+            break
+        for case in regressions:
+            print("Running %s again: %s" % (case, "; ".join(regressions[case])))
+            results[case] = best_of(results[case], run(case))
+        regressions = compare(results, baseline, args.threshold, args.rss_threshold, args.min_ms)
+    for found in regressions.values():
+        for regression in found:
+            print("REGRESSION %s" % regression)
+    if regressions:
+        sys.exit(1)
+    print("No regressions against %s" % args.baseline)
+
+
+if __name__ == '__main__':
+    main()
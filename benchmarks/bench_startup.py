@@ -0,0 +1,117 @@
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+import statistics
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ["engine", "llm_executor", "corpus", "local_retrieval", "clients"]
+
+# Every measurement runs in a fresh interpreter so nothing is imported or connected yet.
+# The scripts print one JSON value and get the tree to measure as argv[1].
+IMPORT_SCRIPT = """
+import sys, time, json
+sys.path.insert(0, sys.argv[1])
+start = time.perf_counter()
+__import__(sys.argv[2])
+print(json.dumps(time.perf_counter() - start))
+"""
+
+RENDER_SCRIPT = """
+import os, sys, time, json
+os.chdir(sys.argv[1])
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file(os.path.join(sys.argv[1], "app.py"), default_timeout=120)
+start = time.perf_counter()
+app.run()
+print(json.dumps(time.perf_counter() - start))
+"""
+
+REQUEST_SCRIPT = """
+import sys, time, json
+sys.path.insert(0, sys.argv[1])
+from fakes import FakeChatServer
+from engine import OpenAIBackend
+from langchain.docstore.document import Document
+docs = [Document(page_content="Shipper: Acme Logistics")]
+with FakeChatServer() as server:
+    times = []
+    for _ in range(int(sys.argv[2])):
+        start = time.perf_counter()
+        OpenAIBackend("gpt-3.5-turbo", api_key="bench", api_base=server.url).answer(docs, "Who is the shipper?")
+        times.append(time.perf_counter() - start)
+print(json.dumps(times))
+"""
+
+
+def _run(script, *args, env=None):
+    # Run from the tree, "python -c" puts the current folder first on sys.path
+    output = subprocess.run([sys.executable, "-c", script] + [str(arg) for arg in args], capture_output=True, text=True, env=env, cwd=args[0])
+    if output.returncode != 0:
+        raise RuntimeError(output.stderr.strip().splitlines()[-1] if output.stderr.strip() else "exit code %d" % output.returncode)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+# Import time of each module, time to the first render of the app with no pdf uploaded and the time of
+# the llm requests against a local fake server, the first one and the median of the rest.
+# The app runs with a dummy key and its caches in a temporary folder, nothing is sent to OpenAI.
+def measure(tree, repeats, requests):
+    result = {"import_ms": {}}
+    for module in MODULES:
+        try:
+            result["import_ms"][module] = round(statistics.median(_run(IMPORT_SCRIPT, tree, module) for _ in range(repeats)) * 1000, 1)
+        except RuntimeError as e:
+            print("  %s: %s" % (module, e))
+
+    with tempfile.TemporaryDirectory() as root:
+        env = dict(os.environ, OPENAI_API_KEY="bench", PDF_CACHE_DIR=os.path.join(root, "pdf"), EMBEDDING_CACHE_DIR=os.path.join(root, "embeddings"),
+                   LLM_CACHE_PATH=os.path.join(root, "responses.sqlite"), CORPUS_DIR=os.path.join(root, "corpus"), METRICS_EXPORTERS="")
+        result["first_render_ms"] = round(statistics.median(_run(RENDER_SCRIPT, tree, env=env) for _ in range(repeats)) * 1000, 1)
+
+    times = _run(REQUEST_SCRIPT, tree, requests)
+    result["first_request_ms"] = round(times[0] * 1000, 2)
+    result["request_p50_ms"] = round(statistics.median(times[1:] or times) * 1000, 2)
+    return result
+
+
+# The tree of a git commit, extracted to a temporary folder
+def checkout(ref, folder):
+    archive = subprocess.run(["git", "-C", ROOT, "archive", ref], capture_output=True, check=True).stdout
+    subprocess.run(["tar", "-x", "-C", folder], input=archive, check=True)
+    return folder
+
+
+def print_result(name, result):
+    print(name)
+    for module, ms in result["import_ms"].items():
+        print("  import %-16s %9.1fms" % (module, ms))
+    print("  first render            %9.1fms" % result["first_render_ms"])
+    print("  first request           %9.2fms" % result["first_request_ms"])
+    print("  request p50             %9.2fms" % result["request_p50_ms"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the cold start of the app and the overhead of every llm request.")
+    parser.add_argument("--repeats", type=int, default=3, help="fresh processes per import and render measurement")
+    parser.add_argument("--requests", type=int, default=50, help="llm requests sent to the fake server")
+    parser.add_argument("--compare-ref", help="also measure this git commit, e.g. HEAD~1")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = {"working tree": measure(ROOT, args.repeats, args.requests)}
+    print_result("working tree", results["working tree"])
+    if args.compare_ref:
+        with tempfile.TemporaryDirectory() as folder:
+            results[args.compare_ref] = measure(checkout(args.compare_ref, folder), args.repeats, args.requests)
+        print_result(args.compare_ref, results[args.compare_ref])
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
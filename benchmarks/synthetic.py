@@ -0,0 +1,148 @@
+import random
+
+
+DOC_TYPES = ['Resume', 'Bill of loading', 'Procurement']
+LINES_PER_PAGE = 60
+
+FIRST_NAMES = ["Maria", "John", "Aiko", "Carlos", "Fatima", "Liam", "Priya", "Noah", "Elena", "Kwame"]
+LAST_NAMES = ["Santos", "Smith", "Tanaka", "Oliveira", "Khan", "Murphy", "Patel", "Johnson", "Rossi", "Mensah"]
+COMPANIES = ["Acme Logistics", "Northwind Traders", "Globex Corporation", "Initech", "Umbrella Foods", "Stark Industries", "Wayne Shipping", "Hooli"]
+CITIES = ["Santos, Brazil", "Rotterdam, Netherlands", "Shanghai, China", "Houston, USA", "Hamburg, Germany", "Singapore", "Manila, Philippines"]
+JOB_TITLES = ["Software Engineer", "Data Analyst", "Project Manager", "Logistics Coordinator", "Accountant", "Sales Executive"]
+SKILLS = ["Python", "SQL", "Excel", "Project Management", "Negotiation", "Java", "Power BI", "SAP", "Customer Service"]
+PRODUCTS = ["Frozen chicken breast", "Frozen beef cuts", "Orange juice concentrate", "Raw cane sugar", "Soybean meal", "Coffee beans"]
+ITEMS = ["Laptop 14in", "Office chair", "Network switch 24 port", "Monitor 27in", "Printer toner", "Server rack 42U", "UPS 3kVA"]
+
+
+# Lines of a synthetic document of each type, a header the size of a page and a body repeated until the
+# document has the requested number of pages. The values are random but only depend on the seed.
+def _resume(rng):
+    name = "%s %s" % (rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES))
+    header = [
+        name.upper(),
+        "Email: %s@example.com  Phone: +1 555 %04d" % (name.lower().replace(" ", "."), rng.randrange(10000)),
+        "Address: %s" % rng.choice(CITIES),
+        "",
+        "PROFESSIONAL SUMMARY",
+        "Experienced %s with a record of delivering results." % rng.choice(JOB_TITLES).lower(),
+        "",
+        "EDUCATION",
+        "Bachelor of Science in Computer Science, State University, %d" % rng.randrange(1995, 2020),
+        "",
+        "TECHNICAL SKILLS",
+        ", ".join(rng.sample(SKILLS, 5)),
+        "",
+        "CERTIFICATIONS",
+        "Certified %s Professional, %d" % (rng.choice(SKILLS), rng.randrange(2010, 2023)),
+        "",
+        "WORK EXPERIENCE",
+    ]
+
+    def body():
+        start = rng.randrange(2000, 2020)
+        return [
+            "%s - %s" % (rng.choice(JOB_TITLES), rng.choice(COMPANIES)),
+            "%d - %d" % (start, start + rng.randrange(1, 5)),
+            "- Led a team of %d people on the %s project." % (rng.randrange(2, 20), rng.choice(SKILLS)),
+            "- Reduced processing time by %d%% by automating reports." % rng.randrange(5, 60),
+            "- Worked with stakeholders to define requirements and deliverables.",
+            "",
+        ]
+    return header, body
+
+
+def _bill_of_lading(rng):
+    header = [
+        "SEA WAYBILL",
+        "SLWB No. %s%08d" % (rng.choice(["MAEU", "MSCU", "CMAU"]), rng.randrange(10 ** 8)),
+        "Shipper: %s, %s" % (rng.choice(COMPANIES), rng.choice(CITIES)),
+        "Consignee: %s, %s" % (rng.choice(COMPANIES), rng.choice(CITIES)),
+        "Notify Party: Same as consignee",
+        "Vessel: %s %s  Voyage No. %03dW" % (rng.choice(["MSC", "MAERSK", "CMA CGM"]), rng.choice(["AURORA", "ELBA", "TITAN"]), rng.randrange(1000)),
+        "Port of Loading: %s" % rng.choice(CITIES),
+        "Port of Discharge: %s" % rng.choice(CITIES),
+        "Freight: PREPAID  Freight payable at: %s" % rng.choice(CITIES),
+        "Place and date of issue: %s, %02d/%02d/2023" % (rng.choice(CITIES), rng.randrange(1, 29), rng.randrange(1, 13)),
+        "",
+        "MARKS AND NUMBERS / NUMBER AND KIND OF PACKAGES / DESCRIPTION OF GOODS / GROSS WEIGHT",
+    ]
+
+    def body():
+        cartons = rng.randrange(100, 3000)
+        return [
+            "Container %s%07d  Seal %06d" % (rng.choice(["MSKU", "TGHU", "CMAU"]), rng.randrange(10 ** 7), rng.randrange(10 ** 6)),
+            "%d CARTONS OF %s" % (cartons, rng.choice(PRODUCTS).upper()),
+            "Net weight: %.2f KG  Gross weight: %.2f KG" % (cartons * 18.5, cartons * 19.2),
+            "Temperature: -18 C  NCM: %04d.%02d.%02d" % (rng.randrange(10000), rng.randrange(100), rng.randrange(100)),
+            "",
+        ]
+    return header, body
+
+
+def _procurement(rng):
+    header = [
+        "QUOTATION",
+        "Quote Number: Q-%06d" % rng.randrange(10 ** 6),
+        "Quote Date: %02d/%02d/2023  Expiration Date: %02d/%02d/2023" % (rng.randrange(1, 29), rng.randrange(1, 7), rng.randrange(1, 29), rng.randrange(7, 13)),
+        "Customer: %s  Customer Number: C%05d" % (rng.choice(COMPANIES), rng.randrange(10 ** 5)),
+        "Payment Method: Net 30",
+        "Sales Rep: %s %s" % (rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)),
+        "Bill To: %s" % rng.choice(CITIES),
+        "Ship To: %s" % rng.choice(CITIES),
+        "",
+        "PRODUCT NAME / QTY / LIST PRICE / UNIT PRICE / NET PRICE / MARK UP",
+    ]
+
+    def body():
+        qty = rng.randrange(1, 200)
+        price = rng.randrange(20, 3000)
+        return ["%s / %d / %.2f / %.2f / %.2f / %d%%" % (rng.choice(ITEMS), qty, price * 1.2, price, price * qty, rng.randrange(5, 30))]
+    return header, body
+
+
+GENERATORS = {
+    'Resume': _resume,
+    'Bill of loading': _bill_of_lading,
+    'Procurement': _procurement,
+}
+
+
+# The text lines of every page of a synthetic document of the given type
+def synthetic_pages(doc_type, pages, seed=0):
+    rng = random.Random("%s-%d-%d" % (doc_type, pages, seed))
+    header, body = GENERATORS[doc_type](rng)
+    lines = list(header)
+    while len(lines) < pages * LINES_PER_PAGE:
+        lines.extend(body())
+    return [lines[i * LINES_PER_PAGE:(i + 1) * LINES_PER_PAGE] for i in range(pages)]
+
+
+def _escape(line):
+    return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+# A minimal valid pdf with one Helvetica text line per entry of every page
+def make_pdf(pages):
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for lines in pages:
+        content = "BT /F1 10 Tf 40 770 Td 12 TL " + " ".join("(%s) '" % _escape(line) for line in lines) + " ET"
+        objects.append("<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content))
+        objects.append("<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects))
+        kids.append(len(objects))
+    objects[1] = "<< /Type /Pages /Kids [%s] /Count %d >>" % (" ".join("%d 0 R" % kid for kid in kids), len(kids))
+
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += ("%d 0 obj\n%s\nendobj\n" % (number, body)).encode("latin-1")
+    xref = len(out)
+    out += ("xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)).encode("latin-1")
+    out += "".join("%010d 00000 n \n" % offset for offset in offsets).encode("latin-1")
+    out += ("trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)).encode("latin-1")
+    return out
+
+
+def synthetic_pdf(doc_type, pages, seed=0):
+    return make_pdf(synthetic_pages(doc_type, pages, seed))
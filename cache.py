@@ -0,0 +1,123 @@
+import os
+import json
+import shutil
+import hashlib
+
+
+# On-disk cache for the extracted page texts, the chunks and the FAISS index of an uploaded pdf.
+# Every entry lives in its own folder named after a hash of the pdf bytes, the splitter
+# settings and the embedding model, so changing any of them never serves a stale index.
+class DocumentCache:
+    def __init__(self, root=None, max_bytes=None):
+        self.root = root or os.getenv("PDF_CACHE_DIR", os.path.join(".cache", "documents"))
+        if max_bytes is None:
+            max_bytes = int(os.getenv("PDF_CACHE_MAX_MB", "512")) * 1024 * 1024
+        self.max_bytes = max_bytes
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def make_key(pdf_bytes, splitter_settings, embedding_model):
+        digest = hashlib.sha256(pdf_bytes)
+        digest.update(json.dumps(splitter_settings, sort_keys=True).encode("utf-8"))
+        digest.update(embedding_model.encode("utf-8"))
+        return digest.hexdigest()
+
+    def _path(self, key, *parts):
+        return os.path.join(self.root, key, *parts)
+
+    # The modification time of the 'access' file is what the LRU eviction orders by
+    def _touch(self, key):
+        marker = self._path(key, "access")
+        with open(marker, "a"):
+            os.utime(marker, None)
+
+    def _write(self, key, name, content):
+        os.makedirs(self._path(key), exist_ok=True)
+        tmp = self._path(key, name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp, self._path(key, name))
+        self._touch(key)
+        self._evict(keep=key)
+
+    def _read(self, key, name):
+        try:
+            with open(self._path(key, name), encoding="utf-8") as f:
+                content = f.read()
+        except FileNotFoundError:
+            return None
+        self._touch(key)
+        return content
+
+    def load_pages(self, key):
+        content = self._read(key, "pages.json")
+        return [tuple(page) for page in json.loads(content)] if content is not None else None
+
+    def save_pages(self, key, pages):
+        self._write(key, "pages.json", json.dumps(pages))
+
+    def load_chunks(self, key):
+        content = self._read(key, "chunks.json")
+        return json.loads(content) if content is not None else None
+
+    def save_chunks(self, key, chunks):
+        self._write(key, "chunks.json", json.dumps(chunks))
+
+    def load_index(self, key, embeddings):
+        folder = self._path(key, "index")
+        if not os.path.exists(os.path.join(folder, "index.faiss")):
+            return None
+        self._touch(key)
+        from langchain.vectorstores import FAISS
+        return FAISS.load_local(folder, embeddings)
+
+    def save_index(self, key, knowledge_base):
+        # Save next to the final folder first so a crash never leaves a half written index behind
+        folder = self._path(key, "index")
+        tmp = folder + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        knowledge_base.save_local(tmp)
+        shutil.rmtree(folder, ignore_errors=True)
+        os.replace(tmp, folder)
+        self._touch(key)
+        self._evict(keep=key)
+
+    def _entry_size(self, key):
+        size = 0
+        for dirpath, _, filenames in os.walk(self._path(key)):
+            for filename in filenames:
+                try:
+                    size += os.path.getsize(os.path.join(dirpath, filename))
+                except OSError:
+                    pass
+        return size
+
+    def _last_access(self, key):
+        try:
+            return os.path.getmtime(self._path(key, "access"))
+        except OSError:
+            return 0
+
+    # Remove the least recently used entries until the cache fits in max_bytes again
+    def _evict(self, keep=None):
+        entries = []
+        total = 0
+        for key in os.listdir(self.root):
+            if not os.path.isdir(self._path(key)):
+                continue
+            size = self._entry_size(key)
+            total += size
+            entries.append((self._last_access(key), key, size))
+
+        entries.sort()
+        for _, key, size in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self._path(key), ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+        os.makedirs(self.root, exist_ok=True)
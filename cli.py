@@ -0,0 +1,127 @@
+import os
+import sys
+import glob
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dotenv import load_dotenv
+from prompts import QUERIES
+
+
+load_dotenv()
+
+_engine = None
+
+
+def _init_worker(backend, model, embeddings, api_base, requests_per_minute, tokens_per_minute, response_cache):
+    global _engine
+    from engine import ExtractionEngine, OpenAIBackend
+    from llm_executor import AsyncLLMExecutor
+    from response_cache import ResponseCache
+
+    # The stub answers locally, the rate limits of the api don't apply to it
+    if backend == "stub":
+        from fakes import StubLLMBackend
+        llm_backend = StubLLMBackend()
+    else:
+        llm_backend = AsyncLLMExecutor(
+            OpenAIBackend(model, api_key=os.getenv("OPENAI_API_KEY"), api_base=api_base, max_retries=0), requests_per_minute, tokens_per_minute
+        )
+    response_cache = ResponseCache() if response_cache else None
+
+    if embeddings == "fake":
+        from fakes import DeterministicFakeEmbeddings
+        from embedding_cache import CachedEmbeddings
+        _engine = ExtractionEngine(
+            llm_backend, embeddings=CachedEmbeddings(DeterministicFakeEmbeddings(), "fake"), embedding_model="fake",
+            extract_workers=1, response_cache=response_cache
+        )
+    elif embeddings == "local":
+        _engine = ExtractionEngine(llm_backend, extract_workers=1, response_cache=response_cache, retrieval="local")
+    else:
+        # Files are already processed in parallel, so every file extracts its pages on a single process
+        _engine = ExtractionEngine(llm_backend, extract_workers=1, response_cache=response_cache)
+
+
+def _process_file(path, doc_type, check_doc_type=False):
+    with open(path, "rb") as f:
+        pdf_bytes = f.read()
+    record = _engine.process(pdf_bytes, doc_type, check_doc_type)
+    record["file"] = path
+    return record
+
+
+# Expands the directories and glob patterns given on the command line into a sorted list of pdf files
+def find_pdfs(inputs):
+    files = set()
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "**", "*.pdf")
+        files.update(path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path))
+    return sorted(files)
+
+
+# The output file doubles as the checkpoint: files that already have a record in it are skipped on the next run.
+# A rejected pdf is done like an extracted one, only errors are processed again with retry_errors.
+def load_checkpoint(output, retry_errors=False):
+    done = set()
+    if not os.path.exists(output):
+        return done
+    with open(output, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A line cut short by a crash mid write, the file is simply processed again
+                continue
+            if record.get("status") != "error" or not retry_errors:
+                done.add(record["file"])
+    return done
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract structured data from a batch of pdfs into a JSONL file.")
+    parser.add_argument("inputs", nargs="+", help="directories or glob patterns of the pdfs to process")
+    parser.add_argument("--doc-type", required=True, choices=list(QUERIES))
+    parser.add_argument("--output", default="results.jsonl", help="JSONL file one record per pdf is appended to")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--model", default="gpt-3.5-turbo")
+    parser.add_argument("--backend", default="openai", choices=["openai", "stub"], help="'stub' answers locally without calling the api")
+    parser.add_argument("--embeddings", default="openai", choices=["openai", "fake", "local"], help="'fake' embeds locally without calling the api, 'local' searches the chunks with TF-IDF and BM25 instead of embeddings")
+    parser.add_argument("--api-base", default=None, help="url of an OpenAI compatible api to send the chat requests to")
+    parser.add_argument("--requests-per-minute", type=int, default=int(os.getenv("LLM_REQUESTS_PER_MINUTE", "3500")))
+    parser.add_argument("--tokens-per-minute", type=int, default=int(os.getenv("LLM_TOKENS_PER_MINUTE", "90000")))
+    parser.add_argument("--no-response-cache", action="store_true", help="always call the model instead of reusing cached responses")
+    parser.add_argument("--check-doc-type", action="store_true", help="classify every pdf locally first, extract the ones that are clearly another template with that one and reject the ones that are clearly none of them without calling the api")
+    parser.add_argument("--retry-errors", action="store_true", help="process the files whose last record is an error again")
+    args = parser.parse_args(argv)
+
+    done = load_checkpoint(args.output, args.retry_errors)
+    files = [path for path in find_pdfs(args.inputs) if path not in done]
+    print("%d files to process, %d already done" % (len(files), len(done)), file=sys.stderr)
+
+    # Every worker process gets its own share of the rate limits
+    workers = max(1, min(args.workers, len(files)))
+    limits = (max(1, args.requests_per_minute // workers), max(1, args.tokens_per_minute // workers))
+
+    failed = 0
+    with open(args.output, "a", encoding="utf-8") as out, ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(args.backend, args.model, args.embeddings, args.api_base, *limits, not args.no_response_cache)
+    ) as executor:
+        futures = {executor.submit(_process_file, path, args.doc_type, args.check_doc_type): path for path in files}
+        for i, future in enumerate(as_completed(futures), 1):
+            try:
+                record = future.result()
+            except Exception as e:
+                record = {"file": futures[future], "doc_type": args.doc_type, "status": "error", "error": "%s: %s" % (type(e).__name__, e)}
+            if record["status"] == "error":
+                failed += 1
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+            print("[%d/%d] %s %s" % (i, len(files), record["status"], record["file"]), file=sys.stderr)
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,96 @@
+import os
+import functools
+
+
+# Model clients are built once per process for every configuration and shared by all requests and sessions,
+# so a request only pays for its own round trip. langchain and openai take seconds to import, they are
+# imported the first time a client is needed instead of when the app starts.
+
+
+# One keep-alive connection pool for every openai request of the process. openai otherwise opens a
+# session per thread, and the thread pools of the embedding and map-reduce calls start new threads every time.
+# The pool outlives the sessions, openai closes a thread's session every few minutes and that mustn't
+# drop the connections of the other threads.
+@functools.lru_cache(maxsize=None)
+def get_http_adapter():
+    from requests.adapters import HTTPAdapter
+    from openai.api_requestor import MAX_CONNECTION_RETRIES
+
+    class SharedAdapter(HTTPAdapter):
+        def close(self):
+            pass
+
+    pool_size = int(os.getenv("OPENAI_POOL_SIZE", "16"))
+    return SharedAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=MAX_CONNECTION_RETRIES)
+
+
+# A session like the one openai makes for every thread, with its proxy and connection retries, on the shared pool
+def make_http_session():
+    import openai
+    import requests
+    session = requests.Session()
+    if isinstance(openai.proxy, str):
+        session.proxies = {"http": openai.proxy, "https": openai.proxy}
+    elif openai.proxy:
+        session.proxies = dict(openai.proxy)
+    session.mount("https://", get_http_adapter())
+    session.mount("http://", get_http_adapter())
+    return session
+
+
+# openai calls a callable requestssession for every thread's session instead of sharing one session object
+def install_http_session():
+    import openai
+    if openai.requestssession is None:
+        openai.requestssession = make_http_session
+
+
+@functools.lru_cache(maxsize=None)
+def get_chat_model(model, api_key=None, max_tokens=2048, api_base=None, max_retries=6, request_timeout=None, streaming=False):
+    install_http_session()
+    from langchain.chat_models import ChatOpenAI
+    return ChatOpenAI(
+        max_tokens=max_tokens, model_name=model, openai_api_key=api_key, openai_api_base=api_base,
+        max_retries=max_retries, request_timeout=request_timeout, streaming=streaming
+    )
+
+
+# The chain holds no state of its own between runs, the documents, question and callbacks are passed to run()
+@functools.lru_cache(maxsize=None)
+def get_qa_chain(model, api_key=None, max_tokens=2048, api_base=None, max_retries=6, request_timeout=None, streaming=False):
+    from langchain.chains.question_answering import load_qa_chain
+    return load_qa_chain(get_chat_model(model, api_key, max_tokens, api_base, max_retries, request_timeout, streaming), chain_type='stuff')
+
+
+@functools.lru_cache(maxsize=None)
+def get_embeddings(model, api_key=None):
+    install_http_session()
+    from langchain.embeddings.openai import OpenAIEmbeddings
+    from embedding_cache import CachedEmbeddings
+    return CachedEmbeddings(OpenAIEmbeddings(model=model, openai_api_key=api_key), model)
+
+
+@functools.lru_cache(maxsize=None)
+def _token_callback_class():
+    from langchain.callbacks.base import BaseCallbackHandler
+
+    # Passes every token the model streams to on_token
+    class TokenCallback(BaseCallbackHandler):
+        def __init__(self, on_token):
+            self.on_token = on_token
+
+        def on_llm_new_token(self, token, **kwargs):
+            self.on_token(token)
+
+    return TokenCallback
+
+
+def token_callback(on_token):
+    return _token_callback_class()(on_token)
+
+
+# The error openai raises for a request the model refuses, like one over its context length.
+# An except clause only evaluates it once something was raised, by then openai is loaded.
+def invalid_request_error():
+    import openai
+    return openai.error.InvalidRequestError
@@ -0,0 +1,171 @@
+import os
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from tokens import count_tokens
+
+
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-3.5-turbo": 4096,
+    "gpt-3.5-turbo-16k": 16384,
+    "text-davinci-003": 4097,
+    "gpt-4": 8192,
+    "gpt-4-32k": 32768,
+}
+
+# Tokens taken by the qa chain's own instructions around the context and the question, with some margin
+PROMPT_OVERHEAD = 150
+# Completion tokens of a map step's answer. It only covers one part of the document, so it needs far less
+# room than the final answer and the rest of the window is left to the chunks.
+MAP_MAX_TOKENS = int(os.getenv("MAP_REDUCE_MAX_TOKENS", "768"))
+
+REDUCE_QUESTION = '''The context holds answers to the question below, each one taken from a different part of the same document.
+Combine them into one complete answer, keep every detail they contain and follow the format the question asks for exactly.
+
+Question: {question}'''
+
+
+# Fills the model's context window up to a token budget before the call is made, so
+# "Maximum context length exceeded" is never found out after a paid round trip.
+# The budget is the window minus the completion's max_tokens, the question and the prompt overhead.
+class ContextAssembler:
+    def __init__(self, model, max_tokens, context_window=None):
+        self.model = model
+        self.max_tokens = max_tokens or 0
+        self.context_window = context_window or MODEL_CONTEXT_WINDOWS.get(model, 4096)
+
+    def count(self, text):
+        return count_tokens(text, self.model)
+
+    def budget(self, question):
+        return self.context_window - self.max_tokens - self.count(question) - PROMPT_OVERHEAD
+
+    # The assembler of the map step's calls, whose answers are given fewer tokens
+    def map_step(self):
+        return ContextAssembler(self.model, min(self.max_tokens, MAP_MAX_TOKENS) or MAP_MAX_TOKENS, self.context_window)
+
+    # Drops chunks whose text, ignoring case and whitespace, was already seen or is part of an earlier chunk.
+    # Only the earlier chunks having the rarest of its words are searched for a chunk, its first and
+    # last word are left out since they can be the cut off end of a word of the chunk containing it.
+    @staticmethod
+    def dedupe(docs):
+        seen = set()
+        kept = []
+        kept_texts = []
+        by_word = {}
+        for doc in docs:
+            words = doc.page_content.lower().split()
+            normalized = " ".join(words)
+            digest = hashlib.sha1(normalized.encode("utf-8")).digest()
+            if digest in seen:
+                continue
+            interior = set(words[1:-1])
+            if interior:
+                candidates = min((by_word.get(word, ()) for word in interior), key=len)
+            else:
+                candidates = range(len(kept_texts))
+            if any(normalized in kept_texts[i] for i in candidates):
+                continue
+            seen.add(digest)
+            for word in set(words):
+                by_word.setdefault(word, []).append(len(kept_texts))
+            kept.append(doc)
+            kept_texts.append(normalized)
+        return kept
+
+    # Takes the chunks in the given (ranked) order while they fit the budget.
+    # Returns the chunks taken and whether all of them fit.
+    def pack(self, docs, question):
+        docs = self.dedupe(docs)
+        remaining = self.budget(question)
+        packed = []
+        for doc in docs:
+            tokens = self.count(doc.page_content)
+            if tokens <= remaining:
+                packed.append(doc)
+                remaining -= tokens
+        return packed, len(packed) == len(docs)
+
+    # Splits the chunks into consecutive groups that each fit the budget on their own,
+    # a chunk bigger than the budget is split into pieces that do
+    def groups(self, docs, question):
+        budget = self.budget(question)
+        groups = [[]]
+        used = 0
+        for doc in docs:
+            for piece in self.split(doc, budget):
+                tokens = self.count(piece.page_content)
+                if groups[-1] and used + tokens > budget:
+                    groups.append([])
+                    used = 0
+                groups[-1].append(piece)
+                used += tokens
+        return groups
+
+    # The chunk in consecutive pieces of its words that each fit 'budget' tokens
+    def split(self, doc, budget):
+        words = doc.page_content.split(" ")
+        parts = -(-self.count(doc.page_content) // max(budget, 1))
+        if parts <= 1:
+            return [doc]
+        from langchain.docstore.document import Document
+        while True:
+            size = -(-len(words) // parts)
+            pieces = [" ".join(words[i:i + size]) for i in range(0, len(words), size)]
+            if size == 1 or all(self.count(piece) <= budget for piece in pieces):
+                return [Document(page_content=piece, metadata=doc.metadata) for piece in pieces]
+            parts += 1
+
+    # The chunks a map-reduce pass over at most 'max_groups' groups answers from: the best 'ranked'
+    # ones that fit, in their order in 'ordered', the document's chunks in pdf order
+    def select(self, ranked, ordered, question, max_groups):
+        position = {}
+        for i, doc in enumerate(ordered):
+            position.setdefault(doc.page_content, i)
+        remaining = self.budget(question) * max_groups
+        chosen = []
+        for doc in self.dedupe(ranked):
+            tokens = self.count(doc.page_content)
+            if tokens <= remaining:
+                chosen.append(doc)
+                remaining -= tokens
+        # The groups don't quite fill their budget, the worst ranked chunks go until they fit
+        while True:
+            selected = sorted(chosen, key=lambda doc: position.get(doc.page_content, len(position)))
+            if len(chosen) <= 1 or len(self.groups(selected, question)) <= max_groups:
+                return selected
+            chosen.pop()
+
+
+# Answers the question over every group of chunks in parallel, then combines the partial answers.
+# The groups are answered with the map step's smaller max_tokens, so they can be bigger and fewer.
+# When the partial answers don't fit in one call either they are combined in groups again,
+# and if that stops making progress only the answers that fit are combined.
+# Only the final answer is streamed to on_token.
+def map_reduce(backend, assembler, docs, question, concurrency=None, on_token=None):
+    concurrency = concurrency or int(os.getenv("MAP_REDUCE_CONCURRENCY", "8"))
+    reduce_question = REDUCE_QUESTION.format(question=question)
+    map_assembler = assembler.map_step()
+
+    def answer_all(groups, query, max_tokens=None):
+        def answer(group):
+            if max_tokens is not None:
+                return backend.answer(group, query, max_tokens=max_tokens)
+            return backend.answer(group, query)
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(groups))) as executor:
+            return list(executor.map(answer, groups))
+
+    def answer_final(partials):
+        if on_token is not None:
+            return backend.answer(partials, reduce_question, on_token=on_token)
+        return backend.answer(partials, reduce_question)
+
+    from langchain.docstore.document import Document
+    answers = answer_all(map_assembler.groups(docs, question), question, map_assembler.max_tokens)
+    while True:
+        partials = [Document(page_content=answer) for answer in answers]
+        groups = assembler.groups(partials, reduce_question)
+        if len(groups) == 1:
+            return answer_final(partials)
+        if len(groups) == len(partials):
+            return answer_final(assembler.pack(partials, reduce_question)[0])
+        answers = answer_all(groups, reduce_question)
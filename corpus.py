@@ -0,0 +1,362 @@
+import os
+import time
+import math
+import sqlite3
+import threading
+import numpy as np
+import faiss
+
+
+# Number of vectors before the flat index is replaced by an IVF index
+TRAIN_THRESHOLD = 10000
+# Retrain once the corpus has grown this many times past the size the IVF index was trained on
+RETRAIN_GROWTH = 4
+# Compact the vectors file once this share of its rows belong to deleted documents
+COMPACT_RATIO = 0.25
+# Filters matching at most this many chunks are searched exactly on their vectors instead of through the index
+EXACT_SEARCH_LIMIT = 20000
+
+
+# Persistent index over the chunks of every document ingested so far, so questions can be asked across all of them.
+# Documents are added and deleted incrementally: the chunk texts and document metadata live in sqlite,
+# the normalized vectors in a raw float32 file that is memory-mapped, and the faiss index next to them
+# is memory-mapped at load as well. The index starts flat and is swapped for an IVF index
+# (which, unlike HNSW, supports removing vectors) once the corpus is big enough to need one.
+# sqlite is the source of truth: rows of the vectors file past its committed row count are left overs of an
+# add that failed and are overwritten by the next one, and an index file that doesn't hold every chunk
+# sqlite has, because the process died before it was saved, is rebuilt from the vectors at load.
+class CorpusIndex:
+    def __init__(self, embeddings, root=None, nprobe=None):
+        self.embeddings = embeddings
+        self.root = root or os.getenv("CORPUS_DIR", os.path.join(".cache", "corpus"))
+        self.nprobe = nprobe or int(os.getenv("CORPUS_NPROBE", "16"))
+        os.makedirs(self.root, exist_ok=True)
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(os.path.join(self.root, "corpus.sqlite"), timeout=60, check_same_thread=False, isolation_level=None)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS documents (doc_id TEXT PRIMARY KEY, name TEXT, doc_type TEXT, uploaded_at REAL)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS chunks (id INTEGER PRIMARY KEY, doc_id TEXT, row INTEGER, page INTEGER, text TEXT)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS chunks_doc ON chunks (doc_id)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS documents_type ON documents (doc_type, uploaded_at)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value REAL)")
+        self.index = None
+        self.mmapped = False
+        self._vectors = None
+        self._chunks = None
+        self._load()
+
+    def _path(self, name):
+        return os.path.join(self.root, name)
+
+    def _meta(self, key, default=0):
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else default
+
+    def _set_meta(self, key, value):
+        self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    # Compaction writes the live rows to a new file and switches to it in the same commit that renumbers them
+    def _vectors_path(self, generation=None):
+        generation = int(self._meta("generation")) if generation is None else generation
+        return self._path("vectors.f32" if generation == 0 else "vectors.%d.f32" % generation)
+
+    @property
+    def dim(self):
+        return int(self._meta("dim")) or None
+
+    def _load(self):
+        if os.path.exists(self._path("index.faiss")):
+            # A memory-mapped index is read only, _writable loads it fully before the first change
+            self.index = faiss.read_index(self._path("index.faiss"), faiss.IO_FLAG_MMAP)
+            self.mmapped = True
+        elif self.dim:
+            self.index = self._flat_index(self.dim)
+        chunks = self.db.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+        if self.index is not None and self.index.ntotal != chunks:
+            self._rebuild()
+
+    def _rebuild(self):
+        ids, vectors = self._live_vectors()
+        self.index = self._flat_index(self.dim)
+        self.mmapped = False
+        self._set_meta("trained_on", 0)
+        if len(ids):
+            self.index.add_with_ids(vectors, ids)
+        self.maybe_train()
+        self.save()
+
+    @staticmethod
+    def _flat_index(dim):
+        return faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+
+    def _writable(self):
+        if self.mmapped:
+            self.index = faiss.read_index(self._path("index.faiss"))
+            self.mmapped = False
+        return self.index
+
+    # Memory map of the vectors file, row i holds the vector of the chunk whose 'row' is i
+    def vectors(self):
+        rows = int(self._meta("rows"))
+        if self._vectors is None or len(self._vectors) != rows:
+            if rows == 0:
+                return np.zeros((0, self.dim or 0), dtype=np.float32)
+            self._vectors = np.memmap(self._vectors_path(), dtype=np.float32, mode="r", shape=(rows, self.dim))
+        return self._vectors
+
+    @staticmethod
+    def _normalize(vectors):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        faiss.normalize_L2(vectors)
+        return vectors
+
+    def has_document(self, doc_id):
+        return self.db.execute("SELECT 1 FROM documents WHERE doc_id = ?", (doc_id,)).fetchone() is not None
+
+    # Adds a document's chunks, replacing the document if it was added before.
+    # Pass the vectors when they are already known, otherwise the chunks are embedded.
+    # The index is saved afterwards unless 'save' is False, for bulk loads that call save() once at the end.
+    def add_document(self, doc_id, chunks, name=None, doc_type=None, pages=None, uploaded_at=None, vectors=None, save=True):
+        if vectors is None:
+            vectors = self.embeddings.embed_documents(chunks)
+        vectors = self._normalize(vectors)
+        pages = pages or [None] * len(chunks)
+
+        with self.lock:
+            if self.has_document(doc_id):
+                self.delete_document(doc_id, save=False)
+            if self.index is None:
+                self._set_meta("dim", vectors.shape[1])
+                self.index = self._flat_index(vectors.shape[1])
+
+            first_row = int(self._meta("rows"))
+            first_id = int(self._meta("next_id"))
+            with open(self._vectors_path(), "ab") as f:
+                # Drops the rows of an add that never committed, the new rows start where sqlite says they do
+                f.truncate(first_row * vectors.shape[1] * vectors.itemsize)
+                f.write(vectors.tobytes())
+
+            ids = np.arange(first_id, first_id + len(chunks), dtype=np.int64)
+            self.db.execute("BEGIN")
+            try:
+                document = self.db.execute(
+                    "INSERT INTO documents (doc_id, name, doc_type, uploaded_at) VALUES (?, ?, ?, ?)",
+                    (doc_id, name, doc_type, uploaded_at or time.time())
+                ).lastrowid
+                self.db.executemany(
+                    "INSERT INTO chunks (id, doc_id, row, page, text) VALUES (?, ?, ?, ?, ?)",
+                    [(int(ids[i]), doc_id, first_row + i, pages[i], chunk) for i, chunk in enumerate(chunks)]
+                )
+                self._set_meta("rows", first_row + len(chunks))
+                self._set_meta("next_id", first_id + len(chunks))
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+            if self._chunks is not None:
+                documents, rows = self._chunks
+                self._chunks = (
+                    np.concatenate([documents, np.full(len(chunks), document, dtype=np.int64)]),
+                    np.concatenate([rows, np.arange(first_row, first_row + len(chunks), dtype=np.int64)]),
+                )
+
+            self._writable().add_with_ids(vectors, ids)
+            self.maybe_train()
+            if save:
+                self.save()
+
+    def delete_document(self, doc_id, save=True):
+        with self.lock:
+            ids = np.array([row[0] for row in self.db.execute("SELECT id FROM chunks WHERE doc_id = ?", (doc_id,))], dtype=np.int64)
+            self.db.execute("BEGIN")
+            self.db.execute("DELETE FROM chunks WHERE doc_id = ?", (doc_id,))
+            self.db.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+            self._set_meta("dead_rows", self._meta("dead_rows") + len(ids))
+            self.db.execute("COMMIT")
+            if self._chunks is not None:
+                self._chunks[0][ids] = -1
+                self._chunks[1][ids] = -1
+            if len(ids):
+                self._writable().remove_ids(faiss.IDSelectorBatch(ids))
+            self.maybe_compact()
+            if save and len(ids):
+                self.save()
+
+    def _live_vectors(self):
+        rows = self.db.execute("SELECT id, row FROM chunks ORDER BY row").fetchall()
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        return ids, np.asarray(self.vectors()[[row[1] for row in rows]])
+
+    # Swaps the flat index for an IVF index once there are enough vectors, and trains it again
+    # when the corpus has outgrown the lists it was trained with
+    def maybe_train(self, force=False):
+        with self.lock:
+            count = self.index.ntotal if self.index is not None else 0
+            trained_on = self._meta("trained_on")
+            if not force and (count < TRAIN_THRESHOLD or (trained_on and count < trained_on * RETRAIN_GROWTH)):
+                return False
+
+            ids, vectors = self._live_vectors()
+            # About sqrt(n) lists, with the 39 training points per list faiss asks for
+            nlist = max(1, min(int(math.sqrt(len(ids))), len(ids) // 39))
+            quantizer = faiss.IndexFlatIP(self.dim)
+            index = faiss.IndexIVFFlat(quantizer, self.dim, nlist, faiss.METRIC_INNER_PRODUCT)
+            sample = vectors[np.random.default_rng(0).permutation(len(vectors))[:nlist * 64]]
+            index.train(sample)
+            index.add_with_ids(vectors, ids)
+            self.index = index
+            self.mmapped = False
+            self._set_meta("trained_on", len(ids))
+            return True
+
+    # Rewrites the vectors file without the rows of deleted documents once they take up too much of it
+    def maybe_compact(self, force=False):
+        with self.lock:
+            rows = self._meta("rows")
+            if not rows or (not force and self._meta("dead_rows") / rows < COMPACT_RATIO):
+                return False
+
+            ids, vectors = self._live_vectors()
+            old_path = self._vectors_path()
+            generation = int(self._meta("generation")) + 1
+            with open(self._vectors_path(generation), "wb") as f:
+                f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+            self.db.execute("BEGIN")
+            try:
+                self.db.executemany("UPDATE chunks SET row = ? WHERE id = ?", [(i, int(chunk_id)) for i, chunk_id in enumerate(ids)])
+                self._set_meta("rows", len(ids))
+                self._set_meta("dead_rows", 0)
+                self._set_meta("generation", generation)
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+            self._vectors = None
+            self._chunks = None
+            os.remove(old_path)
+            return True
+
+    def save(self):
+        with self.lock:
+            if self.index is None or self.mmapped:
+                return
+            tmp = self._path("index.faiss.tmp")
+            faiss.write_index(self.index, tmp)
+            os.replace(tmp, self._path("index.faiss"))
+
+    # For every chunk id, the rowid of its document and the row of its vector, -1 once deleted.
+    # Kept in memory so a filter is turned into chunk ids with numpy instead of a join over every chunk.
+    def _chunk_table(self):
+        if self._chunks is None:
+            size = int(self._meta("next_id"))
+            documents = np.full(size, -1, dtype=np.int64)
+            rows = np.full(size, -1, dtype=np.int64)
+            table = self.db.execute("SELECT c.id, d.rowid, c.row FROM chunks c JOIN documents d ON d.doc_id = c.doc_id").fetchall()
+            if table:
+                table = np.array(table, dtype=np.int64)
+                documents[table[:, 0]] = table[:, 1]
+                rows[table[:, 0]] = table[:, 2]
+            self._chunks = (documents, rows)
+        return self._chunks
+
+    # The chunk ids allowed by the metadata filters, None when there is no filter
+    def _filter_ids(self, doc_types=None, uploaded_after=None, uploaded_before=None, doc_ids=None):
+        conditions = []
+        params = []
+        if doc_types:
+            conditions.append("doc_type IN (%s)" % ",".join("?" * len(doc_types)))
+            params.extend(doc_types)
+        if uploaded_after is not None:
+            conditions.append("uploaded_at >= ?")
+            params.append(uploaded_after)
+        if uploaded_before is not None:
+            conditions.append("uploaded_at < ?")
+            params.append(uploaded_before)
+        if doc_ids:
+            conditions.append("doc_id IN (%s)" % ",".join("?" * len(doc_ids)))
+            params.extend(doc_ids)
+        if not conditions:
+            return None
+        allowed = [row[0] for row in self.db.execute("SELECT rowid FROM documents WHERE " + " AND ".join(conditions), params)]
+        documents, _ = self._chunk_table()
+        return np.flatnonzero(np.isin(documents, allowed))
+
+    # Returns (Document, score) pairs of the chunks most similar to the vector, filtered on the documents' metadata
+    def search_by_vector(self, vector, k=4, **filters):
+        from langchain.docstore.document import Document
+        with self.lock:
+            if self.index is None or self.index.ntotal == 0:
+                return []
+            query = self._normalize([vector])
+            ids = self._filter_ids(**filters)
+            if ids is not None and len(ids) <= EXACT_SEARCH_LIMIT:
+                scores, found = self._exact_search(query[0], ids, k)
+            else:
+                selector = None
+                if ids is not None:
+                    # A bitmap over the chunk ids is much cheaper to build for large filters than a batch of ids
+                    mask = np.zeros(int(self._meta("next_id")), dtype=bool)
+                    mask[ids] = True
+                    bitmap = np.packbits(mask, bitorder="little")
+                    selector = faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(bitmap))
+                if isinstance(self.index, faiss.IndexIVF):
+                    params = faiss.SearchParametersIVF(sel=selector, nprobe=self.nprobe)
+                else:
+                    params = faiss.SearchParameters(sel=selector)
+                scores, found = self.index.search(query, k, params=params)
+                scores, found = scores[0], found[0]
+
+            results = []
+            for score, chunk_id in zip(scores, found):
+                if chunk_id < 0:
+                    continue
+                row = self.db.execute(
+                    "SELECT c.text, c.page, d.doc_id, d.name, d.doc_type, d.uploaded_at "
+                    "FROM chunks c JOIN documents d ON d.doc_id = c.doc_id WHERE c.id = ?", (int(chunk_id),)
+                ).fetchone()
+                if row is None:
+                    continue
+                metadata = {"doc_id": row[2], "name": row[3], "doc_type": row[4], "uploaded_at": row[5], "page": row[1]}
+                results.append((Document(page_content=row[0], metadata=metadata), float(score)))
+            return results
+
+    # A narrow filter is answered exactly, an IVF index could miss chunks outside the probed lists
+    def _exact_search(self, query, ids, k):
+        if len(ids) == 0:
+            return [], []
+        _, rows = self._chunk_table()
+        scores = np.asarray(self.vectors()[rows[ids]]) @ query
+        best = np.argsort(-scores)[:k]
+        return scores[best], ids[best]
+
+    def similarity_search_with_score(self, query, k=4, **filters):
+        return self.search_by_vector(self.embeddings.embed_query(query), k, **filters)
+
+    def similarity_search(self, query, k=4, **filters):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **filters)]
+
+    # A view of the corpus restricted to some documents, usable wherever a knowledge base is
+    def filtered(self, **filters):
+        return CorpusView(self, filters)
+
+    def documents(self):
+        return self.db.execute("SELECT doc_id, name, doc_type, uploaded_at FROM documents ORDER BY uploaded_at").fetchall()
+
+
+class CorpusView:
+    def __init__(self, corpus, filters):
+        self.corpus = corpus
+        self.filters = filters
+
+    @property
+    def index(self):
+        return self.corpus.index
+
+    def similarity_search_with_score(self, query, k=4):
+        return self.corpus.similarity_search_with_score(query, k, **self.filters)
+
+    def similarity_search(self, query, k=4):
+        return self.corpus.similarity_search(query, k, **self.filters)
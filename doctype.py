@@ -0,0 +1,167 @@
+import os
+import re
+import json
+import functools
+import numpy as np
+
+
+# The label of a document that is none of the templates
+OTHER = "Other"
+# Pages from the start of the pdf its type is told from
+CLASSIFY_PAGES = 3
+
+# Words and phrases typical of every template, each match is evidence the document is of that type.
+# The ones of 'Other' belong to documents that look like a template but aren't one, like invoices and contracts.
+KEYWORDS = {
+    'Resume': [
+        "resume", "curriculum vitae", "professional summary", "summary", "objective", "experience", "work experience",
+        "employment history", "education", "university", "college", "bachelor", "master of", "degree", "gpa",
+        "skills", "technical skills", "certifications", "certified", "references", "linkedin", "led a team",
+        "responsibilities", "stakeholders", "projects",
+    ],
+    'Bill of loading': [
+        "bill of lading", "bill of loading", "waybill", "b/l", "shipper", "consignee", "notify party", "vessel",
+        "voyage", "port of loading", "port of discharge", "place of receipt", "place of delivery", "container",
+        "seal", "freight", "prepaid", "collect", "cartons", "packages", "gross weight", "net weight",
+        "marks and numbers", "description of goods", "carrier", "ncm",
+    ],
+    'Procurement': [
+        "quotation", "quote", "quote number", "purchase order", "request for quotation", "qty", "quantity",
+        "list price", "unit price", "net price", "mark up", "subtotal", "discount", "tax", "customer",
+        "customer number", "sales rep", "bill to", "payment method", "payment terms", "net 30", "expiration date",
+        "vendor", "supplier", "product name",
+    ],
+    OTHER: [
+        "invoice", "invoice number", "invoice date", "amount due", "balance due", "due date", "remit", "receipt",
+        "agreement", "lease", "landlord", "tenant", "hereby", "minutes", "agenda", "dear", "sincerely", "abstract",
+        "introduction", "chapter", "ingredients",
+    ],
+}
+
+LAYOUT_FEATURES = ["upper_lines", "key_value_lines", "bullet_lines", "number_ratio", "email"]
+# Weights of the layout features for every template: a resume has bullet points and an email address,
+# a bill of lading has its headings in capitals and "Key: value" fields, a quote is mostly rows of numbers.
+# The share of words that are numbers still holds when the line breaks were lost in the pdf's text.
+LAYOUT_WEIGHTS = {
+    'Resume': [0.0, 0.0, 3.0, -4.0, 2.0],
+    'Bill of loading': [2.0, 2.0, 0.0, 2.0, -1.0],
+    'Procurement': [0.0, 1.0, 0.0, 6.0, -1.0],
+}
+# Logit of 'Other', the evidence a document needs before it counts as any of the templates
+OTHER_LOGIT = 3.0
+# Below this many words, like a scan without a text layer, there is too little to tell the type from
+MIN_WORDS = 20
+
+_EMAIL = re.compile(r"[\w.+-]+@[\w-]+\.[\w.]+")
+_NUMBER = re.compile(r"\d+(?:[.,]\d+)*")
+_KEY_VALUE = re.compile(r"^[A-Za-z][\w .'/()-]{0,40}:\s*\S")
+_BULLET = re.compile(r"^[-*•·▪]\s")
+
+
+# A linear model over the first pages of a document, every template gets a score from how often its
+# keywords appear and what its lines look like, and the scores are turned into probabilities with a
+# softmax over the templates and 'Other'. The default weights are set by hand from the lists above,
+# fit() tunes them on labelled documents and save() / load() keep the tuned ones in a JSON file.
+class DocTypeClassifier:
+    def __init__(self, keywords=None, weights=None, bias=None):
+        self.keywords = keywords or KEYWORDS
+        self.classes = [doc_type for doc_type in self.keywords if doc_type != OTHER] + [OTHER]
+        self.vocabulary = sorted({keyword for words in self.keywords.values() for keyword in words})
+        self.index = {keyword: i for i, keyword in enumerate(self.vocabulary)}
+        # Longest first so "unit price" is counted as itself and not as "price"
+        self.pattern = re.compile(r"\b(?:%s)\b" % "|".join(
+            re.escape(keyword).replace(r"\ ", r"\s+") for keyword in sorted(self.vocabulary, key=len, reverse=True)
+        ))
+        prior_weights, prior_bias = self._prior()
+        self.prior = prior_weights
+        self.weights = np.asarray(weights, dtype=np.float64) if weights is not None else prior_weights.copy()
+        self.bias = np.asarray(bias, dtype=np.float64) if bias is not None else prior_bias
+
+    def _prior(self):
+        weights = np.zeros((len(self.classes), len(self.vocabulary) + len(LAYOUT_FEATURES)))
+        bias = np.zeros(len(self.classes))
+        for row, doc_type in enumerate(self.classes):
+            for keyword in self.keywords.get(doc_type, []):
+                weights[row, self.index[keyword]] = 1.0
+            weights[row, len(self.vocabulary):] = LAYOUT_WEIGHTS.get(doc_type, 0.0)
+        bias[-1] = OTHER_LOGIT
+        return weights, bias
+
+    # The keyword counts, dampened with log1p, followed by the layout features of the text
+    def features(self, text):
+        counts = np.zeros(len(self.vocabulary) + len(LAYOUT_FEATURES))
+        matches = [self.index[" ".join(match.split())] for match in self.pattern.findall(text.lower())]
+        if matches:
+            counts[:len(self.vocabulary)] = np.log1p(np.bincount(matches, minlength=len(self.vocabulary)))
+
+        lines = [line.strip() for line in text.splitlines() if line.strip()]
+        if lines:
+            words = len(text.split())
+            counts[len(self.vocabulary):] = [
+                sum(line.isupper() for line in lines) / len(lines),
+                sum(bool(_KEY_VALUE.match(line)) for line in lines) / len(lines),
+                sum(bool(_BULLET.match(line)) for line in lines) / len(lines),
+                len(_NUMBER.findall(text)) / max(words, 1),
+                1.0 if _EMAIL.search(text) else 0.0,
+            ]
+        return counts
+
+    # One row of probabilities per text, in the order of self.classes
+    def predict_proba(self, texts):
+        features = np.vstack([self.features(text) for text in texts])
+        return _softmax(features @ self.weights.T + self.bias)
+
+    # The most likely type of the text and its probability
+    def predict(self, text):
+        probabilities = self.predict_proba([text])[0]
+        best = int(np.argmax(probabilities))
+        return self.classes[best], float(probabilities[best])
+
+    # The template a document the user asked to extract as 'doc_type' should be extracted with, with the
+    # predicted type and its probability. Only a prediction the classifier is 'min_confidence' sure of is acted
+    # on: another template is extracted with that one and 'Other' is rejected, the template is None then.
+    # Below that, or with less than MIN_WORDS words of text, the classifier abstains and 'doc_type' is kept,
+    # the model's own docType check decides.
+    def route(self, text, doc_type, min_confidence=None):
+        if min_confidence is None:
+            min_confidence = float(os.getenv("DOCTYPE_MIN_CONFIDENCE", "0.8"))
+        predicted, confidence = self.predict(text)
+        if confidence < min_confidence or len(text.split()) < MIN_WORDS:
+            return doc_type, predicted, confidence
+        return (None if predicted == OTHER else predicted), predicted, confidence
+
+    # Multinomial logistic regression by gradient descent from the current weights, the l2 penalty pulls
+    # the weights towards the hand set ones so keywords missing from the training documents keep theirs.
+    # 'labels' are template names or 'Other'.
+    def fit(self, texts, labels, epochs=300, learning_rate=0.5, l2=0.01):
+        features = np.vstack([self.features(text) for text in texts])
+        targets = np.zeros((len(texts), len(self.classes)))
+        targets[np.arange(len(texts)), [self.classes.index(label) for label in labels]] = 1.0
+        for _ in range(epochs):
+            gradient = (_softmax(features @ self.weights.T + self.bias) - targets) / len(texts)
+            self.weights -= learning_rate * (gradient.T @ features + l2 * (self.weights - self.prior))
+            self.bias -= learning_rate * gradient.sum(axis=0)
+        return self
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump({"keywords": self.keywords, "weights": self.weights.tolist(), "bias": self.bias.tolist()}, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            model = json.load(f)
+        return cls(model["keywords"], model["weights"], model["bias"])
+
+
+def _softmax(logits):
+    exponents = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return exponents / exponents.sum(axis=1, keepdims=True)
+
+
+# One classifier per process, the weights tuned with fit() when DOCTYPE_MODEL_PATH points to a saved model
+@functools.lru_cache(maxsize=None)
+def get_doc_type_classifier():
+    path = os.getenv("DOCTYPE_MODEL_PATH")
+    return DocTypeClassifier.load(path) if path else DocTypeClassifier()
+
@@ -0,0 +1,143 @@
+import os
+import sqlite3
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from tokens import count_tokens
+from metrics import add_embedding_tokens
+
+# Maps hash(model + chunk text) to an embedding vector.
+# The keys live in sqlite and point to a row of a raw float32 file per model that is read back memory-mapped.
+# sqlite also holds how many rows of every file were committed, rows past that are left over from a put that
+# failed or crashed before its commit and are never read.
+class EmbeddingStore:
+    def __init__(self, root=None):
+        self.root = root or os.getenv("EMBEDDING_CACHE_DIR", os.path.join(".cache", "embeddings"))
+        os.makedirs(self.root, exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(self.root, "embeddings.sqlite"), timeout=60, check_same_thread=False, isolation_level=None)
+        self.db.execute("CREATE TABLE IF NOT EXISTS models (model TEXT PRIMARY KEY, dim INTEGER, file TEXT, rows INTEGER)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS vectors (key TEXT PRIMARY KEY, row INTEGER)")
+        # Stores from before the row count was kept get it from their file size on their next put
+        if "rows" not in [column[1] for column in self.db.execute("PRAGMA table_info(models)")]:
+            self.db.execute("ALTER TABLE models ADD COLUMN rows INTEGER")
+        self._views = {}
+
+    @staticmethod
+    def make_key(model, text):
+        return hashlib.sha256((model + "\0" + text).encode("utf-8")).hexdigest()
+
+    def _model(self, model):
+        return self.db.execute("SELECT dim, file, rows FROM models WHERE model = ?", (model,)).fetchone()
+
+    # Memory map of the vectors file, remapped only when other writers have appended rows since
+    def _view(self, model, dim, file, min_rows):
+        view = self._views.get(model)
+        if view is None or len(view) < min_rows:
+            path = os.path.join(self.root, file)
+            rows = os.path.getsize(path) // (dim * 4)
+            view = np.memmap(path, dtype=np.float32, mode="r", shape=(rows, dim))
+            self._views[model] = view
+        return view
+
+    # Returns a vector for every text, None where the text isn't in the store yet
+    def get_many(self, model, texts):
+        results = [None] * len(texts)
+        with self.lock:
+            info = self._model(model)
+            if info is None:
+                return results
+            dim, file, _ = info
+            keys = [self.make_key(model, text) for text in texts]
+            rows = {}
+            # sqlite limits the number of bound parameters, so look the keys up in slices
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                query = "SELECT key, row FROM vectors WHERE key IN (%s)" % ",".join("?" * len(batch))
+                rows.update(self.db.execute(query, batch).fetchall())
+            if not rows:
+                return results
+            view = self._view(model, dim, file, max(rows.values()) + 1)
+            for i, key in enumerate(keys):
+                if key in rows:
+                    results[i] = np.array(view[rows[key]])
+        return results
+
+    def put_many(self, model, texts, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self.lock:
+            # BEGIN IMMEDIATE takes sqlite's write lock, which also serializes appends from other processes
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                info = self._model(model)
+                if info is None:
+                    info = (vectors.shape[1], "vectors-%s.f32" % hashlib.sha1(model.encode("utf-8")).hexdigest()[:16], 0)
+                    self.db.execute("INSERT INTO models (model, dim, file, rows) VALUES (?, ?, ?, ?)", (model, *info))
+                dim, file, first_row = info
+                path = os.path.join(self.root, file)
+                if first_row is None:
+                    first_row = os.path.getsize(path) // (dim * 4) if os.path.exists(path) else 0
+                with open(path, "ab") as f:
+                    # Cut off what an uncommitted put left behind so the new rows are where sqlite says they are
+                    f.truncate(first_row * dim * 4)
+                    f.write(vectors.tobytes())
+                self._views.pop(model, None)
+                self.db.executemany(
+                    "INSERT OR IGNORE INTO vectors (key, row) VALUES (?, ?)",
+                    [(self.make_key(model, text), first_row + i) for i, text in enumerate(texts)]
+                )
+                self.db.execute("UPDATE models SET rows = ? WHERE model = ?", (first_row + len(vectors), model))
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+
+
+# Wraps an embeddings model so only the chunks that were never embedded before are sent to it.
+# Misses are embedded in batches of batch_size with up to max_concurrency batches in flight.
+# It has the embed_documents and embed_query of a langchain Embeddings, which is all FAISS calls.
+class CachedEmbeddings:
+    def __init__(self, embeddings, model, store=None, batch_size=None, max_concurrency=None):
+        self.embeddings = embeddings
+        self.model = model
+        self.store = store or EmbeddingStore()
+        self.batch_size = batch_size or int(os.getenv("EMBED_BATCH_SIZE", "256"))
+        self.max_concurrency = max_concurrency or int(os.getenv("EMBED_CONCURRENCY", "4"))
+        self.hits = 0
+        self.misses = 0
+        # Tokens of the texts sent to the embedding api, which is what it bills
+        self.tokens = 0
+        self.stats_lock = threading.Lock()
+
+    @property
+    def stats(self):
+        with self.stats_lock:
+            return {"hits": self.hits, "misses": self.misses, "tokens": self.tokens}
+
+    def _embed(self, model, texts, embed_batch):
+        unique = list(dict.fromkeys(texts))
+        cached = dict(zip(unique, self.store.get_many(model, unique)))
+        missing = [text for text in unique if cached[text] is None]
+        tokens = sum(count_tokens(text, self.model) for text in missing)
+        with self.stats_lock:
+            self.hits += len(unique) - len(missing)
+            self.misses += len(missing)
+            self.tokens += tokens
+        add_embedding_tokens(tokens)
+
+        if missing:
+            batches = [missing[i:i + self.batch_size] for i in range(0, len(missing), self.batch_size)]
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as executor:
+                for batch, vectors in zip(batches, executor.map(embed_batch, batches)):
+                    self.store.put_many(model, batch, vectors)
+                    cached.update(zip(batch, np.asarray(vectors, dtype=np.float32)))
+
+        return [cached[text].tolist() for text in texts]
+
+    def embed_documents(self, texts):
+        return self._embed(self.model, texts, self.embeddings.embed_documents)
+
+    # Queries are kept apart from documents since some models embed the two differently
+    def embed_query(self, text):
+        return self._embed(self.model + ":query", [text], lambda batch: [self.embeddings.embed_query(batch[0])])[0]
@@ -0,0 +1,292 @@
+import os
+import time
+from cache import DocumentCache
+from extraction import extract_pages, join_pages, page_count, first_pages
+from context import ContextAssembler, map_reduce
+from prompts import QUERIES
+from streaming import parse_dict
+from metrics import Tracer, TracedBackend, estimate_cost, track_embedding_usage
+from clients import get_embeddings, get_qa_chain, token_callback
+
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+SPLITTER_SETTINGS = {"separator": "\n", "chunk_size": 1250, "chunk_overlap": 200}
+# How many of the most similar chunks are ranked for a question before packing them into the context
+MAX_CANDIDATES = 50
+# Most map step calls a document that doesn't fit in one call is answered with
+MAX_MAP_REDUCE_PARTS = int(os.getenv("MAP_REDUCE_MAX_PARTS", "8"))
+
+
+# Every chunk of a knowledge base in the order they were added, which is their order in the pdf.
+# A local knowledge base keeps its chunks in a list, FAISS in its docstore.
+def all_chunks(knowledge_base):
+    if hasattr(knowledge_base, "documents"):
+        return list(knowledge_base.documents)
+    return [knowledge_base.docstore.search(doc_id) for _, doc_id in sorted(knowledge_base.index_to_docstore_id.items())]
+
+
+def _valid(validate, response):
+    try:
+        validate(response)
+        return True
+    except (ValueError, SyntaxError):
+        return False
+
+
+# A pdf the local classifier is confident isn't any of the templates, see ExtractionEngine.process
+class DocTypeRejected(Exception):
+    pass
+
+
+# Answers a question about the given documents with ChatGPT through langchain's qa chain
+# When on_token is given the answer is streamed to it token by token as well,
+# max_tokens overrides the backend's for one call, like the map step of map_reduce
+# The chat client and chain are shared by every backend with the same settings, see clients.py
+# Set max_retries to 0 when the backend runs behind the AsyncLLMExecutor, which does the retrying itself
+class OpenAIBackend:
+    def __init__(self, model, api_key=None, max_tokens=2048, api_base=None, max_retries=6, request_timeout=None):
+        self.model = model
+        self.api_key = api_key
+        self.max_tokens = max_tokens
+        self.api_base = api_base
+        self.max_retries = max_retries
+        self.request_timeout = request_timeout
+
+    def answer(self, docs, question, on_token=None, max_tokens=None):
+        chain = get_qa_chain(
+            self.model, self.api_key, max_tokens or self.max_tokens, self.api_base, self.max_retries, self.request_timeout, on_token is not None
+        )
+        if on_token is not None:
+            return chain.run(input_documents=docs, question=question, callbacks=[token_callback(on_token)])
+        return chain.run(input_documents=docs, question=question)
+
+
+# The pdf to structured data pipeline without any UI: extract the pages, split and embed them,
+# search the chunks relevant to the query and let the llm backend answer it.
+# Any object with an answer(docs, question) method can be used as the backend.
+# With retrieval="local" the chunks are searched with local_retrieval instead of embeddings, without any network call.
+# Every stage is timed as a span of the tracer, the llm calls with their estimated tokens and cost.
+class ExtractionEngine:
+    def __init__(self, backend, embeddings=None, cache=None, embedding_model=EMBEDDING_MODEL, extract_workers=None, response_cache=None, retrieval="embeddings", tracer=None):
+        self.backend = backend
+        self.response_cache = response_cache
+        self.tracer = tracer or Tracer()
+        self.retrieval = retrieval
+        if retrieval == "local":
+            from local_retrieval import LOCAL_RETRIEVAL_MODEL
+            self.embedding_model = LOCAL_RETRIEVAL_MODEL
+            self.embeddings = None
+        else:
+            self.embedding_model = embedding_model
+            self.embeddings = embeddings or get_embeddings(embedding_model)
+        self.cache = cache or DocumentCache()
+        self.extract_workers = extract_workers
+        self._text_splitter = None
+
+    # langchain is only imported once there is a pdf to split
+    @property
+    def text_splitter(self):
+        if self._text_splitter is None:
+            from langchain.text_splitter import CharacterTextSplitter
+            self._text_splitter = CharacterTextSplitter(length_function=len, **SPLITTER_SETTINGS)
+        return self._text_splitter
+
+    @text_splitter.setter
+    def text_splitter(self, text_splitter):
+        self._text_splitter = text_splitter
+
+    def make_key(self, pdf_bytes):
+        return self.cache.make_key(pdf_bytes, SPLITTER_SETTINGS, self.embedding_model)
+
+    def load_pages(self, key, pdf_bytes):
+        with self.tracer.span("parse_pdf", cached=True) as span:
+            pages = self.cache.load_pages(key)
+            if pages is None:
+                span.set(cached=False)
+                pages = list(extract_pages(pdf_bytes, workers=self.extract_workers))
+                self.cache.save_pages(key, pages)
+            span.set(pages=len(pages))
+        return pages
+
+    # A cached index is loaded from disk without making any embedding calls.
+    # The local index costs no api calls to build, it is rebuilt from the cached chunks.
+    def build_index(self, key, text):
+        if self.retrieval != "local":
+            with self.tracer.span("index", cached=True) as span:
+                knowledge_base = self.cache.load_index(key, self.embeddings)
+                span.set(found=knowledge_base is not None)
+            if knowledge_base is not None:
+                return knowledge_base
+
+        with self.tracer.span("split", cached=True) as span:
+            chunks = self.cache.load_chunks(key)
+            if chunks is None:
+                span.set(cached=False)
+                chunks = self.text_splitter.split_text(text)
+                self.cache.save_chunks(key, chunks)
+            span.set(chunks=len(chunks))
+        if self.retrieval == "local":
+            from local_retrieval import LocalKnowledgeBase
+            with self.tracer.span("index", retrieval="local", chunks=len(chunks)):
+                return LocalKnowledgeBase.from_texts(chunks)
+
+        with self.tracer.span("embed", model=self.embedding_model, chunks=len(chunks)) as span:
+            # Only the chunks missing from the embedding cache are sent, and paid for
+            with track_embedding_usage() as usage:
+                vectors = self.embeddings.embed_documents(chunks)
+            span.set(embedding_tokens=usage.tokens, cost=estimate_cost(self.embedding_model, usage.tokens))
+        from langchain.vectorstores import FAISS
+        with self.tracer.span("index", chunks=len(chunks)):
+            knowledge_base = FAISS.from_embeddings(list(zip(chunks, vectors)), self.embeddings)
+            self.cache.save_index(key, knowledge_base)
+        return knowledge_base
+
+    # Pdfs of at least STREAMING_MIN_PAGES pages are indexed while they are read instead of read whole first.
+    # The local index is built from every chunk at once, it is never streamed.
+    def streams(self, pdf_bytes):
+        return self.retrieval != "local" and page_count(pdf_bytes) >= int(os.getenv("STREAMING_MIN_PAGES", "200"))
+
+    # Starts indexing the pdf in the background, see ingest.py. Its knowledge base can be searched right away.
+    def ingest(self, key, pdf_bytes, **kwargs):
+        from ingest import StreamingIngestion
+        return StreamingIngestion(self, key, pdf_bytes, **kwargs).start()
+
+    # Tells the type of the pdf from its first pages on this machine, see doctype.py. Returns the template
+    # to extract it with, None to reject it, with the predicted type and its probability. When the classifier
+    # isn't sure the template is 'doc_type', the one asked for.
+    # 'pages' are the (page_number, text) pairs when the pdf was read already, otherwise only its first pages are.
+    def classify(self, doc_type, pdf_bytes=None, pages=None):
+        from doctype import get_doc_type_classifier, CLASSIFY_PAGES
+        with self.tracer.span("classify") as span:
+            if pages is None:
+                pages = first_pages(pdf_bytes, CLASSIFY_PAGES)
+            template, predicted, confidence = get_doc_type_classifier().route("\n".join(text for _, text in pages[:CLASSIFY_PAGES]), doc_type)
+            span.set(predicted=predicted, confidence=round(confidence, 4), template=template)
+        return template, predicted, confidence
+
+    def context_assembler(self):
+        return ContextAssembler(getattr(self.backend, "model", None), getattr(self.backend, "max_tokens", 0))
+
+    # Picks the chunks sent with the query, packed to the model's token budget.
+    # A question gets its most similar chunks, while whole_document (the extraction templates) takes every
+    # chunk in pdf order. Returns the chunks and whether they need a map-reduce pass because they don't fit.
+    # A question is answered in one call from the most similar chunks that fit, only whole_document needs
+    # every part of the document. One too long for one call is answered from the chunks most similar to the
+    # template that fit in MAX_MAP_REDUCE_PARTS map calls, not with a call for every part of it.
+    def retrieve(self, knowledge_base, query, whole_document=False):
+        with self.tracer.span("search", whole_document=whole_document) as span:
+            assembler = self.context_assembler()
+            if whole_document:
+                candidates = all_chunks(knowledge_base)
+            else:
+                candidates = knowledge_base.similarity_search(query, k=min(MAX_CANDIDATES, knowledge_base.index.ntotal))
+            docs, complete = assembler.pack(candidates, query)
+            needs_map_reduce = False
+            if whole_document and not complete:
+                # Local search only ranks the chunks sharing a word with the template, the rest follow in pdf order
+                ranked = knowledge_base.similarity_search(query, k=len(candidates)) + candidates
+                docs = assembler.map_step().select(ranked, candidates, query, MAX_MAP_REDUCE_PARTS)
+                needs_map_reduce = True
+            elif not docs:
+                # Not even the most similar chunk fits on its own, map_reduce splits it
+                docs = assembler.dedupe(candidates)
+                needs_map_reduce = True
+            span.set(candidates=len(candidates), chunks=len(docs), map_reduce=needs_map_reduce)
+        return docs, needs_map_reduce
+
+    # map_reduce answers from several threads, so the llm call spans are given their parent explicitly
+    def _answer(self, docs, query, needs_map_reduce, on_token):
+        with self.tracer.span("llm", map_reduce=needs_map_reduce) as span:
+            backend = TracedBackend(self.backend, self.tracer, parent=span)
+            if needs_map_reduce:
+                return map_reduce(backend, self.context_assembler(), docs, query, on_token=on_token)
+            return backend.answer(docs, query, on_token=on_token)
+
+    # Responses are served from the response cache when one is set, unless use_cache is False.
+    # With match_similar a question close enough to one already asked about the same document
+    # ('document' is its cache key) gets the same answer.
+    # on_token receives the answer as it is streamed, a cached answer is passed to it in one piece.
+    # 'validate', like parse, is called on every answer before it is cached: one it raises ValueError or
+    # SyntaxError for isn't cached, so asking again asks the model again, and a cached one is dropped.
+    def ask(self, knowledge_base, query, document=None, use_cache=True, match_similar=False, whole_document=False, on_token=None, validate=None):
+        with self.tracer.span("ask", cache_hit=False) as span:
+            docs, needs_map_reduce = self.retrieve(knowledge_base, query, whole_document)
+            if self.response_cache is None or not use_cache:
+                return self._answer(docs, query, needs_map_reduce, on_token)
+
+            model = getattr(self.backend, "model", None)
+            key = self.response_cache.make_key(model, getattr(self.backend, "max_tokens", None), query, docs)
+            # The query embedding was already computed and cached by the similarity search.
+            # Local retrieval has no dense embeddings, so only the exact same question is matched there.
+            embedding = self.embeddings.embed_query(query) if match_similar and document is not None and self.embeddings is not None else None
+            response = self.response_cache.lookup(key, model, document, embedding)
+            if response is not None and validate is not None and not _valid(validate, response):
+                self.response_cache.delete(key)
+                response = None
+            if response is None:
+                response = self._answer(docs, query, needs_map_reduce, on_token)
+                if validate is not None:
+                    validate(response)
+                self.response_cache.put(key, response, model, document, embedding)
+            else:
+                span.set(cache_hit=True)
+                if on_token is not None:
+                    on_token(response)
+            return response
+
+    # The templates ask for a python dictionary, it is read without running any code
+    @staticmethod
+    def parse(response):
+        return parse_dict(response)
+
+    # Runs the whole pipeline on one pdf and returns a record with the parsed data, timings,
+    # estimated token usage and cost, and error if any.
+    # A streamed pdf is read while it is indexed, its extraction time is part of 'index'.
+    # With check_doc_type the pdf is classified first: one that is confidently another template is extracted
+    # with that one instead, and one that is confidently none of them is rejected before any embedding or
+    # model call. Anything the classifier isn't sure of is extracted as 'doc_type'.
+    def process(self, pdf_bytes, doc_type, check_doc_type=False):
+        record = {"doc_type": doc_type, "status": "ok", "data": None, "response": None, "error": None, "timings": {}}
+        timings = record["timings"]
+        start = time.perf_counter()
+        stage_start = start
+
+        def lap(stage):
+            nonlocal stage_start
+            now = time.perf_counter()
+            timings[stage] = round(now - stage_start, 4)
+            stage_start = now
+
+        with self.tracer.span("process", doc_type=doc_type) as span:
+            try:
+                if check_doc_type:
+                    template, predicted, confidence = self.classify(doc_type, pdf_bytes)
+                    record["classified"] = {"doc_type": predicted, "confidence": round(confidence, 4)}
+                    lap("classify")
+                    if template is None:
+                        raise DocTypeRejected("The pdf isn't any of the templates (%s, %.2f)" % (predicted, confidence))
+                    doc_type = record["doc_type"] = template
+                key = self.make_key(pdf_bytes)
+                if self.streams(pdf_bytes):
+                    lap("extract")
+                    knowledge_base = self.ingest(key, pdf_bytes, parent=span).result()
+                else:
+                    text, _ = join_pages(self.load_pages(key, pdf_bytes))
+                    lap("extract")
+                    knowledge_base = self.build_index(key, text)
+                lap("index")
+                record["response"] = self.ask(knowledge_base, QUERIES[doc_type], document=key, whole_document=True, validate=self.parse)
+                lap("llm")
+                with self.tracer.span("parse"):
+                    record["data"] = self.parse(record["response"])
+                lap("parse")
+            except DocTypeRejected as e:
+                record["status"] = "rejected"
+                record["error"] = str(e)
+            except Exception as e:
+                record["status"] = "error"
+                record["error"] = "%s: %s" % (type(e).__name__, e)
+
+        timings["total"] = round(time.perf_counter() - start, 4)
+        record["usage"] = {name: round(value, 6) for name, value in span.usage.items()}
+        return record
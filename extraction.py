@@ -0,0 +1,152 @@
+import os
+import re
+import queue
+import bisect
+import threading
+import multiprocessing
+from io import BytesIO
+from collections import deque
+from PyPDF2 import PdfReader
+
+
+# Below this many pages the process pool costs more to start than it saves
+MIN_PARALLEL_PAGES = 32
+
+_reader = None
+
+
+def _init_worker(pdf_bytes):
+    global _reader
+    _reader = PdfReader(BytesIO(pdf_bytes))
+
+
+def _extract_page(page_number):
+    return _reader.pages[page_number].extract_text() or ""
+
+
+def page_count(pdf_bytes):
+    return len(PdfReader(BytesIO(pdf_bytes)).pages)
+
+
+# (page_number, text) of only the first 'count' pages, the rest of the pdf is never parsed
+def first_pages(pdf_bytes, count):
+    reader = PdfReader(BytesIO(pdf_bytes))
+    return [(i + 1, reader.pages[i].extract_text() or "") for i in range(min(count, len(reader.pages)))]
+
+
+# Reads the pages asked for on 'requests' into 'results' until it is sent None, an error is passed on as it is
+def _read_pages(reader, requests, results):
+    for page_number in iter(requests.get, None):
+        try:
+            results.put(reader.pages[page_number].extract_text() or "")
+        except Exception as e:
+            results.put(e)
+
+
+# The serial extraction, one page at a time on a daemon thread so the wait for every page can time out.
+# A thread can't be stopped like a worker process, one stuck on a page is left to finish on its own and
+# the pages after it are read on a new thread with a reader of its own. No process is started, which
+# would take far longer than reading a small pdf.
+def _extract_serially(pdf_bytes, reader, page_timeout):
+    requests = None
+    try:
+        for i in range(len(reader.pages)):
+            if requests is None:
+                requests, results = queue.Queue(), queue.Queue()
+                threading.Thread(target=_read_pages, args=(reader, requests, results), daemon=True).start()
+            requests.put(i)
+            try:
+                text = results.get(timeout=page_timeout)
+            except queue.Empty:
+                requests.put(None)
+                requests = None
+                reader = PdfReader(BytesIO(pdf_bytes))
+                text = ""
+            if isinstance(text, Exception):
+                raise text
+            yield i + 1, text
+    finally:
+        if requests is not None:
+            requests.put(None)
+
+
+# Yields (page_number, text) for every page of the pdf in page order, page numbers start at 1.
+# Pages are extracted on a pool of worker processes, or one by one on a thread for a small pdf or
+# a single worker. A page that takes longer than page_timeout seconds is yielded as an empty string
+# either way, so it can't stall the whole upload or a batch worker.
+# With max_pending at most that many pages are extracted ahead of the consumer, so a slow
+# consumer holds back the workers instead of all the page texts piling up in memory.
+def extract_pages(pdf_bytes, workers=None, page_timeout=None, max_pending=None):
+    if workers is None:
+        workers = int(os.getenv("PDF_EXTRACT_WORKERS", os.cpu_count() or 1))
+    if page_timeout is None:
+        page_timeout = float(os.getenv("PDF_PAGE_TIMEOUT", "30"))
+
+    reader = PdfReader(BytesIO(pdf_bytes))
+    page_count = len(reader.pages)
+
+    if workers <= 1 or page_count < MIN_PARALLEL_PAGES:
+        yield from _extract_serially(pdf_bytes, reader, page_timeout)
+        return
+
+    # Spawned workers are safe to start from the threads the streamlit server runs scripts on
+    context = multiprocessing.get_context("spawn")
+    pool = context.Pool(min(workers, page_count), initializer=_init_worker, initargs=(pdf_bytes,))
+    max_pending = max_pending or page_count
+    results = deque()
+    submitted = 0
+    try:
+        for i in range(page_count):
+            while submitted < page_count and submitted - i < max_pending:
+                results.append(pool.apply_async(_extract_page, (submitted,)))
+                submitted += 1
+            try:
+                text = results.popleft().get(timeout=page_timeout)
+            except multiprocessing.TimeoutError:
+                text = ""
+            yield i + 1, text
+    finally:
+        # terminate also kills a worker that is still stuck on a pathological page
+        pool.terminate()
+
+
+# Joins the page texts with a single allocation, the returned offsets hold the
+# position in the text where every page starts so a chunk can be traced back to its page
+def join_pages(pages):
+    texts = []
+    offsets = []
+    position = 0
+    for _, text in pages:
+        offsets.append(position)
+        texts.append(text)
+        position += len(text)
+    return "".join(texts), offsets
+
+
+def page_at(pages, offsets, position):
+    index = bisect.bisect_right(offsets, position) - 1
+    return pages[max(index, 0)][0]
+
+
+# Where the chunk starts in the text from 'position' on, -1 when it isn't there. The splitter drops the empty
+# pieces between separators and strips the chunk, so a chunk spanning a blank line isn't a substring of the
+# text, only its words are matched and the whitespace between them can be any.
+def find_chunk(text, chunk, position=0):
+    found = text.find(chunk, position)
+    if found >= 0 or not chunk.strip():
+        return found
+    match = re.compile(r"\s+".join(re.escape(word) for word in chunk.split())).search(text, position)
+    return match.start() if match else -1
+
+
+# The page every chunk starts on, the chunks are looked up in the text in order since they overlap
+def chunk_pages(text, chunks, pages, offsets):
+    result = []
+    position = 0
+    for chunk in chunks:
+        found = find_chunk(text, chunk, position)
+        if found < 0:
+            found = position
+        result.append(page_at(pages, offsets, found))
+        position = found + 1
+    return result
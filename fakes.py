@@ -0,0 +1,226 @@
+import re
+import json
+import time
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from langchain.embeddings.base import Embeddings
+from prompts import QUERIES
+
+
+# Local stand-ins for the OpenAI services so the pipeline can run offline and deterministically
+
+# Embeds a text as a normalized bag of hashed words, so texts sharing words land close to each other
+class DeterministicFakeEmbeddings(Embeddings):
+    def __init__(self, size=256):
+        self.size = size
+        self.calls = 0
+
+    def _vector(self, text):
+        vector = np.zeros(self.size, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            digest = hashlib.md5(word.encode("utf-8")).digest()
+            index = int.from_bytes(digest[:4], "little") % self.size
+            vector[index] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            vector[0] = 1.0
+            norm = 1.0
+        return (vector / norm).tolist()
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        self.calls += 1
+        return self._vector(text)
+
+
+STUB_RESPONSES = {
+    'Resume': {
+        'docType': 'True',
+        'name': 'none',
+        'contact': 'none',
+        'experience': [
+            {'company_name': 'none', 'job_date': 'none', 'job_title': 'none', 'job_description': 'none'},
+        ],
+        'educationalBackground': {'school': 'none', 'course': 'none', 'year': 'none'},
+        'technicalSkills': 'none',
+        'certifications': 'none',
+    },
+    'Bill of loading': {
+        'docType': 'True',
+        'slwbNo': 'none',
+        'shipper': 'none',
+        'consignee': 'none',
+        'notify_party': 'none',
+        'vessel': 'none',
+        'loading_port': 'none',
+        'discharge_port': 'none',
+        'packages_info': [
+            {
+                'mark_nos': 'none',
+                'num_kind': ['none'],
+                'desc': [{'cartons': 'none', 'net_weight_prod': 'none', 'temp': 'none', 'ncm': 'none'}],
+                'gross_weight': 'none',
+                'net_weight': 'none',
+            },
+        ],
+        'freight_info': 'none',
+        'freight_paid_at': 'none',
+        'place_date': 'none',
+    },
+    'Procurement': {
+        'docType': 'True',
+        'customer_name': 'none',
+        'quote_info': {
+            'quote_address': 'none',
+            'quote_number': 'none',
+            'quote_creation_date': 'none',
+            'quote_expiration_date': 'none',
+        },
+        'customer_details': {'customer_number': 'none', 'payment_method': 'none', 'customer_information': 'none'},
+        'billing': {'sales_rep': 'none', 'bill_to': 'none', 'mail_to': 'none', 'ship_to': 'none'},
+        'pricing_summary': [
+            {'product name': 'none', 'qty': 'none', 'list_price': 'none', 'unit_price': 'none', 'net_price': 'none', 'mark_up': 'none'},
+        ],
+    },
+}
+
+
+# Answers the extraction templates, also when they are asked again to combine map-reduce answers,
+# with a well formed dictionary and anything else with a fixed sentence, after sleeping for 'latency'
+# seconds to stand in for the round trip. With on_token the answer is streamed to it in pieces of a
+# few characters.
+class StubLLMBackend:
+    def __init__(self, latency=0.0, max_tokens=2048):
+        self.model = "stub"
+        self.max_tokens = max_tokens
+        self.latency = latency
+        self.calls = 0
+
+    def answer(self, docs, question, on_token=None, max_tokens=None):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        response = "This is a stub answer based on %d documents." % len(docs)
+        for doc_type, query in QUERIES.items():
+            if query in question:
+                response = repr(STUB_RESPONSES[doc_type])
+        if on_token is not None:
+            for i in range(0, len(response), 4):
+                on_token(response[i:i + 4])
+        return response
+
+
+# A stub whose first 'failures' calls time out, after streaming 'tokens_first' tokens when it is set,
+# and whose next 'broken' answers are cut short so they don't parse
+class FlakyBackend(StubLLMBackend):
+    def __init__(self, failures=0, tokens_first=0, broken=0, **kwargs):
+        super().__init__(**kwargs)
+        self.failures = failures
+        self.tokens_first = tokens_first
+        self.broken = broken
+
+    def answer(self, docs, question, on_token=None, max_tokens=None):
+        if self.failures:
+            self.failures -= 1
+            self.calls += 1
+            for i in range(self.tokens_first):
+                on_token("partial %d " % i)
+            raise TimeoutError("the model took too long")
+        if not self.broken:
+            return super().answer(docs, question, on_token)
+        self.broken -= 1
+        response = "{'docType' 'True', " + super().answer(docs, question)[1:]
+        if on_token is not None:
+            on_token(response)
+        return response
+
+
+# A local stand-in for the OpenAI chat completions endpoint, point a backend at it with api_base=server.url.
+# The first 'fail_first' requests are answered with a 429 so the retrying of the callers can be exercised.
+class FakeChatServer:
+    def __init__(self, latency=0.0, fail_first=0, port=0):
+        self.latency = latency
+        self.fail_first = fail_first
+        self.requests = 0
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body):
+                content = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                with server.lock:
+                    server.requests += 1
+                    rate_limited = server.requests <= server.fail_first
+                if rate_limited:
+                    self._send(429, {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}})
+                    return
+                if server.latency:
+                    time.sleep(server.latency)
+                completion = server.completion(request)
+                if request.get("stream"):
+                    self._stream(completion)
+                else:
+                    self._send(200, completion)
+
+            # Sends the completion as server-sent events of a few characters each, like the api does with stream=True
+            def _stream(self, completion):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                content = completion["choices"][0]["message"]["content"]
+                for i in range(0, len(content), 4):
+                    chunk = {
+                        "id": completion["id"], "object": "chat.completion.chunk", "created": completion["created"], "model": completion["model"],
+                        "choices": [{"index": 0, "delta": {"content": content[i:i + 4]}, "finish_reason": None}],
+                    }
+                    self.wfile.write(("data: %s\n\n" % json.dumps(chunk)).encode("utf-8"))
+                    self.wfile.flush()
+                self.wfile.write(b"data: [DONE]\n\n")
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.url = "http://127.0.0.1:%d/v1" % self.httpd.server_address[1]
+
+    def completion(self, request):
+        prompt = "\n".join(message["content"] for message in request["messages"])
+        content = "This is a stub answer."
+        for doc_type, query in QUERIES.items():
+            if query in prompt:
+                content = repr(STUB_RESPONSES[doc_type])
+        return {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4, "total_tokens": (len(prompt) + len(content)) // 4},
+        }
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
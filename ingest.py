@@ -0,0 +1,294 @@
+import os
+import time
+import queue
+import bisect
+import threading
+from extraction import extract_pages, page_count, find_chunk
+from metrics import estimate_cost, track_embedding_usage
+
+
+# Batches of chunks waiting to be embedded, one is split while the other is embedded
+BATCH_QUEUE_SIZE = 2
+# Characters of page text buffered before they are split, about 16 chunks of the default size
+SPLIT_WINDOW = 20000
+
+
+# Splits the page texts as they arrive. Once 'window' characters are buffered the buffer is split
+# and every chunk but the last is yielded with the page it starts on; the buffer is kept from where
+# the last one starts and split again together with the next pages, so no chunk is cut short where
+# the buffer happened to end and the chunks are the same as those of the whole text.
+def split_pages(split_text, pages, window):
+    buffer = ""
+    offsets = []
+    numbers = []
+
+    def page_at(position):
+        return numbers[max(bisect.bisect_right(offsets, position) - 1, 0)]
+
+    for page_number, text in pages:
+        offsets.append(len(buffer))
+        numbers.append(page_number)
+        buffer += text
+        if len(buffer) < window:
+            continue
+        chunks = split_text(buffer)
+        if len(chunks) < 2:
+            continue
+        position = 0
+        for chunk in chunks[:-1]:
+            found = find_chunk(buffer, chunk, position)
+            if found < 0:
+                found = position
+            yield chunk, page_at(found)
+            position = found + 1
+        # A last chunk that can't be found is kept from right after the one before it, never from later
+        # on, so at worst some text is split twice instead of lost
+        last = find_chunk(buffer, chunks[-1], position)
+        if last < 0:
+            last = position
+        first = max(bisect.bisect_right(offsets, last) - 1, 0)
+        offsets = [0] + [offset - last for offset in offsets[first + 1:]]
+        numbers = numbers[first:]
+        buffer = buffer[last:]
+
+    if buffer:
+        position = 0
+        for chunk in split_text(buffer):
+            found = find_chunk(buffer, chunk, position)
+            if found < 0:
+                found = position
+            yield chunk, page_at(found)
+            position = found + 1
+
+
+# A FAISS knowledge base that can be searched while chunks are still being added to it.
+# The searches and the adds take turns on a lock, the query itself is embedded outside of it.
+class StreamingKnowledgeBase:
+    def __init__(self, embeddings, store=None):
+        self.embeddings = embeddings
+        self.store = store
+        self.lock = threading.Lock()
+
+    @property
+    def index(self):
+        return self.store.index if self.store is not None else _EMPTY_INDEX
+
+    @property
+    def ntotal(self):
+        return self.index.ntotal
+
+    # Every chunk added so far in pdf order, with the page it starts on in its metadata
+    @property
+    def documents(self):
+        with self.lock:
+            if self.store is None:
+                return []
+            return [self.store.docstore.search(doc_id) for _, doc_id in sorted(self.store.index_to_docstore_id.items())]
+
+    def add(self, texts, vectors, metadatas):
+        from langchain.vectorstores import FAISS
+        with self.lock:
+            if self.store is None:
+                self.store = FAISS.from_embeddings(list(zip(texts, vectors)), self.embeddings, metadatas=metadatas)
+            else:
+                self.store.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas)
+
+    def similarity_search_with_score(self, query, k=4):
+        if self.store is None:
+            return []
+        vector = self.embeddings.embed_query(query)
+        with self.lock:
+            return self.store.similarity_search_with_score_by_vector(vector, k=min(k, self.store.index.ntotal))
+
+    def similarity_search(self, query, k=4):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+
+class _EmptyIndex:
+    ntotal = 0
+
+
+_EMPTY_INDEX = _EmptyIndex()
+
+
+# Reads, splits, embeds and indexes a pdf as a pipeline of threads joined by bounded queues,
+# so only 'queue_size' pages and a couple of batches of chunks are in flight at any time and a
+# slow stage holds back the ones before it. The knowledge base can be searched from the first
+# batch on. The finished index is saved to the engine's document cache like any other, and a
+# pdf that is already there is loaded from it instead.
+# The spans are a trace of their own unless a 'parent' span is given, which must stay open until
+# the ingestion is done.
+class StreamingIngestion:
+    def __init__(self, engine, key, pdf_bytes, queue_size=None, batch_size=None, window=None, parent=None):
+        self.engine = engine
+        self.parent = parent
+        self.key = key
+        self.pdf_bytes = pdf_bytes
+        self.queue_size = queue_size or int(os.getenv("INGEST_QUEUE_SIZE", "32"))
+        self.batch_size = batch_size or int(os.getenv("INGEST_BATCH_SIZE", "128"))
+        self.window = window or SPLIT_WINDOW
+        self.knowledge_base = StreamingKnowledgeBase(engine.embeddings)
+        self.page_count = page_count(pdf_bytes)
+        self.pages_read = 0
+        self.pages_indexed = 0
+        self.chunks_indexed = 0
+        self.cached = False
+        self.error = None
+        self.timings = {"parse_pdf": 0.0, "split": 0.0, "embed": 0.0, "index": 0.0}
+        self.embedding_tokens = 0
+        self.done = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    @property
+    def progress(self):
+        return 1.0 if self.done.is_set() else self.pages_indexed / max(self.page_count, 1)
+
+    # Waits for the whole pdf to be indexed and returns its knowledge base
+    def result(self, timeout=None):
+        if not self.done.wait(timeout):
+            raise TimeoutError("The pdf is still being indexed")
+        if self.error is not None:
+            raise self.error
+        return self.knowledge_base
+
+    def stop(self):
+        self._stop.set()
+
+    def _fail(self, error):
+        if self.error is None:
+            self.error = error
+        self._stop.set()
+
+    # Queue operations give up once the pipeline is stopped, so a failed stage can't leave the others blocked
+    def _put(self, items, item):
+        while not self._stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, items):
+        while not self._stop.is_set():
+            try:
+                return items.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return None
+
+    def _timed(self, stage, function):
+        def timed(*args):
+            start = time.perf_counter()
+            try:
+                return function(*args)
+            finally:
+                self.timings[stage] += time.perf_counter() - start
+        return timed
+
+    def _extract(self, pages):
+        reader = extract_pages(self.pdf_bytes, workers=self.engine.extract_workers, max_pending=self.queue_size)
+        read = self._timed("parse_pdf", next)
+        try:
+            while True:
+                page = read(reader, None)
+                if page is None or not self._put(pages, page):
+                    break
+        except Exception as e:
+            self._fail(e)
+        finally:
+            # Closing the generator terminates the extraction pool
+            reader.close()
+            self._put(pages, None)
+
+    def _received_pages(self, pages):
+        while True:
+            page = self._get(pages)
+            if page is None:
+                return
+            self.pages_read = page[0]
+            yield page
+
+    def _split(self, pages, batches):
+        batch = []
+        try:
+            split_text = self._timed("split", self.engine.text_splitter.split_text)
+            for chunk in split_pages(split_text, self._received_pages(pages), self.window):
+                batch.append(chunk)
+                if len(batch) >= self.batch_size:
+                    if not self._put(batches, batch):
+                        return
+                    batch = []
+            if batch:
+                self._put(batches, batch)
+        except Exception as e:
+            self._fail(e)
+        finally:
+            self._put(batches, None)
+
+    def _index(self, batches):
+        embeddings = self.engine.embeddings
+        embed = self._timed("embed", embeddings.embed_documents)
+        add = self._timed("index", self.knowledge_base.add)
+        while True:
+            batch = self._get(batches)
+            if batch is None:
+                return
+            texts = [text for text, _ in batch]
+            with track_embedding_usage() as usage:
+                vectors = embed(texts)
+            self.embedding_tokens += usage.tokens
+            add(texts, vectors, [{"page": page} for _, page in batch])
+            self.chunks_indexed += len(batch)
+            self.pages_indexed = batch[-1][1]
+
+    def _run(self):
+        tracer = self.engine.tracer
+        try:
+            with tracer.span("ingest", parent=self.parent, pages=self.page_count) as span:
+                store = self.engine.cache.load_index(self.key, self.engine.embeddings)
+                if store is not None:
+                    self.knowledge_base.store = store
+                    self.cached = True
+                    self.pages_read = self.pages_indexed = self.page_count
+                    span.set(cached=True, chunks=store.index.ntotal)
+                    return
+
+                pages = queue.Queue(maxsize=self.queue_size)
+                batches = queue.Queue(maxsize=BATCH_QUEUE_SIZE)
+                workers = [
+                    threading.Thread(target=self._extract, args=(pages,), daemon=True),
+                    threading.Thread(target=self._split, args=(pages, batches), daemon=True),
+                ]
+                for worker in workers:
+                    worker.start()
+                try:
+                    self._index(batches)
+                except Exception as e:
+                    self._fail(e)
+                for worker in workers:
+                    worker.join()
+                if self.error is not None:
+                    raise self.error
+                if self.knowledge_base.store is not None:
+                    self.engine.cache.save_index(self.key, self.knowledge_base.store)
+                self.pages_indexed = self.page_count
+
+                span.set(cached=False, chunks=self.chunks_indexed)
+                model = self.engine.embedding_model
+                # The stages overlap, each span holds the total time spent in that stage
+                for stage, seconds in self.timings.items():
+                    attributes = {}
+                    if stage == "embed":
+                        attributes = {"model": model, "embedding_tokens": self.embedding_tokens, "cost": estimate_cost(model, self.embedding_tokens)}
+                    tracer.record(stage, seconds, parent=span, **attributes)
+        except Exception as e:
+            self._fail(e)
+        finally:
+            self.done.set()
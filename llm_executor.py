@@ -0,0 +1,137 @@
+import os
+import time
+import random
+import asyncio
+import hashlib
+import functools
+import threading
+from tokens import count_tokens
+
+
+# The errors worth waiting out and sending again, anything else is raised straight away.
+# openai is only imported by the first call, it adds a quarter of a second to the app's start.
+@functools.lru_cache(maxsize=None)
+def retryable_errors():
+    import openai
+    return tuple(
+        getattr(openai.error, name) for name in ("RateLimitError", "Timeout", "APIConnectionError", "ServiceUnavailableError", "TryAgain")
+        if hasattr(openai.error, name)
+    ) + (TimeoutError,)
+
+
+# Holds up to 'per_minute' units and refills them continuously, acquire waits until enough units are available
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.available = per_minute
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        # A request bigger than the whole bucket would wait forever, it goes through once the bucket is full
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            self._refill()
+            while self.available < amount:
+                await asyncio.sleep((amount - self.available) / self.rate)
+                self._refill()
+            self.available -= amount
+
+
+# Runs the calls of an llm backend on an asyncio loop with requests/min and tokens/min limits,
+# jittered exponential backoff on rate limit and timeout errors, and identical requests that are
+# already in flight answered by the same call. It has the same answer(docs, question, on_token, max_tokens) method
+# as the backends, so it can be handed to the engine in their place. Streamed calls are never coalesced
+# since every caller needs its own tokens.
+class AsyncLLMExecutor:
+    def __init__(self, backend, requests_per_minute=None, tokens_per_minute=None, max_retries=5, base_delay=1.0, max_delay=60.0):
+        self.backend = backend
+        self.requests = TokenBucket(requests_per_minute or int(os.getenv("LLM_REQUESTS_PER_MINUTE", "3500")))
+        self.tokens = TokenBucket(tokens_per_minute or int(os.getenv("LLM_TOKENS_PER_MINUTE", "90000")))
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+        self.coalesced = 0
+        self._in_flight = {}
+        self._loop = None
+        self._loop_lock = threading.Lock()
+
+    # The tokens a call uses up: the prompt plus the completion it may generate
+    def estimate_tokens(self, docs, question, max_tokens=None):
+        model = self.model or "gpt-3.5-turbo"
+        prompt = sum(count_tokens(doc.page_content, model) for doc in docs) + count_tokens(question, model)
+        return prompt + (max_tokens or self.max_tokens)
+
+    def _key(self, docs, question, max_tokens=None):
+        digest = hashlib.sha256(str(getattr(self.backend, "model", "")).encode("utf-8"))
+        digest.update(("%s\0%s" % (max_tokens, question)).encode("utf-8"))
+        for doc in docs:
+            digest.update(b"\0" + doc.page_content.encode("utf-8"))
+        return digest.hexdigest()
+
+    async def aanswer(self, docs, question, on_token=None, max_tokens=None):
+        if on_token is not None:
+            return await self._call(docs, question, on_token, max_tokens)
+        key = self._key(docs, question, max_tokens)
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(self._call(docs, question, max_tokens=max_tokens))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # shield so one caller giving up doesn't cancel the call for the others waiting on it
+        return await asyncio.shield(task)
+
+    async def _call(self, docs, question, on_token=None, max_tokens=None):
+        tokens = self.estimate_tokens(docs, question, max_tokens)
+        call = functools.partial(self.backend.answer, docs, question)
+        if max_tokens is not None:
+            call = functools.partial(call, max_tokens=max_tokens)
+        streamed = []
+        if on_token is not None:
+            def forward(token):
+                streamed.append(True)
+                on_token(token)
+            call = functools.partial(call, on_token=forward)
+        for attempt in range(self.max_retries + 1):
+            await self.requests.acquire(1)
+            await self.tokens.acquire(tokens)
+            try:
+                return await asyncio.to_thread(call)
+            except retryable_errors():
+                # A stream that failed part way is raised, sending it again would repeat the tokens the caller already has
+                if attempt == self.max_retries or streamed:
+                    raise
+                self.retries += 1
+                # Full jitter keeps the workers that were rate limited together from retrying together
+                await asyncio.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+
+    # Blocking callers like the streamlit script thread share one event loop running in the background
+    def _get_loop(self):
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, daemon=True).start()
+            return self._loop
+
+    def submit(self, docs, question, on_token=None, max_tokens=None):
+        return asyncio.run_coroutine_threadsafe(self.aanswer(docs, question, on_token, max_tokens), self._get_loop())
+
+    def answer(self, docs, question, on_token=None, max_tokens=None):
+        return self.submit(docs, question, on_token, max_tokens).result()
+
+    @property
+    def model(self):
+        return getattr(self.backend, "model", None)
+
+    @property
+    def max_tokens(self):
+        return getattr(self.backend, "max_tokens", 0)
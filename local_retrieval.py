@@ -0,0 +1,175 @@
+import os
+import re
+import numpy as np
+from scipy import sparse
+
+
+LOCAL_RETRIEVAL_MODEL = "local-hybrid"
+# Constant of reciprocal rank fusion, a chunk ranked r-th by a scorer adds 1 / (RRF_K + r) to its score
+RRF_K = 60
+# How many of the best chunks of each scorer are fused
+FUSION_CANDIDATES = 100
+
+_WORD = re.compile(r"\w+")
+_PRIME = np.uint64(1099511628211)
+_MIX = np.uint64(0x9E3779B97F4A7C15)
+
+
+# Hashes every character n-gram of the given byte arrays into 'bits' bits, all of them at once.
+# Returns the row each n-gram belongs to and its bucket, n-grams never span two texts.
+def _hash_ngrams(texts, ngram_range, bits):
+    encoded = [text.encode("utf-8") for text in texts]
+    lengths = np.array([len(text) for text in encoded], dtype=np.int64)
+    data = np.frombuffer(b"".join(encoded), dtype=np.uint8).astype(np.uint64)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    rows = np.repeat(np.arange(len(texts)), lengths)
+
+    all_rows = []
+    all_buckets = []
+    for n in range(ngram_range[0], ngram_range[1] + 1):
+        count = len(data) - n + 1
+        if count <= 0:
+            continue
+        hashes = np.full(count, n, dtype=np.uint64)
+        for j in range(n):
+            hashes = hashes * _PRIME + data[j:j + count]
+        # An n-gram that starts less than n bytes from the end of its text runs into the next one
+        keep = np.arange(count) + n <= (starts + lengths)[rows[:count]]
+        all_rows.append(rows[:count][keep])
+        all_buckets.append(((hashes[keep] * _MIX) >> np.uint64(64 - bits)).astype(np.int64))
+    if not all_rows:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(all_rows), np.concatenate(all_buckets)
+
+
+# Builds the rows x columns matrix counting every (row, column) pair, sorting the pairs as one
+# int64 key is a lot faster than scipy's own duplicate summing on millions of entries
+def _count_matrix(rows, columns, shape):
+    keys = np.sort(rows * shape[1] + columns)
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    counts = np.diff(np.append(starts, len(keys))).astype(np.float32)
+    unique = keys[starts]
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(unique // shape[1], minlength=shape[0]))))
+    return sparse.csr_matrix((counts, unique % shape[1], indptr), shape=shape)
+
+
+def _normalize_text(text):
+    return " ".join(text.lower().split())
+
+
+def _l2_normalize_rows(matrix):
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.diags(1 / norms) @ matrix
+
+
+# TF-IDF over hashed character n-grams, so there is no vocabulary to keep and misspelled or
+# oddly split words from the pdf text still match. Sublinear tf, smoothed idf and unit length rows.
+class HashedTfidf:
+    def __init__(self, ngram_range=(3, 5), bits=18):
+        self.ngram_range = ngram_range
+        self.bits = bits
+        self.idf = None
+
+    def _counts(self, texts):
+        rows, buckets = _hash_ngrams([_normalize_text(text) for text in texts], self.ngram_range, self.bits)
+        counts = _count_matrix(rows, buckets, (len(texts), 1 << self.bits))
+        counts.data = np.log1p(counts.data)
+        return counts
+
+    def fit_transform(self, texts):
+        counts = self._counts(texts)
+        df = np.bincount(counts.indices, minlength=counts.shape[1])
+        self.idf = (np.log((1 + len(texts)) / (1 + df)) + 1).astype(np.float32)
+        return self._weigh(counts)
+
+    def transform(self, texts):
+        return self._weigh(self._counts(texts))
+
+    def _weigh(self, counts):
+        counts.data *= self.idf[counts.indices]
+        return _l2_normalize_rows(counts).tocsr()
+
+
+# Okapi BM25 over the words of the chunks. The index is a term x chunk sparse matrix holding the
+# precomputed BM25 weight of every term in every chunk, so scoring a query only adds up its terms' rows.
+class BM25Index:
+    def __init__(self, texts, k1=1.5, b=0.75):
+        self.vocabulary = {}
+        rows = []
+        terms = []
+        for row, text in enumerate(texts):
+            ids = [self.vocabulary.setdefault(word, len(self.vocabulary)) for word in _WORD.findall(text.lower())]
+            terms.extend(ids)
+            rows.extend([row] * len(ids))
+
+        tf = _count_matrix(np.array(rows, dtype=np.int64), np.array(terms, dtype=np.int64), (len(texts), len(self.vocabulary)))
+        lengths = np.asarray(tf.sum(axis=1)).ravel()
+        df = np.bincount(tf.indices, minlength=tf.shape[1])
+        idf = np.log(1 + (len(texts) - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+        row_of = np.repeat(np.arange(tf.shape[0]), np.diff(tf.indptr))
+        norm = k1 * (1 - b + b * lengths / max(lengths.mean(), 1))
+        tf.data = idf[tf.indices] * tf.data * (k1 + 1) / (tf.data + norm[row_of])
+        self.postings = tf.T.tocsr()
+        self.size = len(texts)
+
+    def scores(self, query):
+        scores = np.zeros(self.size, dtype=np.float32)
+        for term in set(_WORD.findall(query.lower())):
+            term_id = self.vocabulary.get(term)
+            if term_id is not None:
+                start, end = self.postings.indptr[term_id], self.postings.indptr[term_id + 1]
+                scores[self.postings.indices[start:end]] += self.postings.data[start:end]
+        return scores
+
+
+def _top(scores, count):
+    count = min(count, int(np.count_nonzero(scores > 0)))
+    if count == 0:
+        return np.zeros(0, dtype=np.int64)
+    top = np.argpartition(-scores, count - 1)[:count]
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+# Searches the chunks without any network call: the TF-IDF cosine ranking and the BM25 ranking
+# are merged with reciprocal rank fusion.
+class LocalIndex:
+    def __init__(self, texts, ngram_range=(3, 5), bits=18):
+        self.tfidf = HashedTfidf(ngram_range, bits)
+        # Stored term x chunk like the BM25 postings, so a query only touches the rows of its own n-grams
+        self.vectors = self.tfidf.fit_transform(texts).T.tocsr()
+        self.bm25 = BM25Index(texts)
+        self.ntotal = len(texts)
+
+    def search(self, query, k=4):
+        query_vector = self.tfidf.transform([query])
+        dense_scores = np.asarray((query_vector @ self.vectors).todense()).ravel()
+        fused = np.zeros(self.ntotal, dtype=np.float64)
+        for ranking in (_top(dense_scores, FUSION_CANDIDATES), _top(self.bm25.scores(query), FUSION_CANDIDATES)):
+            fused[ranking] += 1.0 / (RRF_K + 1 + np.arange(len(ranking)))
+        top = _top(fused, k)
+        return top, fused[top]
+
+
+# A knowledge base with the same search methods as langchain's FAISS store. Building it needs no
+# embedding calls, so it is rebuilt from the cached chunks instead of being saved like the FAISS indexes.
+# Scores are fused reciprocal ranks, higher is more similar.
+class LocalKnowledgeBase:
+    def __init__(self, documents, index):
+        self.documents = documents
+        self.index = index
+
+    @classmethod
+    def from_texts(cls, texts, ngram_range=None, bits=None):
+        ngram_range = ngram_range or tuple(int(n) for n in os.getenv("LOCAL_NGRAM_RANGE", "3,5").split(","))
+        bits = bits or int(os.getenv("LOCAL_HASH_BITS", "18"))
+        from langchain.docstore.document import Document
+        return cls([Document(page_content=text) for text in texts], LocalIndex(texts, ngram_range, bits))
+
+    def similarity_search_with_score(self, query, k=4):
+        rows, scores = self.index.search(query, k)
+        return [(self.documents[row], float(score)) for row, score in zip(rows, scores)]
+
+    def similarity_search(self, query, k=4):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
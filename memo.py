@@ -0,0 +1,40 @@
+from collections import OrderedDict
+
+
+# Remembers the results of the pipeline stages of one session, keyed by the upload and the options they
+# were computed with, so a rerun of the script that changed none of them gets them back in O(1).
+# 'state' is any mutable mapping, st.session_state in the app. Every stage keeps its 'max_entries'
+# most recently used results.
+class StageMemo:
+    def __init__(self, state, max_entries=8, namespace="stage_memo"):
+        if namespace not in state:
+            state[namespace] = {}
+        self.stages = state[namespace]
+        self.max_entries = max_entries
+
+    def get(self, stage, key):
+        entries = self.stages.get(stage)
+        if entries is None or key not in entries:
+            return None
+        entries.move_to_end(key)
+        return entries[key]
+
+    def put(self, stage, key, value):
+        entries = self.stages.setdefault(stage, OrderedDict())
+        entries[key] = value
+        entries.move_to_end(key)
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+        return value
+
+    def get_or_compute(self, stage, key, compute):
+        value = self.get(stage, key)
+        if value is None:
+            value = self.put(stage, key, compute())
+        return value
+
+    def clear(self, stage=None):
+        if stage is None:
+            self.stages.clear()
+        else:
+            self.stages.pop(stage, None)
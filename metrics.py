@@ -0,0 +1,336 @@
+import os
+import sys
+import json
+import time
+import uuid
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from tokens import count_tokens
+
+
+# Dollars per 1000 prompt and completion tokens
+MODEL_PRICES = {
+    "gpt-3.5-turbo": (0.0015, 0.002),
+    "gpt-3.5-turbo-16k": (0.003, 0.004),
+    "text-davinci-003": (0.02, 0.02),
+    "gpt-4": (0.03, 0.06),
+    "gpt-4-32k": (0.06, 0.12),
+    "text-embedding-ada-002": (0.0001, 0.0),
+}
+
+# Attributes of a span that are added up into its parent when it ends, so a request shows the total of its calls
+USAGE_ATTRIBUTES = ("prompt_tokens", "completion_tokens", "embedding_tokens", "cost")
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_embedding_usage = contextvars.ContextVar("embedding_usage", default=None)
+
+
+def estimate_cost(model, prompt_tokens, completion_tokens=0):
+    prompt_price, completion_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+
+class EmbeddingUsage:
+    def __init__(self):
+        self.tokens = 0
+
+
+# Counts the tokens the embedding calls made inside the with block, by this thread or task only, send to the api.
+# The embeddings are shared by every session and ingestion, so the difference of their totals before and
+# after would also count what the others sent meanwhile.
+@contextmanager
+def track_embedding_usage():
+    usage = EmbeddingUsage()
+    reset = _embedding_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _embedding_usage.reset(reset)
+
+
+# Called by the embeddings with the tokens of every call that reaches the api
+def add_embedding_tokens(tokens):
+    usage = _embedding_usage.get()
+    if usage is not None:
+        usage.tokens += tokens
+
+
+# One timed stage of the pipeline. 'attributes' are its own, 'usage' also holds the token counts
+# and cost of the spans inside it.
+class Span:
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.attributes = dict(attributes or {})
+        self.usage = {}
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self.duration = None
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, duration=None):
+        self.duration = duration if duration is not None else time.perf_counter() - self._start
+        for key in USAGE_ATTRIBUTES:
+            if key in self.attributes:
+                self.usage[key] = self.usage.get(key, 0) + self.attributes[key]
+        if self.parent is not None:
+            for key, value in self.usage.items():
+                self.parent.usage[key] = self.parent.usage.get(key, 0) + value
+
+    @property
+    def depth(self):
+        return 0 if self.parent is None else self.parent.depth + 1
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent.span_id if self.parent is not None else None,
+            "start_time": self.start_time,
+            "duration_ms": round(self.duration * 1000, 3),
+            "attributes": self.attributes,
+            "usage": self.usage,
+            "error": self.error,
+        }
+
+
+# Times the stages of the pipeline as nested spans and hands every finished span to the exporters.
+# The parent of a span is the span open in the same context, pass 'parent' explicitly across threads.
+class Tracer:
+    def __init__(self, exporters=None):
+        self.exporters = list(exporters or [])
+
+    # Builds the exporters named in METRICS_EXPORTERS, a comma separated list of json, prometheus and otel
+    @classmethod
+    def from_env(cls, extra_exporters=None):
+        exporters = list(extra_exporters or [])
+        for name in filter(None, (name.strip() for name in os.getenv("METRICS_EXPORTERS", "").split(","))):
+            if name == "json":
+                exporters.append(JsonLogExporter(os.getenv("METRICS_LOG_PATH")))
+            elif name == "prometheus":
+                exporters.append(PrometheusExporter().serve(int(os.getenv("METRICS_PORT", "9464")), os.getenv("METRICS_HOST", "127.0.0.1")))
+            elif name == "otel":
+                exporters.append(OpenTelemetryExporter())
+            else:
+                raise ValueError("Unknown metrics exporter: %s" % name)
+        return cls(exporters)
+
+    @staticmethod
+    def current():
+        return _current_span.get()
+
+    @contextmanager
+    def span(self, name, parent=None, **attributes):
+        span = Span(name, parent or _current_span.get(), attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = "%s: %s" % (type(e).__name__, e)
+            raise
+        finally:
+            _current_span.reset(token)
+            self._finish(span)
+
+    # Records a stage that was timed in pieces, like the response parsing spread over the streamed tokens
+    def record(self, name, duration, parent=None, **attributes):
+        span = Span(name, parent or _current_span.get(), attributes)
+        span.start_time -= duration
+        span._start -= duration
+        self._finish(span, duration)
+        return span
+
+    def _finish(self, span, duration=None):
+        span.end(duration)
+        for exporter in self.exporters:
+            exporter.export(span)
+
+
+# Wraps an llm backend so every call is a span with its estimated prompt and completion tokens and cost.
+# Streamed answers carry no usage, so the tokens are counted on the texts sent and received.
+class TracedBackend:
+    def __init__(self, backend, tracer, parent=None):
+        self.backend = backend
+        self.tracer = tracer
+        self.parent = parent
+
+    def answer(self, docs, question, on_token=None, max_tokens=None):
+        model = getattr(self.backend, "model", None)
+        with self.tracer.span("llm_call", parent=self.parent, model=model, chunks=len(docs)) as span:
+            options = {}
+            if on_token is not None:
+                options["on_token"] = on_token
+            if max_tokens is not None:
+                options["max_tokens"] = max_tokens
+            response = self.backend.answer(docs, question, **options)
+            counting_model = model or "gpt-3.5-turbo"
+            prompt_tokens = sum(count_tokens(doc.page_content, counting_model) for doc in docs) + count_tokens(question, counting_model)
+            completion_tokens = count_tokens(response, counting_model)
+            span.set(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, cost=estimate_cost(model, prompt_tokens, completion_tokens))
+        return response
+
+    @property
+    def model(self):
+        return getattr(self.backend, "model", None)
+
+    @property
+    def max_tokens(self):
+        return getattr(self.backend, "max_tokens", 0)
+
+
+# Keeps the latest spans in memory for the app's performance panel
+class RecentSpansExporter:
+    def __init__(self, max_spans=2000):
+        self.spans = deque(maxlen=max_spans)
+        self.lock = threading.Lock()
+
+    def export(self, span):
+        with self.lock:
+            self.spans.append(span)
+
+    # The spans of one trace in the order they started
+    def trace(self, trace_id):
+        with self.lock:
+            spans = [span for span in self.spans if span.trace_id == trace_id]
+        return sorted(spans, key=lambda span: span._start)
+
+
+# Writes every span as one JSON line, to 'path' or to stderr
+class JsonLogExporter:
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def export(self, span):
+        line = json.dumps(span.to_dict(), default=str) + "\n"
+        with self.lock:
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+            else:
+                sys.stderr.write(line)
+
+
+def _labels(**labels):
+    return "{%s}" % ",".join('%s="%s"' % (key, str(value).replace("\\", "\\\\").replace('"', '\\"')) for key, value in sorted(labels.items()))
+
+
+# Aggregates the spans into a stage duration histogram and token and cost counters,
+# exposed in the Prometheus text format by render() and on /metrics by serve()
+class PrometheusExporter:
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self.durations = {}
+        self.tokens = {}
+        self.costs = {}
+        self.errors = {}
+        self.lock = threading.Lock()
+        self.server = None
+
+    def export(self, span):
+        with self.lock:
+            counts = self.durations.setdefault(span.name, [0] * len(self.buckets) + [0, 0.0])
+            for i, bucket in enumerate(self.buckets):
+                if span.duration <= bucket:
+                    counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += span.duration
+            if span.error is not None:
+                self.errors[span.name] = self.errors.get(span.name, 0) + 1
+            model = span.attributes.get("model") or "unknown"
+            for kind in ("prompt", "completion", "embedding"):
+                tokens = span.attributes.get(kind + "_tokens")
+                if tokens:
+                    self.tokens[(model, kind)] = self.tokens.get((model, kind), 0) + tokens
+            if span.attributes.get("cost"):
+                self.costs[model] = self.costs.get(model, 0.0) + span.attributes["cost"]
+
+    def render(self):
+        lines = [
+            "# HELP pdfchatbot_stage_duration_seconds Time spent in each stage of the pipeline",
+            "# TYPE pdfchatbot_stage_duration_seconds histogram",
+        ]
+        with self.lock:
+            for stage, counts in sorted(self.durations.items()):
+                for bucket, count in zip(self.buckets, counts):
+                    lines.append("pdfchatbot_stage_duration_seconds_bucket%s %d" % (_labels(stage=stage, le=bucket), count))
+                lines.append("pdfchatbot_stage_duration_seconds_bucket%s %d" % (_labels(stage=stage, le="+Inf"), counts[-2]))
+                lines.append("pdfchatbot_stage_duration_seconds_sum%s %f" % (_labels(stage=stage), counts[-1]))
+                lines.append("pdfchatbot_stage_duration_seconds_count%s %d" % (_labels(stage=stage), counts[-2]))
+            lines += ["# HELP pdfchatbot_stage_errors_total Stages that raised an error", "# TYPE pdfchatbot_stage_errors_total counter"]
+            for stage, count in sorted(self.errors.items()):
+                lines.append("pdfchatbot_stage_errors_total%s %d" % (_labels(stage=stage), count))
+            lines += ["# HELP pdfchatbot_tokens_total Estimated tokens sent to and received from the models", "# TYPE pdfchatbot_tokens_total counter"]
+            for (model, kind), count in sorted(self.tokens.items()):
+                lines.append("pdfchatbot_tokens_total%s %d" % (_labels(model=model, kind=kind), count))
+            lines += ["# HELP pdfchatbot_cost_dollars_total Estimated cost of the model calls", "# TYPE pdfchatbot_cost_dollars_total counter"]
+            for model, cost in sorted(self.costs.items()):
+                lines.append("pdfchatbot_cost_dollars_total%s %f" % (_labels(model=model), cost))
+        return "\n".join(lines) + "\n"
+
+    # Serves the metrics on http://host:port/metrics from a background thread
+    def serve(self, port, host="127.0.0.1"):
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                content = exporter.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+
+# Sends the spans to OpenTelemetry when the opentelemetry api is installed, with whatever
+# span processor and exporter the process configured. The spans of a trace are sent once its
+# root span has ended, since the children end first and need their parent to be created.
+class OpenTelemetryExporter:
+    def __init__(self, tracer_name="pdf-chatbot"):
+        from opentelemetry import trace
+        self.trace = trace
+        self.tracer = trace.get_tracer(tracer_name)
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def export(self, span):
+        with self.lock:
+            self.pending.setdefault(span.trace_id, []).append(span)
+            if span.parent is not None:
+                return
+            spans = self.pending.pop(span.trace_id)
+
+        created = {}
+        for finished in sorted(spans, key=lambda s: s._start):
+            parent = created.get(finished.parent.span_id) if finished.parent is not None else None
+            context = self.trace.set_span_in_context(parent) if parent is not None else None
+            attributes = {key: value for key, value in finished.attributes.items() if isinstance(value, (str, bool, int, float))}
+            created[finished.span_id] = self.tracer.start_span(
+                finished.name, context=context, attributes=attributes, start_time=int(finished.start_time * 1e9)
+            )
+        for finished in spans:
+            otel_span = created[finished.span_id]
+            if finished.error is not None:
+                otel_span.set_status(self.trace.Status(self.trace.StatusCode.ERROR, finished.error))
+            otel_span.end(end_time=int((finished.start_time + finished.duration) * 1e9))
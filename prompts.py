@@ -0,0 +1,108 @@
+# The extraction templates sent to the model for every structured document type
+
+RESUME_QUERY = '''
+            Follow this format and insert the owner's information in the values. Do not copy the value:
+
+            {   
+                'docType': 'Answer with True or False, is this a resume?'
+                'name': "owner's name",
+                'contact': "owner's contact information separated by commas",
+                'experience': [
+                    {
+                        'company_name': 'first work experience company name',
+                        'job_date': 'from date and to date of the job',
+                        'job_title': 'job title for this experience',
+                        'job_description': 'summarize the experience description'
+                    },
+                    # Add more experiences if relevant
+                ],
+                'educationalBackground': { 
+                    'school': 'the school attended', 
+                    'course': 'the course taken', 
+                    'year': 'year started and ended' 
+                },
+                'technicalSkills': 'only give 5 of the most notable technical skills that can apply to full stack development',
+                'certifications': 'list out the resume owner\\'s certifications',
+            }
+
+            Send out the complete response and format it like a Python dictionary so that I can do eval() method on it later. Remove any bullet points
+            '''
+
+BILL_OF_LOADING_QUERY = '''
+            Follow this format and insert the proper information as values. Do not copy the value. If empty, just put 'none' as the value:
+
+            {   'docType': 'Answer with True or False, is this doc a bill of loading?',
+                'slwbNo': 'the slwbno of the shipment',
+                'shipper': "shipper's details (separate each detail with a new line)",
+                'consignee': "consignee's details (separate each detail with a new line)",
+                'notify_party': "notify party's details (separate each detail with a new line)",
+                'vessel': 'what vessel will be used within this delivery',
+                'loading_port': 'port of loading',
+                'discharge_port': 'port of discharge',
+                'packages_info': [
+                    {
+                        'mark_nos': 'total number of palletes',
+                        'num_kind': ['the number of palettes for the given product'],
+                        'desc': [
+                            {
+                                'cartons': 'how many cartons and what does it contain',
+                                'net_weight_prod': 'net-weight of the product',
+                                'temp': 'temperature of the product',
+                                'ncm': 'ncm of the product'
+                            },
+                            # (add more to this list if needed, separate each product's details into dictionaries inside this list)
+                        ],
+                        'gross_weight': 'package gross weight',
+                        'net_weight': 'package net weight'
+                    },
+                    # (if necessary create more object that contains the details like the last one)
+                ],
+                'freight_info': 'freight, charges, etc (if no data, just leave it blank)',
+                'freight_paid_at': 'freight to be paid at (if no data, just leave it blank)',
+                'place_date': 'place and date of issue',
+            }
+
+            Send out the complete response and format it like a Python dictionary so that I can do eval() method on it later. Remove any bullet points
+            '''
+
+PROCUREMENT_QUERY = '''
+                Follow this format and insert the proper information as values. Do not copy the value. If empty, just put 'none' as the value:
+
+                {
+                    'docType': 'Answer with True or False, is this doc a procurement doc based on the doc template? if the doc is a resume or a bill of loading answer False',
+                    'customer_name': 'the customer name stated in the paper.',
+                    'quote_info': {
+                        'quote_address': 'The address of the provider of the quote (add newline to every new bit of information.)',
+                        'quote_number': 'Quote Number or ID',
+                        'quote_creation_date': 'The Quote Creation Date',
+                        'quote_expiration_date': 'The expiration date of the quote',
+                    },
+                    'customer_details': {
+                        'customer_number': 'The customer number id',
+                        'payment_method': 'The payment method used for this quote',
+                        'customer_information': 'The customer\\'s information'                   
+                    },
+                    'billing': {
+                        'sales_rep': 'The details of the sales representative (add newline to every new bit of information.)',
+                        'bill_to': 'the information the \\'bill to\\' contains',
+                        'mail_to': 'the information the \\'mail to\\' contains',
+                        'ship_to': 'the information the \\'ship to\\' contains',
+                    },
+                    'pricing_summary': [
+                        {
+                            'product name': 'the product name or description',
+                            'qty': 'the product quantity',
+                            'list_price': 'product\\'s list price',
+                            'unit_price': 'product\\'s unit price',
+                            'net_price': 'product\\'s net price',
+                            'mark_up': 'The markup in price of list price and unit price in percentage add a & sign at the end'
+                        }
+                    ]
+                }
+            '''
+
+QUERIES = {
+    'Resume': RESUME_QUERY,
+    'Bill of loading': BILL_OF_LOADING_QUERY,
+    'Procurement': PROCUREMENT_QUERY,
+}
@@ -0,0 +1,102 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+
+
+# Persistent cache of llm responses keyed on the model, max_tokens, the query and the retrieved chunks.
+# Entries expire after 'ttl' seconds and the least recently used ones are dropped past 'max_entries'.
+# Questions asked about a document can also be matched by the similarity of their embeddings,
+# so "what is the vessel?" and "What is the vessel" are answered from the same entry.
+class ResponseCache:
+    def __init__(self, path=None, ttl=None, max_entries=None, similarity_threshold=None):
+        self.path = path or os.getenv("LLM_CACHE_PATH", os.path.join(".cache", "responses.sqlite"))
+        self.ttl = ttl if ttl is not None else float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+        self.max_entries = max_entries or int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000"))
+        self.similarity_threshold = similarity_threshold or float(os.getenv("LLM_CACHE_SIMILARITY", "0.97"))
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, timeout=60, check_same_thread=False, isolation_level=None)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT, document TEXT, response TEXT, embedding BLOB, created REAL, accessed REAL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_document ON responses (model, document)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+
+    @staticmethod
+    def make_key(model, max_tokens, query, docs):
+        digest = hashlib.sha256(("%s\0%s\0%s" % (model, max_tokens, query)).encode("utf-8"))
+        for doc in docs:
+            digest.update(hashlib.sha256(doc.page_content.encode("utf-8")).digest())
+        return digest.hexdigest()
+
+    # Looks the exact key up first, then when an embedding is given the most similar question
+    # asked about the same document. Returns None when neither is in the cache.
+    def lookup(self, key, model=None, document=None, embedding=None):
+        now = time.time()
+        with self.lock:
+            response = self._get(key, now)
+            if response is None and embedding is not None and document is not None:
+                response = self._find_similar(model, document, embedding, now)
+        if response is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return response
+
+    def _get(self, key, now):
+        row = self.db.execute("SELECT response FROM responses WHERE key = ? AND created > ?", (key, now - self.ttl)).fetchone()
+        if row is None:
+            return None
+        self.db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def _find_similar(self, model, document, embedding, now):
+        rows = self.db.execute(
+            "SELECT key, response, embedding FROM responses WHERE model IS ? AND document = ? AND embedding IS NOT NULL AND created > ?",
+            (model, document, now - self.ttl)
+        ).fetchall()
+        if not rows:
+            return None
+        query = np.asarray(embedding, dtype=np.float32)
+        matrix = np.stack([np.frombuffer(row[2], dtype=np.float32) for row in rows])
+        scores = matrix @ query / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(query) + 1e-12)
+        best = int(np.argmax(scores))
+        if scores[best] < self.similarity_threshold:
+            return None
+        self.db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, rows[best][0]))
+        return rows[best][1]
+
+    def put(self, key, response, model, document=None, embedding=None):
+        now = time.time()
+        blob = np.asarray(embedding, dtype=np.float32).tobytes() if embedding is not None else None
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses (key, model, document, response, embedding, created, accessed) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, model, document, response, blob, now, now)
+            )
+            self._evict(now)
+
+    def delete(self, key):
+        with self.lock:
+            self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def _evict(self, now):
+        self.db.execute("DELETE FROM responses WHERE created <= ?", (now - self.ttl,))
+        self.db.execute(
+            "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+    @property
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+    def clear(self):
+        with self.lock:
+            self.db.execute("DELETE FROM responses")
@@ -0,0 +1,111 @@
+import re
+import ast
+
+
+# Reads the python dictionary the extraction templates ask for while it is still being streamed.
+# feed() returns the top-level fields whose value is complete so far, so they can be shown right away.
+# Values are read with ast.literal_eval, the response is never run as code.
+class IncrementalDictParser:
+    def __init__(self):
+        self.data = {}
+        self.depth = 0
+        self.quote = None
+        self.escaped = False
+        self.comment = False
+        self.item = []
+        self.started = False
+        self.finished = False
+
+    def feed(self, text):
+        fields = []
+        for char in text:
+            if self.finished:
+                break
+            fields.extend(self._feed_char(char))
+        return fields
+
+    def _feed_char(self, char):
+        if self.comment:
+            # Comments like the '# Add more experiences' of the templates are dropped
+            if char == "\n":
+                self.comment = False
+                self.item.append(char)
+            return []
+
+        if self.quote is not None:
+            if self.depth >= 1:
+                self.item.append(char)
+            if self.escaped:
+                self.escaped = False
+            elif char == "\\":
+                self.escaped = True
+            elif char == self.quote:
+                self.quote = None
+            return []
+
+        if not self.started:
+            # Anything the model writes before the opening brace is ignored
+            if char == "{":
+                self.started = True
+                self.depth = 1
+            return []
+
+        if char in "'\"":
+            self.quote = char
+        elif char == "#":
+            self.comment = True
+            return []
+        elif char in "{[(":
+            self.depth += 1
+        elif char in "}])":
+            self.depth -= 1
+            if self.depth == 0:
+                self.finished = True
+                return self._complete_item()
+        elif char == "," and self.depth == 1:
+            return self._complete_item()
+        self.item.append(char)
+        return []
+
+    def _complete_item(self):
+        source = "".join(self.item).strip()
+        self.item = []
+        if not source:
+            return []
+        fields = list(_parse_items(source).items())
+        self.data.update(fields)
+        return fields
+
+    # Parses what is left of an answer that was cut off before its closing brace
+    def close(self):
+        if not self.started:
+            raise ValueError("The response doesn't contain a dictionary")
+        if self.finished:
+            return []
+        self.finished = True
+        try:
+            return self._complete_item()
+        except (ValueError, SyntaxError):
+            return []
+
+    def result(self):
+        return self.data
+
+
+def _parse_items(source):
+    try:
+        items = ast.literal_eval("{" + source + "}")
+    except SyntaxError:
+        # The model sometimes leaves out the comma between two entries, as the resume template itself does
+        items = ast.literal_eval("{" + re.sub(r"(['\"\]}])\s*\n(\s*['\"])", r"\1,\n\2", source) + "}")
+    # An entry without its colon, like "'docType' 'True'", reads as a set
+    if not isinstance(items, dict):
+        raise ValueError("Not a 'key': value entry: %s" % source[:80])
+    return items
+
+
+def parse_dict(response):
+    parser = IncrementalDictParser()
+    parser.feed(response)
+    parser.close()
+    return parser.result()
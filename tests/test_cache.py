@@ -0,0 +1,82 @@
+import os
+from cache import DocumentCache
+from fakes import DeterministicFakeEmbeddings
+
+
+# Pages of about 'size' bytes once saved
+def _pages(size):
+    return [(1, "x" * size)]
+
+
+# Marks the entry as last used 'seconds' ago, mtimes of files written in the same test are too close to order
+def _age(cache, key, seconds):
+    marker = cache._path(key, "access")
+    mtime = os.path.getmtime(marker) - seconds
+    os.utime(marker, (mtime, mtime))
+
+
+def test_miss_then_hit(tmp_path):
+    cache = DocumentCache(str(tmp_path))
+    key = cache.make_key(b"%PDF", {"chunk_size": 1250}, "fake")
+    assert cache.load_pages(key) is None
+    assert cache.load_chunks(key) is None
+    assert cache.load_index(key, DeterministicFakeEmbeddings()) is None
+
+    cache.save_pages(key, [(1, "first page"), (2, "second page")])
+    cache.save_chunks(key, ["first", "second"])
+    assert cache.load_pages(key) == [(1, "first page"), (2, "second page")]
+    assert cache.load_chunks(key) == ["first", "second"]
+
+
+def test_index_round_trip(tmp_path):
+    from langchain.vectorstores import FAISS
+    embeddings = DeterministicFakeEmbeddings()
+    cache = DocumentCache(str(tmp_path))
+    texts = ["shipper acme", "consignee globex", "vessel nordic star"]
+    cache.save_index("document", FAISS.from_texts(texts, embeddings))
+
+    knowledge_base = cache.load_index("document", embeddings)
+    assert knowledge_base.index.ntotal == 3
+    assert knowledge_base.similarity_search("vessel nordic star", k=1)[0].page_content == "vessel nordic star"
+
+
+def test_key_changes_with_the_settings_and_model():
+    key = DocumentCache.make_key(b"%PDF", {"chunk_size": 1250, "chunk_overlap": 200}, "ada")
+    assert key == DocumentCache.make_key(b"%PDF", {"chunk_overlap": 200, "chunk_size": 1250}, "ada")
+    assert key != DocumentCache.make_key(b"%PDF", {"chunk_size": 1000, "chunk_overlap": 200}, "ada")
+    assert key != DocumentCache.make_key(b"%PDF", {"chunk_size": 1250, "chunk_overlap": 200}, "fake")
+    assert key != DocumentCache.make_key(b"%PDF-1.4", {"chunk_size": 1250, "chunk_overlap": 200}, "ada")
+
+
+# Past max_bytes the entries whose access file is oldest go first, a read counts as an access
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = DocumentCache(str(tmp_path), max_bytes=2500)
+    cache.save_pages("a", _pages(1000))
+    cache.save_pages("b", _pages(1000))
+    _age(cache, "a", 20)
+    _age(cache, "b", 10)
+    assert cache.load_pages("a") is not None
+
+    cache.save_pages("c", _pages(1000))
+    assert cache.load_pages("b") is None
+    assert cache.load_pages("a") is not None
+    assert cache.load_pages("c") is not None
+    assert sorted(os.listdir(str(tmp_path))) == ["a", "c"]
+
+
+def test_cache_stays_within_max_bytes(tmp_path):
+    cache = DocumentCache(str(tmp_path), max_bytes=3500)
+    for i in range(10):
+        cache.save_pages(str(i), _pages(1000))
+        _age(cache, str(i), 100 - i)
+        assert sum(cache._entry_size(key) for key in os.listdir(str(tmp_path))) <= 3500
+    assert sorted(os.listdir(str(tmp_path))) == ["7", "8", "9"]
+
+
+# The entry just written is kept even when it is bigger than the whole cache on its own
+def test_entry_being_written_is_never_evicted(tmp_path):
+    cache = DocumentCache(str(tmp_path), max_bytes=500)
+    cache.save_pages("small", _pages(100))
+    cache.save_pages("big", _pages(1000))
+    assert os.listdir(str(tmp_path)) == ["big"]
+    assert cache.load_pages("big") == _pages(1000)
@@ -0,0 +1,18 @@
+import json
+from cli import load_checkpoint
+
+
+def _write(path, records):
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+        f.write('{"file": "cut short')
+
+
+# A rejected pdf is a final answer like an extracted one, only errors are worth another try
+def test_retry_errors_skips_rejected_pdfs(tmp_path):
+    output = str(tmp_path / "results.jsonl")
+    _write(output, [{"file": "a.pdf", "status": "ok"}, {"file": "b.pdf", "status": "rejected"}, {"file": "c.pdf", "status": "error"}])
+    assert load_checkpoint(output) == {"a.pdf", "b.pdf", "c.pdf"}
+    assert load_checkpoint(output, retry_errors=True) == {"a.pdf", "b.pdf"}
+    assert load_checkpoint(str(tmp_path / "missing.jsonl")) == set()
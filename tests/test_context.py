@@ -0,0 +1,73 @@
+from langchain.docstore.document import Document
+from cache import DocumentCache
+from context import ContextAssembler, map_reduce, MAP_MAX_TOKENS
+from fakes import StubLLMBackend, DeterministicFakeEmbeddings
+
+
+def _chunks(count, words=200):
+    return [Document(page_content=" ".join("word%d-%d" % (i, j) for j in range(words))) for i in range(count)]
+
+
+# Records the max_tokens of every call
+class RecordingBackend(StubLLMBackend):
+    def __init__(self):
+        super().__init__()
+        self.max_tokens_seen = []
+
+    def answer(self, docs, question, on_token=None, max_tokens=None):
+        self.max_tokens_seen.append(max_tokens)
+        return super().answer(docs, question, on_token)
+
+
+def test_oversized_chunk_is_split_to_fit():
+    assembler = ContextAssembler("gpt-3.5-turbo", 2048)
+    budget = assembler.budget("question")
+    big = Document(page_content=" ".join("word%d" % i for i in range(3000)), metadata={"page": 4})
+    groups = assembler.groups(_chunks(1) + [big], "question")
+    assert len(groups) > 2
+    for group in groups:
+        assert sum(assembler.count(doc.page_content) for doc in group) <= budget
+    pieces = [doc for group in groups for doc in group][1:]
+    assert " ".join(doc.page_content for doc in pieces) == big.page_content
+    assert all(doc.metadata == {"page": 4} for doc in pieces)
+
+
+def test_select_caps_the_groups_and_keeps_pdf_order():
+    assembler = ContextAssembler("gpt-3.5-turbo", 2048)
+    ordered = _chunks(60)
+    ranked = list(reversed(ordered))
+    selected = assembler.select(ranked, ordered, "question", 3)
+    assert len(assembler.groups(selected, "question")) <= 3
+    # The best ranked chunks are the last ones of the pdf, they are taken in pdf order
+    assert selected == ordered[-len(selected):]
+
+
+def test_map_step_answers_with_fewer_tokens():
+    backend = RecordingBackend()
+    assembler = ContextAssembler("gpt-3.5-turbo", 2048)
+    map_reduce(backend, assembler, _chunks(20), "question")
+    map_calls = len(assembler.map_step().groups(_chunks(20), "question"))
+    assert map_calls < len(assembler.groups(_chunks(20), "question"))
+    assert backend.max_tokens_seen[:map_calls] == [MAP_MAX_TOKENS] * map_calls
+    assert backend.max_tokens_seen[-1] is None
+
+
+# A question about a document far bigger than the budget is still answered in one streamed call from the
+# most similar chunks, only the extraction of the whole document is map-reduced
+def test_question_on_a_large_document_is_one_call(tmp_path):
+    from engine import ExtractionEngine
+    backend = StubLLMBackend()
+    engine = ExtractionEngine(backend, embeddings=DeterministicFakeEmbeddings(), embedding_model="fake", cache=DocumentCache(str(tmp_path)), extract_workers=1)
+    text = "\n".join("Line %d of the manifest, vessel Nordic Star on voyage %d to Rotterdam." % (i, i) for i in range(1000))
+    knowledge_base = engine.build_index("document", text)
+    assert knowledge_base.index.ntotal > 50
+
+    tokens = []
+    docs, needs_map_reduce = engine.retrieve(knowledge_base, "What is the vessel?")
+    assert not needs_map_reduce
+    engine.ask(knowledge_base, "What is the vessel?", on_token=tokens.append)
+    assert backend.calls == 1
+    assert "".join(tokens) == "This is a stub answer based on %d documents." % len(docs)
+
+    _, needs_map_reduce = engine.retrieve(knowledge_base, "question", whole_document=True)
+    assert needs_map_reduce
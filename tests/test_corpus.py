@@ -0,0 +1,85 @@
+import os
+import shutil
+import numpy as np
+import pytest
+import corpus as corpus_module
+from corpus import CorpusIndex
+
+DIM = 16
+
+
+# Chunk j of document d gets its own direction, so an exact search for it has to return it with score 1
+def _vectors(doc, count):
+    vectors = np.zeros((count, DIM), dtype=np.float32)
+    for j in range(count):
+        vectors[j, (doc * 4 + j) % DIM] = 1.0
+        vectors[j, (doc * 4 + j + 1) % DIM] = 0.5
+    return vectors
+
+
+def _add(corpus, doc, count=3, **kwargs):
+    corpus.add_document("doc-%d" % doc, ["doc %d chunk %d" % (doc, j) for j in range(count)], doc_type="Resume", vectors=_vectors(doc, count), **kwargs)
+
+
+def _assert_finds_every_chunk(corpus, docs, count=3):
+    for doc in docs:
+        for j, vector in enumerate(_vectors(doc, count)):
+            # Once through the faiss index and once exactly on the vectors file
+            for filters in ({}, {"doc_types": ["Resume"]}):
+                (found, score), = corpus.search_by_vector(vector, k=1, **filters)
+                assert found.page_content == "doc %d chunk %d" % (doc, j)
+                assert score == pytest.approx(1.0, abs=1e-5)
+
+
+def test_add_delete_search_stay_aligned(tmp_path):
+    corpus = CorpusIndex(None, root=str(tmp_path))
+    for doc in range(4):
+        _add(corpus, doc)
+    corpus.delete_document("doc-1")
+    _add(corpus, 2)
+    _assert_finds_every_chunk(corpus, [0, 2, 3])
+    assert corpus.maybe_compact(force=True)
+    _add(corpus, 5)
+    _assert_finds_every_chunk(corpus, [0, 2, 3, 5])
+
+    # The index was saved by every add and delete, a new process sees the same corpus
+    reopened = CorpusIndex(None, root=str(tmp_path))
+    assert reopened.index.ntotal == 12
+    _assert_finds_every_chunk(reopened, [0, 2, 3, 5])
+
+
+# An add that fails after its vectors were written must not shift the rows of the next documents
+def test_failed_add_leaves_no_orphan_rows(tmp_path):
+    corpus = CorpusIndex(None, root=str(tmp_path))
+    _add(corpus, 0)
+    with pytest.raises(Exception):
+        # A page number sqlite can't store fails the insert after the vectors were appended
+        _add(corpus, 1, pages=[object()] * 3)
+    assert not corpus.has_document("doc-1")
+    _add(corpus, 2)
+    _assert_finds_every_chunk(corpus, [0, 2])
+    assert os.path.getsize(corpus._vectors_path()) == 6 * DIM * 4
+
+
+def test_stale_index_file_is_rebuilt(tmp_path):
+    corpus = CorpusIndex(None, root=str(tmp_path))
+    _add(corpus, 0)
+    shutil.copy(str(tmp_path / "index.faiss"), str(tmp_path / "old.faiss"))
+    _add(corpus, 1)
+    # Like a process that died after committing the second document but before saving the index
+    shutil.copy(str(tmp_path / "old.faiss"), str(tmp_path / "index.faiss"))
+
+    reopened = CorpusIndex(None, root=str(tmp_path))
+    assert reopened.index.ntotal == 6
+    _assert_finds_every_chunk(reopened, [0, 1])
+
+
+def test_ivf_index_after_training(tmp_path, monkeypatch):
+    monkeypatch.setattr(corpus_module, "TRAIN_THRESHOLD", 40)
+    corpus = CorpusIndex(None, root=str(tmp_path), nprobe=64)
+    for doc in range(16):
+        _add(corpus, doc)
+    assert type(corpus.index).__name__ == "IndexIVFFlat"
+    corpus.delete_document("doc-3")
+    assert corpus.index.ntotal == 45
+    assert corpus.search_by_vector(_vectors(3, 3)[0], k=1, doc_ids=["doc-3"]) == []
@@ -0,0 +1,71 @@
+import os
+import json
+import pytest
+from doctype import DocTypeClassifier, OTHER
+from synthetic import DOC_TYPES, synthetic_pdf, make_pdf
+
+
+with open(os.path.join(os.path.dirname(__file__), "data", "doctype_samples.json"), encoding="utf-8") as f:
+    SAMPLES = json.load(f)
+TEMPLATES = [sample for sample in SAMPLES if sample["label"] != OTHER]
+OTHERS = [sample for sample in SAMPLES if sample["label"] == OTHER]
+
+
+@pytest.fixture(scope="module")
+def classifier():
+    return DocTypeClassifier()
+
+
+# A real document of a template is never rejected, whichever option the user picked
+@pytest.mark.parametrize("sample", TEMPLATES, ids=lambda sample: sample["name"])
+@pytest.mark.parametrize("chosen", DOC_TYPES)
+def test_templates_are_not_rejected(classifier, sample, chosen):
+    template, _, _ = classifier.route(sample["text"], chosen)
+    assert template in (sample["label"], chosen)
+
+
+# Look-alikes like invoices are rejected or left to the model, never extracted with another template
+@pytest.mark.parametrize("sample", OTHERS, ids=lambda sample: sample["name"])
+@pytest.mark.parametrize("chosen", DOC_TYPES)
+def test_other_documents_are_not_routed(classifier, sample, chosen):
+    template, _, _ = classifier.route(sample["text"], chosen)
+    assert template in (None, chosen)
+
+
+def test_abstains_below_the_confidence(classifier):
+    text = next(sample["text"] for sample in SAMPLES if sample["name"] == "plain prose resume")
+    predicted, confidence = classifier.predict(text)
+    assert classifier.route(text, "Procurement", min_confidence=min(confidence + 0.01, 1.0)) == ("Procurement", predicted, confidence)
+
+
+def test_abstains_on_too_little_text(classifier):
+    template, predicted, _ = classifier.route("Scanned page 1", "Resume")
+    assert predicted == OTHER
+    assert template == "Resume"
+
+
+def test_fit_keeps_the_prior_and_round_trips(classifier, tmp_path):
+    prior = classifier.weights.copy()
+    texts = [sample["text"] for sample in SAMPLES]
+    tuned = DocTypeClassifier().fit(texts, [sample["label"] for sample in SAMPLES], epochs=20)
+    assert (tuned.prior == prior).all()
+    tuned.save(str(tmp_path / "model.json"))
+    loaded = DocTypeClassifier.load(str(tmp_path / "model.json"))
+    assert loaded.classes == tuned.classes
+    assert loaded.predict_proba(texts) == pytest.approx(tuned.predict_proba(texts))
+
+
+def test_process_rejects_only_confident_others(tmp_path):
+    from cache import DocumentCache
+    from engine import ExtractionEngine
+    from fakes import StubLLMBackend, DeterministicFakeEmbeddings
+    engine = ExtractionEngine(StubLLMBackend(), embeddings=DeterministicFakeEmbeddings(), embedding_model="fake", cache=DocumentCache(str(tmp_path)), extract_workers=1)
+
+    lease = next(sample["text"] for sample in OTHERS if sample["name"] == "residential lease")
+    record = engine.process(make_pdf([lease.splitlines()]), "Resume", check_doc_type=True)
+    assert record["status"] == "rejected"
+    assert record["response"] is None
+
+    record = engine.process(synthetic_pdf("Bill of loading", 2), "Resume", check_doc_type=True)
+    assert record["status"] == "ok"
+    assert record["doc_type"] == "Bill of loading"
@@ -0,0 +1,98 @@
+import os
+import sqlite3
+import threading
+import numpy as np
+from embedding_cache import CachedEmbeddings, EmbeddingStore
+from fakes import DeterministicFakeEmbeddings
+
+
+def _vectors(count, dim=8, start=0):
+    return np.arange(start * dim, (start + count) * dim, dtype=np.float32).reshape(count, dim)
+
+
+def _file(root, store):
+    return os.path.join(root, store._model("model")[1])
+
+
+def test_round_trip_and_reopen(tmp_path):
+    store = EmbeddingStore(str(tmp_path))
+    store.put_many("model", ["a", "b"], _vectors(2))
+    store.put_many("model", ["c"], _vectors(1, start=2))
+    store.put_many("other", ["a"], _vectors(1, dim=4))
+    found = store.get_many("model", ["c", "missing", "a", "b"])
+    assert found[1] is None
+    np.testing.assert_array_equal(np.vstack([found[2], found[3], found[0]]), _vectors(3))
+
+    reopened = EmbeddingStore(str(tmp_path))
+    np.testing.assert_array_equal(np.vstack(reopened.get_many("model", ["a", "b", "c"])), _vectors(3))
+    np.testing.assert_array_equal(reopened.get_many("other", ["a"])[0], _vectors(1, dim=4)[0])
+
+
+# A process that died between writing its vectors and committing their keys leaves rows nothing points to,
+# the next put must not take them for its own
+def test_rows_of_an_uncommitted_put_are_overwritten(tmp_path):
+    root = str(tmp_path)
+    store = EmbeddingStore(root)
+    store.put_many("model", ["a", "b"], _vectors(2))
+    with open(_file(root, store), "ab") as f:
+        f.write(np.full((3, 8), -1, dtype=np.float32).tobytes() + b"\x01\x02")
+
+    reopened = EmbeddingStore(root)
+    reopened.put_many("model", ["c", "d"], _vectors(2, start=2))
+    np.testing.assert_array_equal(np.vstack(reopened.get_many("model", ["a", "b", "c", "d"])), _vectors(4))
+    assert os.path.getsize(_file(root, reopened)) == 4 * 8 * 4
+
+
+def test_failed_put_leaves_no_rows(tmp_path):
+    store = EmbeddingStore(str(tmp_path))
+    store.put_many("model", ["a"], _vectors(1))
+    try:
+        # A key sqlite can't store fails the insert after the vectors were written
+        store.put_many("model", ["b", object()], _vectors(2, start=1))
+    except Exception:
+        pass
+    assert store.get_many("model", ["b"]) == [None]
+    store.put_many("model", ["c"], _vectors(1, start=1))
+    np.testing.assert_array_equal(np.vstack(store.get_many("model", ["a", "c"])), _vectors(2))
+
+
+# Stores written before the committed row count was kept take it from their file size
+def test_store_without_row_counts(tmp_path):
+    root = str(tmp_path)
+    db = sqlite3.connect(os.path.join(root, "embeddings.sqlite"))
+    db.execute("CREATE TABLE models (model TEXT PRIMARY KEY, dim INTEGER, file TEXT)")
+    db.execute("CREATE TABLE vectors (key TEXT PRIMARY KEY, row INTEGER)")
+    db.execute("INSERT INTO models VALUES ('model', 8, 'vectors.f32')")
+    db.execute("INSERT INTO vectors VALUES (?, 0)", (EmbeddingStore.make_key("model", "a"),))
+    db.commit()
+    db.close()
+    with open(os.path.join(root, "vectors.f32"), "wb") as f:
+        f.write(_vectors(1).tobytes())
+
+    store = EmbeddingStore(root)
+    store.put_many("model", ["b"], _vectors(1, start=1))
+    np.testing.assert_array_equal(np.vstack(store.get_many("model", ["a", "b"])), _vectors(2))
+
+
+def test_only_misses_are_embedded(tmp_path):
+    fake = DeterministicFakeEmbeddings()
+    embeddings = CachedEmbeddings(fake, "fake", store=EmbeddingStore(str(tmp_path)), batch_size=2)
+    first = embeddings.embed_documents(["a", "b", "c", "a"])
+    calls = fake.calls
+    second = embeddings.embed_documents(["c", "b", "d"])
+    # Only "d" was sent, in one batch
+    assert fake.calls - calls == 1
+    assert first[0] == first[3] == fake.embed_query("a")
+    assert second[:2] == [first[2], first[1]]
+    assert embeddings.stats["hits"] == 2 and embeddings.stats["misses"] == 4
+
+
+def test_counters_from_many_threads(tmp_path):
+    embeddings = CachedEmbeddings(DeterministicFakeEmbeddings(), "fake", store=EmbeddingStore(str(tmp_path)))
+    threads = [threading.Thread(target=embeddings.embed_documents, args=(["text %d %d" % (t, i) for i in range(50)],)) for t in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert embeddings.stats["misses"] == 400
+    assert embeddings.store.get_many("fake", ["text 7 49"])[0] is not None
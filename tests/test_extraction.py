@@ -0,0 +1,71 @@
+import re
+import time
+import pytest
+import threading
+from PyPDF2 import PageObject
+from langchain.text_splitter import CharacterTextSplitter
+from engine import SPLITTER_SETTINGS
+from extraction import join_pages, chunk_pages, find_chunk, extract_pages
+from synthetic import make_pdf
+
+
+# Pages of numbered lines with a blank line after every few, like paragraphs
+def blank_line_pages(count, lines=60):
+    return [
+        (page, "".join("Line %d of page %d with a few more words.\n%s" % (line, page, "\n" if line % 4 == 3 else "") for line in range(lines)))
+        for page in range(1, count + 1)
+    ]
+
+
+def split_text(text):
+    return CharacterTextSplitter(length_function=len, **SPLITTER_SETTINGS).split_text(text)
+
+
+def test_chunk_spanning_a_blank_line_is_found():
+    text = "first line\n\n\nsecond  line\nthird line\n"
+    assert find_chunk(text, "first line\nsecond  line") == 0
+    assert find_chunk(text, "second  line\nthird line") == text.index("second")
+    assert find_chunk(text, "first line\nsecond line", 1) == -1
+
+
+# Every chunk is attributed to the page its first line is on
+def test_chunk_pages_with_blank_lines():
+    pages = blank_line_pages(20)
+    text, offsets = join_pages(pages)
+    chunks = split_text(text)
+    assert any(chunk not in text for chunk in chunks)
+    expected = [int(re.match(r"Line \d+ of page (\d+)", chunk).group(1)) for chunk in chunks]
+    assert chunk_pages(text, chunks, pages, offsets) == expected
+    assert expected[-1] == 20
+
+
+# A page stuck in the pdf parser is skipped after page_timeout also when the pages are read serially,
+# as the batch workers and the streamed ingestion do, and the pages after it are still read
+def test_hanging_page_times_out_on_a_single_worker(monkeypatch):
+    release = threading.Event()
+    extract_text = PageObject.extract_text
+
+    def hanging(page, *args, **kwargs):
+        text = extract_text(page, *args, **kwargs)
+        if "page 2" in text:
+            release.wait()
+        return text
+    monkeypatch.setattr(PageObject, "extract_text", hanging)
+
+    pdf = make_pdf([["This is page %d" % page] for page in range(1, 5)])
+    start = time.perf_counter()
+    try:
+        pages = list(extract_pages(pdf, workers=1, page_timeout=0.5))
+    finally:
+        release.set()
+    assert time.perf_counter() - start < 5
+    assert [number for number, _ in pages] == [1, 2, 3, 4]
+    assert [text.strip() for _, text in pages] == ["This is page 1", "", "This is page 3", "This is page 4"]
+
+
+def test_page_error_is_raised_on_a_single_worker(monkeypatch):
+    def broken(page, *args, **kwargs):
+        raise ValueError("broken page")
+    monkeypatch.setattr(PageObject, "extract_text", broken)
+    with pytest.raises(ValueError):
+        list(extract_pages(make_pdf([["page"]]), workers=1))
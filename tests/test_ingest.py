@@ -0,0 +1,125 @@
+import threading
+import pytest
+from langchain.text_splitter import CharacterTextSplitter
+from cache import DocumentCache
+from engine import ExtractionEngine, SPLITTER_SETTINGS
+from extraction import extract_pages, join_pages, chunk_pages
+from fakes import StubLLMBackend, DeterministicFakeEmbeddings
+from ingest import split_pages
+from synthetic import synthetic_pages, synthetic_pdf
+
+
+def split_text(text):
+    return CharacterTextSplitter(length_function=len, **SPLITTER_SETTINGS).split_text(text)
+
+
+# The resume's sections are separated by blank lines, the chunks spanning them aren't substrings of the text
+@pytest.mark.parametrize("window", [3000, 5000, 20000])
+def test_streamed_chunks_are_those_of_the_whole_text(window):
+    pages = [(i + 1, "\n".join(lines) + "\n") for i, lines in enumerate(synthetic_pages("Resume", 30))]
+    text, offsets = join_pages(pages)
+    chunks = split_text(text)
+    assert any(chunk not in text for chunk in chunks)
+    assert len(text) > 3 * window
+
+    streamed = list(split_pages(split_text, pages, window))
+    assert [chunk for chunk, _ in streamed] == chunks
+    assert [page for _, page in streamed] == chunk_pages(text, chunks, pages, offsets)
+
+
+# Embeds like the fake, the embedding of every batch waits for 'release' and the batch numbered 'fail_on' raises
+class GatedEmbeddings(DeterministicFakeEmbeddings):
+    def __init__(self, fail_on=None):
+        super().__init__()
+        self.release = threading.Event()
+        self.release.set()
+        self.batches = 0
+        self.fail_on = fail_on
+
+    def embed_documents(self, texts):
+        self.batches += 1
+        if self.batches == self.fail_on:
+            raise RuntimeError("embedding failed")
+        self.release.wait()
+        return super().embed_documents(texts)
+
+
+def _engine(tmp_path, embeddings):
+    return ExtractionEngine(StubLLMBackend(), embeddings=embeddings, embedding_model="fake", cache=DocumentCache(str(tmp_path)), extract_workers=1)
+
+
+def _whole_text_chunks(engine, pdf_bytes):
+    pages = list(extract_pages(pdf_bytes, workers=1))
+    text, offsets = join_pages(pages)
+    chunks = engine.text_splitter.split_text(text)
+    return chunks, chunk_pages(text, chunks, pages, offsets)
+
+
+def test_chunks_are_indexed_with_their_pages(tmp_path):
+    engine = _engine(tmp_path, DeterministicFakeEmbeddings())
+    pdf_bytes = synthetic_pdf("Bill of loading", 12)
+    ingestion = engine.ingest("document", pdf_bytes, batch_size=8, window=4000)
+    documents = ingestion.result(timeout=30).documents
+
+    chunks, pages = _whole_text_chunks(engine, pdf_bytes)
+    assert [doc.page_content for doc in documents] == chunks
+    assert [doc.metadata["page"] for doc in documents] == pages
+    assert pages[-1] == 12
+    assert ingestion.progress == 1.0 and ingestion.chunks_indexed == len(chunks)
+
+
+# While the embedding is held up only a few batches and pages are in flight, and the
+# chunks indexed so far can already be searched
+def test_slow_embedding_holds_back_the_reading(tmp_path):
+    embeddings = GatedEmbeddings()
+    engine = _engine(tmp_path, embeddings)
+    pdf_bytes = synthetic_pdf("Resume", 60)
+    ingestion = engine.ingest("document", pdf_bytes, queue_size=2, batch_size=4, window=3000)
+    try:
+        while ingestion.chunks_indexed == 0:
+            ingestion.done.wait(0.01)
+        embeddings.release.clear()
+        ingestion.done.wait(1.0)
+        read = ingestion.pages_read
+        ingestion.done.wait(0.5)
+        assert ingestion.pages_read == read
+        assert read < 20
+        assert not ingestion.done.is_set()
+        assert ingestion.knowledge_base.similarity_search("work experience", k=2)
+    finally:
+        embeddings.release.set()
+    assert ingestion.result(timeout=30).ntotal == len(_whole_text_chunks(engine, pdf_bytes)[0])
+
+
+def test_failing_stage_is_raised_from_result(tmp_path):
+    engine = _engine(tmp_path, GatedEmbeddings(fail_on=2))
+    ingestion = engine.ingest("document", synthetic_pdf("Resume", 30), queue_size=2, batch_size=4, window=3000)
+    with pytest.raises(RuntimeError, match="embedding failed"):
+        ingestion.result(timeout=30)
+    # Nothing is saved for a pdf that wasn't indexed whole
+    assert engine.cache.load_index("document", engine.embeddings) is None
+
+
+def test_failing_split_is_raised_from_result(tmp_path):
+    class BrokenSplitter:
+        def split_text(self, text):
+            raise ValueError("split failed")
+    engine = _engine(tmp_path, DeterministicFakeEmbeddings())
+    engine.text_splitter = BrokenSplitter()
+    with pytest.raises(ValueError, match="split failed"):
+        engine.ingest("document", synthetic_pdf("Resume", 30), window=3000).result(timeout=30)
+
+
+# The finished index is saved and a second ingestion of the pdf loads it without embedding anything
+def test_ingested_pdf_is_reloaded_from_the_cache(tmp_path):
+    pdf_bytes = synthetic_pdf("Procurement", 8)
+    first = _engine(tmp_path, DeterministicFakeEmbeddings()).ingest("document", pdf_bytes, window=4000)
+    chunks = first.result(timeout=30).ntotal
+
+    embeddings = DeterministicFakeEmbeddings()
+    second = _engine(tmp_path, embeddings).ingest("document", pdf_bytes, window=4000)
+    knowledge_base = second.result(timeout=30)
+    assert second.cached and second.progress == 1.0
+    assert knowledge_base.ntotal == chunks
+    assert embeddings.calls == 0
+    assert [doc.page_content for doc in knowledge_base.documents] == [doc.page_content for doc in first.knowledge_base.documents]
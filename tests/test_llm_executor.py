@@ -0,0 +1,73 @@
+import asyncio
+import threading
+import pytest
+from langchain.docstore.document import Document
+from fakes import StubLLMBackend, FlakyBackend
+from llm_executor import AsyncLLMExecutor
+
+
+def _executor(backend, **kwargs):
+    return AsyncLLMExecutor(backend, requests_per_minute=10 ** 6, tokens_per_minute=10 ** 9, base_delay=0.001, **kwargs)
+
+
+DOCS = [Document(page_content="The shipper is ACME.")]
+
+
+def test_retries_until_the_call_succeeds():
+    backend = FlakyBackend(failures=2)
+    executor = _executor(backend)
+    assert executor.answer(DOCS, "Who is the shipper?").startswith("This is a stub answer")
+    assert backend.calls == 3
+    assert executor.retries == 2
+
+
+def test_gives_up_after_max_retries():
+    backend = FlakyBackend(failures=5)
+    with pytest.raises(TimeoutError):
+        _executor(backend, max_retries=2).answer(DOCS, "Who is the shipper?")
+    assert backend.calls == 3
+
+
+def test_stream_is_retried_before_its_first_token():
+    backend = FlakyBackend(failures=1)
+    tokens = []
+    answer = _executor(backend).answer(DOCS, "Who is the shipper?", on_token=tokens.append)
+    assert "".join(tokens) == answer
+
+
+# Sending a stream again after some of it reached the caller would show those tokens twice
+def test_stream_is_not_retried_after_its_first_token():
+    backend = FlakyBackend(failures=1, tokens_first=2)
+    executor = _executor(backend)
+    tokens = []
+    with pytest.raises(TimeoutError):
+        executor.answer(DOCS, "Who is the shipper?", on_token=tokens.append)
+    assert tokens == ["partial 0 ", "partial 1 "]
+    assert backend.calls == 1
+    assert executor.retries == 0
+
+
+def test_identical_requests_in_flight_share_one_call():
+    backend = StubLLMBackend(latency=0.2)
+    executor = _executor(backend)
+
+    async def ask_together():
+        return await asyncio.gather(*[executor.aanswer(DOCS, "Who is the shipper?") for _ in range(5)], executor.aanswer(DOCS, "Who is the consignee?"))
+
+    answers = asyncio.run_coroutine_threadsafe(ask_together(), executor._get_loop()).result()
+    assert len(set(answers)) == 1
+    assert backend.calls == 2
+    assert executor.coalesced == 4
+
+
+def test_streamed_requests_are_never_coalesced():
+    backend = StubLLMBackend(latency=0.1)
+    executor = _executor(backend)
+    streams = [[], []]
+    threads = [threading.Thread(target=executor.answer, args=(DOCS, "Who is the shipper?", tokens.append)) for tokens in streams]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert backend.calls == 2
+    assert streams[0] == streams[1] != []
@@ -0,0 +1,68 @@
+import math
+import numpy as np
+import pytest
+from local_retrieval import BM25Index, LocalIndex, LocalKnowledgeBase, RRF_K, _top
+
+TEXTS = [
+    "Shipper: Acme Logistics. The shipper pays the freight.",
+    "Consignee: Globex Corporation, Springfield.",
+    "Port of loading: Rotterdam. Port of discharge: Santos.",
+    "Gross weight 12,400 kg in 40 cartons.",
+    "Notify party: the consignee, Globex Corporation.",
+]
+
+
+# Okapi BM25 written out term by term, the index precomputes the same weights as a sparse matrix
+def _bm25(texts, query, k1=1.5, b=0.75):
+    docs = [[word for word in text.lower().replace(",", " ").replace(".", " ").replace(":", " ").split()] for text in texts]
+    average = sum(len(doc) for doc in docs) / len(docs)
+    scores = []
+    for doc in docs:
+        score = 0.0
+        for term in set(query.lower().split()):
+            df = sum(term in other for other in docs)
+            tf = doc.count(term)
+            idf = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+            score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(doc) / average))
+        scores.append(score)
+    return np.array(scores)
+
+
+@pytest.mark.parametrize("query", ["shipper", "globex consignee", "port of discharge", "weight cartons freight"])
+def test_bm25_scores_match_the_formula(query):
+    np.testing.assert_allclose(BM25Index(TEXTS).scores(query), _bm25(TEXTS, query), rtol=1e-5)
+
+
+def test_bm25_ranks_rare_terms_and_repeats_higher():
+    scores = BM25Index(TEXTS).scores("shipper globex")
+    # "shipper" appears twice in one chunk and nowhere else, "globex" once in two chunks
+    assert list(_top(scores, 5)) == [0, 1, 4]
+    assert scores[0] > scores[1] > scores[4] > 0
+    assert list(_top(BM25Index(TEXTS).scores("nothing matches"), 5)) == []
+
+
+def test_reciprocal_rank_fusion_adds_up_both_rankings():
+    index = LocalIndex(TEXTS)
+    rows, scores = index.search("consignee globex corporation", k=5)
+    # Both chunks naming the consignee are ranked first by both scorers, in the same order
+    assert set(rows[:2]) == {1, 4}
+    assert scores[0] == pytest.approx(2.0 / (RRF_K + 1))
+    assert scores[1] == pytest.approx(2.0 / (RRF_K + 2))
+    assert list(scores) == sorted(scores, reverse=True)
+
+
+# A misspelling only the character n-grams catch still finds its chunk through the TF-IDF ranking
+def test_fusion_keeps_chunks_only_one_scorer_found():
+    index = LocalIndex(TEXTS)
+    rows, scores = index.search("Rotterdamm", k=1)
+    assert list(rows) == [2]
+    assert index.bm25.scores("Rotterdamm").max() == 0
+    assert scores[0] == pytest.approx(1.0 / (RRF_K + 1))
+
+
+def test_knowledge_base_returns_the_chunks():
+    knowledge_base = LocalKnowledgeBase.from_texts(TEXTS, ngram_range=(3, 5), bits=16)
+    found = knowledge_base.similarity_search_with_score("port of loading", k=10)
+    assert found[0][0].page_content == TEXTS[2]
+    assert len(found) <= len(TEXTS)
+    assert [doc.page_content for doc in knowledge_base.documents] == TEXTS
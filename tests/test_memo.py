@@ -0,0 +1,69 @@
+from memo import StageMemo
+
+
+def test_hit_after_put_and_across_reruns():
+    state = {}
+    memo = StageMemo(state)
+    assert memo.get("result", "key") is None
+    memo.put("result", "key", {"response": "answer"})
+    assert memo.get("result", "key") == {"response": "answer"}
+    # A rerun builds a new memo over the same session state
+    assert StageMemo(state).get("result", "key") == {"response": "answer"}
+    assert StageMemo({}).get("result", "key") is None
+
+
+def test_get_or_compute_computes_once():
+    memo = StageMemo({})
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return "text"
+    assert memo.get_or_compute("document", "upload", compute) == "text"
+    assert memo.get_or_compute("document", "upload", compute) == "text"
+    assert len(calls) == 1
+
+
+# Changing anything the key is made of, like the option or the model, misses
+def test_changed_key_misses():
+    memo = StageMemo({})
+    memo.put("result", ("pdf", "Resume", "gpt-3.5-turbo"), "resume")
+    assert memo.get("result", ("pdf", "Resume", "text-davinci-003")) is None
+    assert memo.get("result", ("pdf", "Procurement", "gpt-3.5-turbo")) is None
+    assert memo.get("result", ("other pdf", "Resume", "gpt-3.5-turbo")) is None
+    # The stages are kept apart
+    assert memo.get("route", ("pdf", "Resume", "gpt-3.5-turbo")) is None
+
+
+def test_least_recently_used_entries_are_dropped():
+    memo = StageMemo({}, max_entries=2)
+    memo.put("result", "a", 1)
+    memo.put("result", "b", 2)
+    memo.get("result", "a")
+    memo.put("result", "c", 3)
+    assert memo.get("result", "b") is None
+    assert memo.get("result", "a") == 1 and memo.get("result", "c") == 3
+    memo.put("route", "d", 4)
+    assert memo.get("result", "a") == 1
+
+
+def test_clear():
+    memo = StageMemo({})
+    memo.put("result", "a", 1)
+    memo.put("route", "a", 2)
+    memo.clear("result")
+    assert memo.get("result", "a") is None and memo.get("route", "a") == 2
+    memo.clear()
+    assert memo.get("route", "a") is None
+
+
+# Ticking "Bypass response cache" changes the key of the result, so the answer kept without it isn't shown
+def test_bypass_cache_is_part_of_the_result_key():
+    from app import PDFChatBot
+    bot = PDFChatBot()
+    bot.cache_key, bot.option, bot.model = "pdf", "Ask your pdf", "gpt-3.5-turbo"
+    memo = StageMemo({})
+    memo.put("result", bot._result_key("what is the shipper?"), {"response": "remembered"})
+    assert memo.get("result", bot._result_key("what is the shipper?")) is not None
+    bot.bypass_cache = True
+    assert memo.get("result", bot._result_key("what is the shipper?")) is None
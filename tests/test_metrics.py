@@ -0,0 +1,52 @@
+import time
+import threading
+from embedding_cache import CachedEmbeddings, EmbeddingStore
+from engine import ExtractionEngine
+from cache import DocumentCache
+from fakes import StubLLMBackend, DeterministicFakeEmbeddings
+from metrics import PrometheusExporter, Tracer, track_embedding_usage
+from tokens import count_tokens
+
+
+class SlowEmbeddings(DeterministicFakeEmbeddings):
+    def embed_documents(self, texts):
+        time.sleep(0.05)
+        return super().embed_documents(texts)
+
+
+# Two sessions embedding through the same CachedEmbeddings at once are each charged for their own chunks
+def test_embedding_tokens_are_charged_to_the_caller(tmp_path):
+    embeddings = CachedEmbeddings(SlowEmbeddings(), "fake", store=EmbeddingStore(str(tmp_path / "embeddings")), batch_size=1)
+    engine = ExtractionEngine(
+        StubLLMBackend(), embeddings=embeddings, embedding_model="fake", cache=DocumentCache(str(tmp_path / "documents")), extract_workers=1, tracer=Tracer()
+    )
+    texts = {"short": "Shipper: Acme", "long": "\n".join("Consignee number %d: Globex Corporation, Springfield" % i for i in range(40))}
+    usage = {}
+
+    def build(name):
+        with engine.tracer.span("request") as span:
+            engine.build_index(name, texts[name])
+        usage[name] = span.usage["embedding_tokens"]
+
+    threads = [threading.Thread(target=build, args=(name,)) for name in texts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    chunks = {name: engine.text_splitter.split_text(text) for name, text in texts.items()}
+    for name in texts:
+        assert usage[name] == sum(count_tokens(chunk, "fake") for chunk in chunks[name])
+    assert embeddings.stats["tokens"] == usage["short"] + usage["long"]
+
+    # Embedded before, nothing is sent and nothing charged
+    with track_embedding_usage() as again:
+        embeddings.embed_documents(chunks["long"])
+    assert again.tokens == 0
+
+
+def test_prometheus_listens_on_localhost_by_default():
+    exporter = PrometheusExporter().serve(0)
+    try:
+        assert exporter.server.server_address[0] == "127.0.0.1"
+    finally:
+        exporter.server.shutdown()
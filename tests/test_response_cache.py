@@ -0,0 +1,120 @@
+import types
+import pytest
+import response_cache as response_cache_module
+from cache import DocumentCache
+from engine import ExtractionEngine
+from fakes import StubLLMBackend, FlakyBackend, DeterministicFakeEmbeddings
+from prompts import QUERIES
+from response_cache import ResponseCache
+
+
+def _engine(tmp_path, backend):
+    response_cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+    engine = ExtractionEngine(
+        backend, embeddings=DeterministicFakeEmbeddings(), embedding_model="fake", cache=DocumentCache(str(tmp_path / "documents")),
+        extract_workers=1, response_cache=response_cache
+    )
+    knowledge_base = engine.build_index("document", "Shipper: Acme Logistics\nConsignee: Globex Corporation\n")
+    return engine, knowledge_base, response_cache
+
+
+def _entries(response_cache):
+    return response_cache.db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+
+def test_unparsable_answer_is_not_cached(tmp_path):
+    backend = FlakyBackend(broken=1)
+    engine, knowledge_base, response_cache = _engine(tmp_path, backend)
+    query = QUERIES['Bill of loading']
+
+    with pytest.raises(ValueError):
+        engine.ask(knowledge_base, query, document="document", whole_document=True, validate=engine.parse)
+    assert _entries(response_cache) == 0
+
+    # Extracting again asks the model again instead of replaying the broken answer
+    response = engine.ask(knowledge_base, query, document="document", whole_document=True, validate=engine.parse)
+    assert engine.parse(response)["docType"] == "True"
+    assert backend.calls == 2
+    assert _entries(response_cache) == 1
+
+
+def test_unparsable_cached_answer_is_dropped(tmp_path):
+    backend = StubLLMBackend()
+    engine, knowledge_base, response_cache = _engine(tmp_path, backend)
+    query = QUERIES['Resume']
+
+    # Cached without validation, like an entry written before the check existed
+    expected = engine.ask(knowledge_base, query, document="document", whole_document=True)
+    key = next(row[0] for row in response_cache.db.execute("SELECT key FROM responses"))
+    response_cache.put(key, "{'docType' 'True'}", "stub", "document")
+
+    response = engine.ask(knowledge_base, query, document="document", whole_document=True, validate=engine.parse)
+    assert response == expected
+    assert backend.calls == 2
+    assert response_cache.lookup(key) == response
+
+
+# The cache's clock, moved on by hand
+@pytest.fixture
+def clock(monkeypatch):
+    clock = types.SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(response_cache_module, "time", types.SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+def test_entries_expire_after_the_ttl(tmp_path, clock):
+    response_cache = ResponseCache(str(tmp_path / "responses.sqlite"), ttl=60)
+    response_cache.put("key", "answer", "stub")
+    clock.now += 59
+    assert response_cache.lookup("key") == "answer"
+    clock.now += 2
+    assert response_cache.lookup("key") is None
+    assert response_cache.stats == {"hits": 1, "misses": 1}
+    # Expired entries are deleted on the next put
+    response_cache.put("other", "answer", "stub")
+    assert _entries(response_cache) == 1
+
+
+def test_least_recently_used_past_max_entries_are_dropped(tmp_path, clock):
+    response_cache = ResponseCache(str(tmp_path / "responses.sqlite"), max_entries=2)
+    response_cache.put("a", "first", "stub")
+    clock.now += 1
+    response_cache.put("b", "second", "stub")
+    clock.now += 1
+    assert response_cache.lookup("a") == "first"
+    clock.now += 1
+    response_cache.put("c", "third", "stub")
+    assert _entries(response_cache) == 2
+    assert response_cache.lookup("b") is None
+    assert response_cache.lookup("a") == "first" and response_cache.lookup("c") == "third"
+
+
+# An embedding with a cosine similarity of at least 0.97 to a question asked about the same document,
+# with the same model, gets its answer
+def test_similar_question_lookup(tmp_path):
+    response_cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+    assert response_cache.similarity_threshold == 0.97
+    response_cache.put("what is the vessel?", "Nordic Star", "stub", "document", [1.0, 0.0])
+
+    assert response_cache.lookup("What is the vessel", "stub", "document", [0.98, (1 - 0.98 ** 2) ** 0.5]) == "Nordic Star"
+    assert response_cache.lookup("Who is the shipper?", "stub", "document", [0.96, (1 - 0.96 ** 2) ** 0.5]) is None
+    assert response_cache.lookup("What is the vessel", "stub", "other document", [1.0, 0.0]) is None
+    assert response_cache.lookup("What is the vessel", "gpt-4", "document", [1.0, 0.0]) is None
+    # Without an embedding only the exact key matches
+    assert response_cache.lookup("What is the vessel", "stub", "document") is None
+
+
+# use_cache=False asks the model even for a cached answer and leaves the cache as it was
+def test_use_cache_false_bypasses_the_cache(tmp_path):
+    backend = StubLLMBackend()
+    engine, knowledge_base, response_cache = _engine(tmp_path, backend)
+    query = "What is the shipper?"
+    first = engine.ask(knowledge_base, query, document="document")
+    key = next(row[0] for row in response_cache.db.execute("SELECT key FROM responses"))
+    response_cache.put(key, "cached answer", "stub", "document")
+
+    assert engine.ask(knowledge_base, query, document="document") == "cached answer"
+    assert engine.ask(knowledge_base, query, document="document", use_cache=False) == first
+    assert backend.calls == 2
+    assert response_cache.lookup(key) == "cached answer"
+    assert _entries(response_cache) == 1
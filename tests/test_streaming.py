@@ -0,0 +1,54 @@
+import pytest
+from prompts import QUERIES
+from streaming import IncrementalDictParser, parse_dict
+
+
+# The templates are the examples the model copies, every one of them must read back whole
+@pytest.mark.parametrize("doc_type", list(QUERIES))
+def test_templates_parse(doc_type):
+    data = parse_dict(QUERIES[doc_type])
+    assert list(data)[0] == "docType"
+    assert data["docType"].startswith("Answer with True or False")
+
+
+# Fed a character at a time, like a slow stream, the fields come out in order and add up to the whole parse
+@pytest.mark.parametrize("doc_type", list(QUERIES))
+def test_streamed_templates_match_whole_parse(doc_type):
+    parser = IncrementalDictParser()
+    fields = []
+    for char in QUERIES[doc_type]:
+        fields.extend(parser.feed(char))
+    fields.extend(parser.close())
+    assert fields == list(parse_dict(QUERIES[doc_type]).items())
+
+
+def test_fields_are_returned_once_complete():
+    parser = IncrementalDictParser()
+    assert parser.feed("Sure! {'name': 'Ana', 'skills': ['SQL', ") == [("name", "Ana")]
+    assert parser.feed("'Go'], 'age'") == [("skills", ["SQL", "Go"])]
+    assert parser.feed(": 3}") == [("age", 3)]
+
+
+def test_missing_colon_raises_value_error():
+    with pytest.raises(ValueError):
+        parse_dict("{'docType' 'True', 'name': 'Ana'}")
+
+
+def test_missing_comma_between_entries():
+    assert parse_dict("{'a': 'x'\n 'b': {'c': 1}\n 'd': [2]}") == {"a": "x", "b": {"c": 1}, "d": [2]}
+
+
+def test_comments_are_dropped():
+    assert parse_dict("{'a': [1, # more if relevant\n 2], 'b': '# not a comment'}") == {"a": [1, 2], "b": "# not a comment"}
+
+
+def test_cut_off_answer_keeps_the_complete_fields():
+    parser = IncrementalDictParser()
+    parser.feed("{'a': 1, 'b': 'unfinish")
+    parser.close()
+    assert parser.result() == {"a": 1}
+
+
+def test_answer_without_dictionary():
+    with pytest.raises(ValueError):
+        parse_dict("I can't read this document.")
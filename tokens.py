@@ -0,0 +1,22 @@
+import functools
+import tiktoken
+
+
+# tiktoken downloads its encodings on first use, without network access the count falls back
+# to the usual estimate of 4 characters per token
+@functools.lru_cache(maxsize=None)
+def _encoding(model):
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+def count_tokens(text, model="gpt-3.5-turbo"):
+    encoding = _encoding(model)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text))